@@ -0,0 +1,709 @@
+#!/usr/bin/env python3
+
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+from sqlalchemy import select, insert, func, and_
+from sqlalchemy.orm import Session
+
+from data_manager.orm import (
+    Base,
+    Project,
+    ProcessingStep,
+    System,
+    Result,
+    configure_session,
+)
+from data_manager.utils import (
+    get_ancestors,
+    get_descendants,
+    depends_on,
+    lookup_descendants,
+    rebuild_step_closure,
+    has_properties,
+    get_property_keys,
+    get_property_values,
+    get_properties,
+    PropertyKey,
+    property_compares,
+    compile_property_filter,
+    aggregate_results,
+    get_or_create_system,
+    get_or_create_systems,
+    get_or_create_project,
+    get_or_create_projects,
+    insert_collection_result,
+    get_collection_result,
+)
+
+from generators import (
+    create_projects,
+    create_step_chain,
+    create_step_dag,
+    create_steps_with_properties,
+    list_data,
+    matrix_data,
+)
+
+# All sessions of the benchmarks carry the ORM's flush hooks, like those obtained via open_database
+configure_session(Session)
+
+# Measurements of the current run, as written by --json
+_measurements: List[Dict[str, Any]] = []
+
+
+def record(benchmark: str, case: str, size: int, value: float, unit: str = "s") -> None:
+    """Adds a measurement to the machine-readable output. For all measurements, lower values are better."""
+    _measurements.append(
+        {
+            "benchmark": benchmark,
+            "case": case,
+            "size": size,
+            "value": value,
+            "unit": unit,
+        }
+    )
+
+
+def timed(function: Callable, repetitions: int = 3) -> float:
+    """Returns the best wall time (in seconds) out of the given amount of calls to function"""
+    best = float("inf")
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def lazy_ancestors(step: ProcessingStep) -> Set[int]:
+    """Reference implementation of get_ancestors that walks the preceding_steps relationship (one lazy load per
+    visited step)"""
+    visited: Set[int] = set()
+    pending: List[ProcessingStep] = [step]
+    while pending:
+        current = pending.pop()
+        for preceding in current.preceding_steps:
+            if preceding.id not in visited:
+                visited.add(preceding.id)
+                pending.append(preceding)
+
+    return visited
+
+
+def benchmark_provenance(sizes: List[int]) -> None:
+    print("Ancestors of the last step in a linear chain")
+    print(
+        "%10s %15s %15s %10s %20s"
+        % ("length", "lazy [s]", "CTE [s]", "speedup", "closure lookup [s]")
+    )
+
+    for size in sizes:
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            first_step, last_step = create_step_chain(session, size)
+            first_step_id, last_step_id = first_step.id, last_step.id
+            rebuild_step_closure(session)
+            session.commit()
+
+        def run_lazy():
+            # Use a fresh session in order to not benefit from already loaded relationships
+            with Session(engine) as session:
+                step = session.get(ProcessingStep, last_step_id)
+                assert step is not None
+                assert len(lazy_ancestors(step)) == size - 1
+
+        def run_cte():
+            with Session(engine) as session:
+                assert len(get_ancestors(session, last_step_id).steps) == size - 1
+
+        def run_closure():
+            with Session(engine) as session:
+                assert depends_on(session, last_step_id, first_step_id)
+
+        lazy = timed(run_lazy)
+        cte = timed(run_cte)
+        closure = timed(run_closure)
+
+        print(
+            "%10d %15.4f %15.4f %10.1f %20.6f" % (size, lazy, cte, lazy / cte, closure)
+        )
+        record("provenance", "lazy", size, lazy)
+        record("provenance", "cte", size, cte)
+        record("provenance", "closure_lookup", size, closure)
+
+        engine.dispose()
+
+
+def benchmark_property_filters(sizes: List[int]) -> None:
+    n_properties = 10
+    n_filters = 8
+
+    print(
+        "Selecting steps (with %d properties each) matching %d property values"
+        % (n_properties, n_filters)
+    )
+    print(
+        "%10s %20s %20s %10s"
+        % ("steps", "EXISTS per key [s]", "compiled filter [s]", "speedup")
+    )
+
+    values = {"property%d" % i: 1 for i in range(n_filters)}
+
+    filter = None
+    for key, value in values.items():
+        predicate = PropertyKey(key) == value
+        filter = predicate if filter is None else filter & predicate
+    assert filter is not None
+
+    for size in sizes:
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            create_steps_with_properties(session, size, n_properties)
+
+        def count(condition) -> int:
+            with Session(engine) as session:
+                return session.scalars(
+                    select(func.count()).select_from(ProcessingStep).where(condition)
+                ).one()
+
+        # One correlated EXISTS subquery per key
+        exists_condition = and_(
+            *[
+                property_compares(ProcessingStep, key, "==", value)
+                for key, value in values.items()
+            ]
+        )
+
+        expected = count(exists_condition)
+        assert count(compile_property_filter(ProcessingStep, filter)) == expected
+
+        exists = timed(lambda: count(exists_condition))
+        compiled = timed(lambda: count(compile_property_filter(ProcessingStep, filter)))
+
+        print("%10d %20.4f %20.4f %10.1f" % (size, exists, compiled, exists / compiled))
+        record("property_filters", "exists_per_key", size, exists)
+        record("property_filters", "compiled_filter", size, compiled)
+
+        engine.dispose()
+
+
+def benchmark_aggregates(sizes: List[int]) -> None:
+    n_systems = 10
+
+    print("Lowest energy per system (%d systems)" % n_systems)
+    print("%10s %15s %15s %10s" % ("results", "Python [s]", "SQL [s]", "speedup"))
+
+    for size in sizes:
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            project = Project(name="Aggregates")
+            systems = [System(name="System %d" % i) for i in range(n_systems)]
+            session.add_all([project] + systems)
+            session.flush()
+
+            session.execute(
+                insert(ProcessingStep),
+                [
+                    {
+                        "kind": "SP",
+                        "project_id": project.id,
+                        "system_id": systems[i % n_systems].id,
+                    }
+                    for i in range(size)
+                ],
+            )
+            session.execute(
+                insert(Result),
+                [
+                    dict(
+                        kind="Energy",
+                        processing_step_id=step_id,
+                        **Result.encode_data(-step_id / 7)
+                    )
+                    for step_id in session.scalars(select(ProcessingStep.id)).all()
+                ],
+            )
+            session.commit()
+
+        def run_python():
+            with Session(engine) as session:
+                lowest: Dict[int, float] = {}
+                for result in session.scalars(
+                    select(Result).where(Result.kind == "Energy")
+                ):
+                    system_id = result.processing_step.system_id
+                    energy = result.data
+                    assert isinstance(energy, float)
+                    lowest[system_id] = min(lowest.get(system_id, float("inf")), energy)
+                return lowest
+
+        def run_sql():
+            with Session(engine) as session:
+                return aggregate_results(session, "Energy", "min", group_by="system")
+
+        assert run_python() == run_sql()
+
+        python = timed(run_python)
+        sql = timed(run_sql)
+
+        print("%10d %15.4f %15.4f %10.1f" % (size, python, sql, python / sql))
+        record("aggregates", "python", size, python)
+        record("aggregates", "sql", size, sql)
+
+        engine.dispose()
+
+
+def benchmark_get_or_create(sizes: List[int]) -> None:
+    print("Resolving systems (half of which already exist)")
+    print("%10s %15s %15s %10s" % ("systems", "single [s]", "bulk [s]", "speedup"))
+
+    for size in sizes:
+        names = ["System %d" % i for i in range(size)]
+
+        def prepare():
+            engine = sqlalchemy.create_engine("sqlite:///:memory:")
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                session.add_all([System(name=name) for name in names[::2]])
+                session.commit()
+            return engine
+
+        def run_single():
+            engine = prepare()
+            with Session(engine) as session:
+                start = time.perf_counter()
+                for name in names:
+                    get_or_create_system(session, name)
+                session.commit()
+                duration = time.perf_counter() - start
+            engine.dispose()
+            return duration
+
+        def run_bulk():
+            engine = prepare()
+            with Session(engine) as session:
+                start = time.perf_counter()
+                get_or_create_systems(session, names)
+                session.commit()
+                duration = time.perf_counter() - start
+            engine.dispose()
+            return duration
+
+        single = min(run_single() for _ in range(3))
+        bulk = min(run_bulk() for _ in range(3))
+
+        print("%10d %15.4f %15.4f %10.1f" % (size, single, bulk, single / bulk))
+        record("get_or_create", "single", size, single)
+        record("get_or_create", "bulk", size, bulk)
+
+
+def benchmark_storage(sizes: List[int]) -> None:
+    print("Size of a database holding a single Matrix result (bulk insert)")
+    print("%10s %15s %20s" % ("elements", "file size [kB]", "bytes per element"))
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "storage.sqlite")
+            engine = sqlalchemy.create_engine("sqlite:///%s" % path)
+            Base.metadata.create_all(engine)
+
+            n_columns = 10
+            data = matrix_data(size, n_columns)
+
+            with Session(engine) as session:
+                step = ProcessingStep(kind="Storage", project=Project(name="Storage"))
+                insert_collection_result(session, "Matrix", step, data, bulk=True)
+                session.commit()
+
+            with engine.connect() as connection:
+                connection.exec_driver_sql("VACUUM")
+            engine.dispose()
+
+            file_size = os.path.getsize(path)
+            n_elements = len(data) * n_columns
+
+            print(
+                "%10d %15.1f %20.1f"
+                % (n_elements, file_size / 1024, file_size / n_elements)
+            )
+            record(
+                "storage", "bytes_per_element", size, file_size / n_elements, "bytes"
+            )
+
+
+def benchmark_projects(sizes: List[int]) -> None:
+    print("Resolving projects (half of which already exist)")
+    print("%10s %15s %15s %10s" % ("projects", "single [s]", "bulk [s]", "speedup"))
+
+    for size in sizes:
+        names = ["Project %d" % i for i in range(size)]
+
+        def run(resolve: Callable[[Session], Any]) -> float:
+            engine = sqlalchemy.create_engine("sqlite:///:memory:")
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                create_projects(session, size // 2)
+
+                start = time.perf_counter()
+                resolve(session)
+                session.commit()
+                duration = time.perf_counter() - start
+            engine.dispose()
+            return duration
+
+        single = min(
+            run(
+                lambda session: [get_or_create_project(session, name) for name in names]
+            )
+            for _ in range(3)
+        )
+        bulk = min(
+            run(lambda session: get_or_create_projects(session, names))
+            for _ in range(3)
+        )
+
+        print("%10d %15.4f %15.4f %10.1f" % (size, single, bulk, single / bulk))
+        record("projects", "single", size, single)
+        record("projects", "bulk", size, bulk)
+
+
+def benchmark_collections(sizes: List[int]) -> None:
+    print("Storing and retrieving a Matrix (10 columns) and a List of random floats")
+    print(
+        "%10s %15s %15s %15s %15s %15s"
+        % (
+            "elements",
+            "insert [s]",
+            "bulk insert [s]",
+            "get [s]",
+            "get array [s]",
+            "get List [s]",
+        )
+    )
+
+    for size in sizes:
+        matrix = matrix_data(size)
+        vector = list_data(size)
+
+        def insert_matrix(bulk: bool) -> float:
+            engine = sqlalchemy.create_engine("sqlite:///:memory:")
+            Base.metadata.create_all(engine)
+            with Session(engine) as session:
+                step = ProcessingStep(kind="Storage", project=Project(name="Storage"))
+                session.add(step)
+                session.flush()
+
+                start = time.perf_counter()
+                insert_collection_result(session, "Matrix", step, matrix, bulk=bulk)
+                session.commit()
+                duration = time.perf_counter() - start
+            engine.dispose()
+            return duration
+
+        # Creating one ORM object per element is too slow (and memory hungry) for the largest sizes
+        orm_insert = (
+            min(insert_matrix(False) for _ in range(3)) if size <= 10**5 else None
+        )
+        bulk_insert = min(insert_matrix(True) for _ in range(3))
+
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            step = ProcessingStep(kind="Storage", project=Project(name="Storage"))
+            insert_collection_result(session, "Matrix", step, matrix, bulk=True)
+            insert_collection_result(session, "List", step, vector, bulk=True)
+            session.commit()
+            step_id = step.id
+
+        def get(kind: str, as_array: bool = False):
+            with Session(engine) as session:
+                step = session.get(ProcessingStep, step_id)
+                assert step is not None
+                return get_collection_result(session, kind, step, as_array=as_array)
+
+        assert get("Matrix") == matrix
+
+        get_list = timed(lambda: get("Matrix"))
+        get_array = timed(lambda: get("Matrix", as_array=True))
+        get_vector = timed(lambda: get("List"))
+        engine.dispose()
+
+        print(
+            "%10d %15s %15.4f %15.4f %15.4f %15.4f"
+            % (
+                size,
+                "%.4f" % orm_insert if orm_insert is not None else "-",
+                bulk_insert,
+                get_list,
+                get_array,
+                get_vector,
+            )
+        )
+        if orm_insert is not None:
+            record("collections", "insert", size, orm_insert)
+        record("collections", "bulk_insert", size, bulk_insert)
+        record("collections", "get_matrix", size, get_list)
+        record("collections", "get_matrix_array", size, get_array)
+        record("collections", "get_list", size, get_vector)
+
+
+def benchmark_property_queries(sizes: List[int]) -> None:
+    n_properties = 10
+
+    print("Querying properties of steps (with %d properties each)" % n_properties)
+    print(
+        "%10s %20s %20s %20s %20s"
+        % (
+            "steps",
+            "has_properties [s]",
+            "property keys [s]",
+            "property values [s]",
+            "all properties [s]",
+        )
+    )
+
+    for size in sizes:
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            create_steps_with_properties(session, size, n_properties)
+
+        def count_matching() -> int:
+            with Session(engine) as session:
+                return session.scalars(
+                    select(func.count())
+                    .select_from(ProcessingStep)
+                    .where(has_properties(ProcessingStep, property0=0, property1=1))
+                ).one()
+
+        def keys():
+            with Session(engine) as session:
+                assert len(get_property_keys(session, ProcessingStep)) == n_properties
+
+        def values():
+            with Session(engine) as session:
+                get_property_values(
+                    session, ProcessingStep, "property%d" % (n_properties - 1)
+                )
+
+        def fetch_all():
+            with Session(engine) as session:
+                get_properties(session, ProcessingStep, select(ProcessingStep.id))
+
+        exists = timed(count_matching)
+        key_lookup = timed(keys)
+        value_lookup = timed(values)
+        bulk_fetch = timed(fetch_all)
+
+        print(
+            "%10d %20.4f %20.4f %20.4f %20.4f"
+            % (size, exists, key_lookup, value_lookup, bulk_fetch)
+        )
+        record("property_queries", "has_properties", size, exists)
+        record("property_queries", "get_property_keys", size, key_lookup)
+        record("property_queries", "get_property_values", size, value_lookup)
+        record("property_queries", "get_properties", size, bulk_fetch)
+
+        engine.dispose()
+
+
+def benchmark_dag(sizes: List[int]) -> None:
+    depth = 100
+
+    print("Traversing a layered DAG (%d layers, up to 3 parents per step)" % depth)
+    print(
+        "%10s %15s %15s %20s"
+        % ("steps", "ancestors [s]", "descendants [s]", "closure lookup [s]")
+    )
+
+    for size in sizes:
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+
+        # The transitive closure of such a DAG grows quadratically with its size
+        with_closure = size <= 10**3
+
+        with Session(engine) as session:
+            first_layer, last_layer = create_step_dag(
+                session, size, max(size // depth, 1)
+            )
+            if with_closure:
+                rebuild_step_closure(session)
+                session.commit()
+
+        def ancestors():
+            with Session(engine) as session:
+                get_ancestors(session, last_layer[0])
+
+        def descendants():
+            with Session(engine) as session:
+                get_descendants(session, first_layer[0])
+
+        def closure():
+            with Session(engine) as session:
+                lookup_descendants(session, first_layer[0])
+
+        ancestor_time = timed(ancestors)
+        descendant_time = timed(descendants)
+        closure_time = timed(closure) if with_closure else None
+
+        print(
+            "%10d %15.4f %15.4f %20s"
+            % (
+                size,
+                ancestor_time,
+                descendant_time,
+                "%.4f" % closure_time if closure_time is not None else "-",
+            )
+        )
+        record("dag", "ancestors", size, ancestor_time)
+        record("dag", "descendants", size, descendant_time)
+        if closure_time is not None:
+            record("dag", "closure_lookup", size, closure_time)
+
+        engine.dispose()
+
+
+BENCHMARKS: Dict[str, Callable[[List[int]], None]] = {
+    "provenance": benchmark_provenance,
+    "property_filters": benchmark_property_filters,
+    "aggregates": benchmark_aggregates,
+    "get_or_create": benchmark_get_or_create,
+    "storage": benchmark_storage,
+    "projects": benchmark_projects,
+    "collections": benchmark_collections,
+    "property_queries": benchmark_property_queries,
+    "dag": benchmark_dag,
+}
+
+
+def run_metadata() -> Dict[str, Any]:
+    """Describes the environment of the current run"""
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare_to_baseline(
+    baseline: Dict[str, Any], tolerance: float
+) -> List[Dict[str, Any]]:
+    """Prints the change of every measurement of the current run with respect to the matching measurement (same
+    benchmark, case and size) of the given baseline and returns the measurements that got worse by more than the
+    given (relative) tolerance"""
+    reference = {
+        (current["benchmark"], current["case"], current["size"]): current["value"]
+        for current in baseline["measurements"]
+    }
+
+    print("Comparison to baseline from %s" % baseline["metadata"].get("date", "?"))
+    print(
+        "%20s %20s %10s %15s %15s %10s"
+        % ("benchmark", "case", "size", "baseline", "current", "change")
+    )
+
+    regressions = []
+    for current in _measurements:
+        key = (current["benchmark"], current["case"], current["size"])
+        if key not in reference:
+            continue
+
+        previous = reference[key]
+        change = current["value"] / previous - 1 if previous > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(current)
+            flag = " REGRESSION"
+
+        print(
+            "%20s %20s %10d %15.4g %15.4g %+9.1f%%%s"
+            % (*key, previous, current["value"], 100 * change, flag)
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for performance-critical parts of data-manager"
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="The benchmarks to run (default: all). Available: "
+        + ", ".join(BENCHMARKS),
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="The problem sizes to run the benchmarks for",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Write all measurements (and a description of the environment) to the given JSON file",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        help="Compare the measurements against those of the given JSON file (as written by --json). The exit "
+        "status is 1 if any measurement regressed by more than the tolerance",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative slowdown that is still accepted when comparing against a baseline (default: 0.25)",
+    )
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark '%s'" % name)
+
+    baseline: Optional[Dict[str, Any]] = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    for name in args.benchmarks or list(BENCHMARKS):
+        BENCHMARKS[name](args.sizes)
+        print()
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(
+                {"metadata": run_metadata(), "measurements": _measurements},
+                file,
+                indent=2,
+            )
+
+    if baseline is not None and len(compare_to_baseline(baseline, args.tolerance)) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+from typing import List, Tuple
+
+import random
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from data_manager.orm import (
+    Project,
+    ProcessingStep,
+    ProcessingStepProperty,
+    PropertyString,
+    System,
+)
+from data_manager.orm.ProcessingStep import step_hierarchy
+
+# Generators of synthetic data for the benchmarks. All generators are deterministic (random choices are made with a
+# seeded generator), such that repeated runs operate on identical data.
+
+# Upper bound for the number of rows per executemany INSERT, which keeps the memory consumption of the generators
+# bounded for large sizes
+_BATCH_SIZE = 100000
+
+
+def create_projects(session: Session, count: int) -> List[int]:
+    """Creates count projects (named "Project <i>") and returns their IDs"""
+    for offset in range(0, count, _BATCH_SIZE):
+        session.execute(
+            insert(Project),
+            [
+                {"name": "Project %d" % i}
+                for i in range(offset, min(offset + _BATCH_SIZE, count))
+            ],
+        )
+    session.commit()
+
+    return list(session.scalars(select(Project.id).order_by(Project.id)))
+
+
+def create_systems(session: Session, count: int) -> List[int]:
+    """Creates count systems (named "System <i>") and returns their IDs"""
+    for offset in range(0, count, _BATCH_SIZE):
+        session.execute(
+            insert(System),
+            [
+                {"name": "System %d" % i}
+                for i in range(offset, min(offset + _BATCH_SIZE, count))
+            ],
+        )
+    session.commit()
+
+    return list(session.scalars(select(System.id).order_by(System.id)))
+
+
+def _insert_steps(session: Session, project_id: int, count: int) -> List[int]:
+    first_id = (
+        session.scalar(select(ProcessingStep.id).order_by(ProcessingStep.id.desc()))
+        or 0
+    ) + 1
+
+    for offset in range(0, count, _BATCH_SIZE):
+        session.execute(
+            insert(ProcessingStep),
+            [
+                {"id": first_id + i, "kind": "Step", "project_id": project_id}
+                for i in range(offset, min(offset + _BATCH_SIZE, count))
+            ],
+        )
+
+    return list(range(first_id, first_id + count))
+
+
+def create_step_chain(
+    session: Session, length: int
+) -> Tuple[ProcessingStep, ProcessingStep]:
+    """Creates a linear chain of the given length where every step depends on its predecessor and returns the
+    first and the last step of that chain"""
+    project = Project(name="Chain")
+    first = ProcessingStep(kind="Preparation", project=project)
+    previous = first
+    for _ in range(length - 1):
+        previous = ProcessingStep(
+            kind="Preparation", project=project, preceding_steps={previous}
+        )
+
+    session.add(project)
+    session.commit()
+
+    return first, previous
+
+
+def create_step_dag(
+    session: Session, n_steps: int, width: int, max_parents: int = 3, seed: int = 0
+) -> Tuple[List[int], List[int]]:
+    """Creates a layered DAG of n_steps steps with (at most) width steps per layer, where every step outside of the
+    first layer depends on 1 to max_parents random steps of the previous layer. The depth of the DAG thus is
+    n_steps / width. Returns the IDs of the steps in the first and in the last layer."""
+    generator = random.Random(seed)
+
+    project = Project(name="DAG")
+    session.add(project)
+    session.flush()
+
+    step_ids = _insert_steps(session, project.id, n_steps)
+    layers = [step_ids[offset : offset + width] for offset in range(0, n_steps, width)]
+
+    edges = []
+    for previous, layer in zip(layers, layers[1:]):
+        for step_id in layer:
+            for parent_id in generator.sample(
+                previous, generator.randint(1, min(max_parents, len(previous)))
+            ):
+                edges.append(
+                    {"preceding_step_id": parent_id, "dependent_step_id": step_id}
+                )
+
+            if len(edges) >= _BATCH_SIZE:
+                session.execute(insert(step_hierarchy), edges)
+                edges = []
+
+    if len(edges) > 0:
+        session.execute(insert(step_hierarchy), edges)
+
+    session.commit()
+
+    return layers[0], layers[-1]
+
+
+def create_steps_with_properties(
+    session: Session, count: int, n_properties: int
+) -> None:
+    """Creates count steps with n_properties properties each, where property i of step j has the value j % (i + 2)"""
+    project = Project(name="Properties")
+    session.add(project)
+    session.flush()
+
+    step_ids = _insert_steps(session, project.id, count)
+    keyword_ids = PropertyString.ids(
+        session.connection(), ["property%d" % i for i in range(n_properties)]
+    )
+
+    table = ProcessingStepProperty.metadata.tables[ProcessingStepProperty.__tablename__]
+    rows = []
+    for step_id in step_ids:
+        for i in range(n_properties):
+            rows.append(
+                {
+                    "step_id": step_id,
+                    "keyword_id": keyword_ids["property%d" % i],
+                    "value": str(step_id % (i + 2)),
+                    "value_type": "int",
+                    "numeric_value": step_id % (i + 2),
+                }
+            )
+
+        if len(rows) >= _BATCH_SIZE:
+            session.execute(insert(table), rows)
+            rows = []
+
+    if len(rows) > 0:
+        session.execute(insert(table), rows)
+
+    session.commit()
+
+
+def list_data(n_elements: int, seed: int = 0) -> List[float]:
+    """Returns a List of n_elements random floats"""
+    generator = random.Random(seed)
+    return [generator.random() for _ in range(n_elements)]
+
+
+def matrix_data(
+    n_elements: int, n_columns: int = 10, seed: int = 0
+) -> List[List[float]]:
+    """Returns a Matrix of (about) n_elements random floats with n_columns columns"""
+    generator = random.Random(seed)
+    return [
+        [generator.random() for _ in range(n_columns)]
+        for _ in range(max(n_elements // n_columns, 1))
+    ]
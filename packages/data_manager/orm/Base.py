@@ -1,5 +1,74 @@
-from sqlalchemy.orm import DeclarativeBase
+from typing import Optional, TYPE_CHECKING
+
+import math
+
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, validates
 
 
 class Base(DeclarativeBase):
     pass
+
+
+# Table options shared by all *Property tables: their rows are stored WITHOUT ROWID, i.e. directly in the B-tree of
+# their (owner ID, keyword ID) primary key. This keeps all properties of an object next to each other, such that
+# fetching them is a single range scan, and avoids a separate rowid B-tree. Secondary indexes such as
+# (keyword_id, value) then reference rows by their primary key instead of a rowid.
+PROPERTY_TABLE_OPTIONS = {"sqlite_with_rowid": False}
+
+
+class TypedPropertyValue:
+    """Mixin for the *Property classes. Values are always stored as strings, but additionally the type of the
+    originally assigned value is recorded and a numeric shadow column is filled for all values that represent a
+    number (including strings such as "3" or "1e-5"), which allows range queries on properties to be done in SQL.
+    Hence, values of any type can be assigned (e.g. via the properties of the owning object), but they are read
+    back as strings (see typed_value for the original type).
+    """
+
+    value_type: Mapped[str] = mapped_column(default="str", server_default="str")
+    numeric_value: Mapped[Optional[float]]
+
+    if TYPE_CHECKING:
+        # Mapped by every class using this mixin
+        value: Mapped[str]
+
+    @validates("value")
+    def _record_value_type(self, key, value):
+        if isinstance(value, bool):
+            self.value_type = "bool"
+            self.numeric_value = float(value)
+        elif isinstance(value, (int, float)):
+            self.value_type = "int" if isinstance(value, int) else "float"
+            self.numeric_value = TypedPropertyValue.to_numeric(value)
+        else:
+            self.value_type = "str"
+            self.numeric_value = TypedPropertyValue.to_numeric(value)
+
+        return str(value)
+
+    @staticmethod
+    def to_numeric(value) -> Optional[float]:
+        """Converts the given value into the representation used for the numeric shadow column (None if the value
+        doesn't represent a finite number)"""
+        try:
+            numeric = float(value)
+        except (TypeError, ValueError):
+            return None
+
+        return numeric if math.isfinite(numeric) else None
+
+    @staticmethod
+    def convert(value: str, value_type: str):
+        """Converts the given (stored) value back to the type recorded in value_type"""
+        if value_type == "int":
+            return int(value)
+        elif value_type == "float":
+            return float(value)
+        elif value_type == "bool":
+            return value == "True"
+        else:
+            return value
+
+    @property
+    def typed_value(self):
+        """The property's value converted back to the type it had when it was assigned"""
+        return TypedPropertyValue.convert(self.value, self.value_type)
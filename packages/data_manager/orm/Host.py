@@ -1,16 +1,18 @@
-from .Base import Base
+from .Base import Base, TypedPropertyValue, PROPERTY_TABLE_OPTIONS
+from .PropertyString import PropertyString, interned_string
 
-from typing import Dict
+from typing import Any, Dict
 
 from datetime import datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship, attribute_keyed_dict
-from sqlalchemy import ForeignKey, func
+from sqlalchemy import ForeignKey, Index, func
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
 
 class Host(Base):
     __tablename__ = "hosts"
+    __table_args__ = (Index("ix_hosts_name", "name"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str]
@@ -20,18 +22,31 @@ class Host(Base):
         collection_class=attribute_keyed_dict("keyword"), passive_deletes=True
     )
 
-    properties: AssociationProxy[Dict[str, str]] = association_proxy(
+    properties: AssociationProxy[Dict[str, Any]] = association_proxy(
         target_collection="_properties",
         attr="value",
         creator=lambda k, v: HostProperty(keyword=k, value=v),
     )
 
 
-class HostProperty(Base):
+class HostProperty(TypedPropertyValue, Base):
     __tablename__ = "host_properties"
+    __table_args__ = (
+        Index("ix_host_properties_keyword_value", "keyword_id", "value"),
+        Index(
+            "ix_host_properties_keyword_numeric_value", "keyword_id", "numeric_value"
+        ),
+        PROPERTY_TABLE_OPTIONS,
+    )
 
     host_id: Mapped[int] = mapped_column(
         ForeignKey(Host.id, onupdate="CASCADE", ondelete="CASCADE"), primary_key=True
     )
-    keyword: Mapped[str] = mapped_column(primary_key=True)
+    _keyword_id: Mapped[int] = mapped_column(
+        "keyword_id", ForeignKey(PropertyString.id), primary_key=True
+    )
+    _keyword: Mapped[PropertyString] = relationship(
+        viewonly=True, lazy="joined", innerjoin=True
+    )
+    keyword = interned_string("_keyword_id", "_keyword")
     value: Mapped[str]
@@ -1,13 +1,14 @@
-from .Base import Base
+from .Base import Base, TypedPropertyValue, PROPERTY_TABLE_OPTIONS
+from .PropertyString import PropertyString, interned_string
 from .Host import Host
 from .Result import Result
 from .System import System
 from .Project import Project
 
-from typing import Optional, Set, List, Dict
+from typing import Any, Optional, Set, List, Dict
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship, attribute_keyed_dict
-from sqlalchemy import ForeignKey, Table, Column, Integer, CheckConstraint
+from sqlalchemy import ForeignKey, Table, Column, Integer, CheckConstraint, Index
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
 step_hierarchy = Table(
@@ -28,6 +29,30 @@ step_hierarchy = Table(
     CheckConstraint(
         "preceding_step_id != dependent_step_id", name="check_no_self_dependence"
     ),
+    # The primary key only covers lookups by preceding_step_id
+    Index("ix_processing_step_hierarchy_dependent", "dependent_step_id"),
+)
+
+# Transitive closure of step_hierarchy: one row for every pair of steps where descendant (directly or indirectly)
+# depends on ancestor, with depth being the length of the shortest path between them. This table is only kept up
+# to date if enabled via data_manager.utils.maintain_step_closure
+step_closure = Table(
+    "processing_step_closure",
+    Base.metadata,
+    Column(
+        "ancestor_id",
+        Integer,
+        ForeignKey("processing_steps.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "descendant_id",
+        Integer,
+        ForeignKey("processing_steps.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column("depth", Integer, nullable=False),
+    Index("ix_processing_step_closure_descendant", "descendant_id", "ancestor_id"),
 )
 
 keyword_step_association = Table(
@@ -50,6 +75,7 @@ keyword_step_association = Table(
 
 class ProcessingStep(Base):
     __tablename__ = "processing_steps"
+    __table_args__ = (Index("ix_processing_steps_output_digest", "output_digest"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     kind: Mapped[str]
@@ -63,6 +89,8 @@ class ProcessingStep(Base):
         ForeignKey(Project.id, ondelete="CASCADE", onupdate="CASCADE")
     )
     output_path: Mapped[Optional[str]]
+    # SHA-256 digest of the step's output in a BlobStore (see data_manager.utils.BlobStore.add_file)
+    output_digest: Mapped[Optional[str]]
 
     host: Mapped[Optional[Host]] = relationship(passive_deletes=True)
     system: Mapped[Optional[System]] = relationship(passive_deletes=True)
@@ -93,7 +121,7 @@ class ProcessingStep(Base):
         collection_class=attribute_keyed_dict("keyword"), passive_deletes=True
     )
 
-    properties: AssociationProxy[Dict[str, str]] = association_proxy(
+    properties: AssociationProxy[Dict[str, Any]] = association_proxy(
         target_collection="_properties",
         attr="value",
         creator=lambda k, v: ProcessingStepProperty(keyword=k, value=v),
@@ -106,14 +134,29 @@ class ProcessingStep(Base):
     )
 
 
-class ProcessingStepProperty(Base):
+class ProcessingStepProperty(TypedPropertyValue, Base):
     __tablename__ = "processing_step_properties"
+    __table_args__ = (
+        Index("ix_processing_step_properties_keyword_value", "keyword_id", "value"),
+        Index(
+            "ix_processing_step_properties_keyword_numeric_value",
+            "keyword_id",
+            "numeric_value",
+        ),
+        PROPERTY_TABLE_OPTIONS,
+    )
 
     step_id: Mapped[int] = mapped_column(
         ForeignKey(ProcessingStep.id, onupdate="CASCADE", ondelete="CASCADE"),
         primary_key=True,
     )
-    keyword: Mapped[str] = mapped_column(primary_key=True)
+    _keyword_id: Mapped[int] = mapped_column(
+        "keyword_id", ForeignKey(PropertyString.id), primary_key=True
+    )
+    _keyword: Mapped[PropertyString] = relationship(
+        viewonly=True, lazy="joined", innerjoin=True
+    )
+    keyword = interned_string("_keyword_id", "_keyword")
     value: Mapped[str]
 
 
@@ -3,7 +3,7 @@ from .Base import Base
 from typing import Optional, Set
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Table, Column, Integer, ForeignKey
+from sqlalchemy import Table, Column, Integer, ForeignKey, Index
 
 
 project_author_association = Table(
@@ -26,6 +26,7 @@ project_author_association = Table(
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (Index("ix_projects_name", "name"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str]
@@ -44,6 +45,7 @@ class Project(Base):
 
 class Author(Base):
     __tablename__ = "authors"
+    __table_args__ = (Index("ix_authors_name_affiliation", "name", "affiliation"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str]
@@ -0,0 +1,201 @@
+from .Base import Base
+
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Type
+
+import functools
+
+from sqlalchemy.orm import Mapped, mapped_column, Session, object_session
+from sqlalchemy import Connection, select, event, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property, Comparator
+
+
+class PropertyString(Base):
+    """Dictionary of the strings used as property keywords. Instead of repeating the keyword in every single
+    property row, the property tables only reference the keyword's entry in this table. The *Property classes
+    expose the keyword as a regular string attribute (see interned_string)."""
+
+    __tablename__ = "property_strings"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    string: Mapped[str] = mapped_column(unique=True)
+
+    # Upper bound for the number of strings per IN query, which keeps us below SQLite's limit on the number of
+    # variables in a single statement
+    _BATCH_SIZE = 500
+
+    @staticmethod
+    def ids(connection: Connection, strings: Iterable[str]) -> Dict[str, int]:
+        """Returns the IDs of the given strings, adding those to the dictionary that are not part of it yet"""
+        table = PropertyString.metadata.tables[PropertyString.__tablename__]
+        pending = list(set(strings))
+
+        ids: Dict[str, int] = {}
+
+        for offset in range(0, len(pending), PropertyString._BATCH_SIZE):
+            batch = pending[offset : offset + PropertyString._BATCH_SIZE]
+
+            query = select(table.c.string, table.c.id).where(table.c.string.in_(batch))
+            ids.update({string: id for string, id in connection.execute(query)})
+
+            missing = [string for string in batch if string not in ids]
+            if len(missing) > 0:
+                # Concurrent writers might add the same strings, which is resolved via the unique constraint
+                connection.execute(
+                    sqlite_insert(table).on_conflict_do_nothing(
+                        index_elements=["string"]
+                    ),
+                    [{"string": string} for string in missing],
+                )
+                ids.update(
+                    {
+                        string: id
+                        for string, id in connection.execute(
+                            select(table.c.string, table.c.id).where(
+                                table.c.string.in_(missing)
+                            )
+                        )
+                    }
+                )
+
+        return ids
+
+
+class InternedStringComparator(Comparator[str]):
+    """Comparator of interned strings. Comparisons with plain strings are done on the level of string IDs (which
+    allows using indexes on the ID column) whereas selecting the attribute yields the string itself.
+    """
+
+    def __init__(self, cls, id_attribute: str):
+        self.id_attribute = id_attribute
+        self.id_column = id_column = getattr(cls, id_attribute)
+        super().__init__(
+            select(PropertyString.string)
+            .where(PropertyString.id == id_column)
+            .scalar_subquery()
+        )
+
+    def adapt_to_entity(self, adapt_to_entity):
+        # Make sure that comparisons on aliased classes refer to the alias' ID column
+        return InternedStringComparator(adapt_to_entity.entity, self.id_attribute)
+
+    @staticmethod
+    def _string_id(string: str):
+        return (
+            select(PropertyString.id)
+            .where(PropertyString.string == string)
+            .scalar_subquery()
+        )
+
+    def __eq__(self, other):  # type: ignore[override]
+        if isinstance(other, str):
+            return self.id_column == self._string_id(other)
+        return self.expression == other
+
+    def __ne__(self, other):  # type: ignore[override]
+        if isinstance(other, str):
+            return self.id_column != self._string_id(other)
+        return self.expression != other
+
+    def in_(self, other):
+        return self.id_column.in_(
+            select(PropertyString.id).where(PropertyString.string.in_(other))
+        )
+
+    def operate(self, op, *other, **kwargs):
+        return op(self.expression, *other, **kwargs)
+
+
+class InternedString(NamedTuple):
+    name: str
+    id_attribute: str
+    pending_attribute: str
+
+
+# (id_attribute, pending_attribute) of all attributes created via interned_string
+_INTERNED_STRING_ATTRIBUTES: Dict[hybrid_property, Tuple[str, str]] = {}
+
+
+def interned_string(id_attribute: str, relationship_attribute: str) -> hybrid_property:
+    """Creates a string attribute that is stored as a reference (id_attribute) into PropertyString. The string of
+    persistent objects is obtained via relationship_attribute (a relationship to PropertyString). Strings assigned to
+    new objects are resolved into IDs when the objects are flushed: in one go for all new objects of sessions that
+    have been set up via configure_session and one by one (right before inserting every object) otherwise.
+    """
+    pending_attribute = relationship_attribute + "_pending"
+
+    def get_string(self) -> str:
+        pending = self.__dict__.get(pending_attribute)
+        if pending is not None:
+            return pending
+
+        return getattr(self, relationship_attribute).string
+
+    def set_string(self, value: str) -> None:
+        self.__dict__[pending_attribute] = value
+
+        session = object_session(self)
+        if session is not None and inspect(self).has_identity:
+            # The object won't show up in session.new, so the ID has to be resolved right away
+            setattr(
+                self,
+                id_attribute,
+                PropertyString.ids(session.connection(), [value])[value],
+            )
+
+    attribute = hybrid_property(get_string, set_string).comparator(
+        lambda cls: InternedStringComparator(cls, id_attribute)
+    )
+    _INTERNED_STRING_ATTRIBUTES[attribute] = (id_attribute, pending_attribute)
+
+    return attribute
+
+
+@functools.lru_cache(maxsize=None)
+def interned_strings(cls: Type) -> List[InternedString]:
+    """Returns all attributes of the given class that have been created via interned_string"""
+    return [
+        InternedString(name, *_INTERNED_STRING_ATTRIBUTES[value])
+        for klass in cls.__mro__
+        for name, value in vars(klass).items()
+        if isinstance(value, hybrid_property) and value in _INTERNED_STRING_ATTRIBUTES
+    ]
+
+
+def resolve_interned_strings(session: Session, flush_context, instances) -> None:
+    """before_flush hook (see configure_session) resolving the interned strings of all new objects at once"""
+    pending = [
+        (object, attribute)
+        for object in session.new
+        for attribute in interned_strings(type(object))
+        if getattr(object, attribute.id_attribute) is None
+    ]
+
+    if len(pending) == 0:
+        return
+
+    ids = PropertyString.ids(
+        session.connection(),
+        {object.__dict__[attribute.pending_attribute] for object, attribute in pending},
+    )
+
+    for object, attribute in pending:
+        setattr(
+            object,
+            attribute.id_attribute,
+            ids[object.__dict__[attribute.pending_attribute]],
+        )
+
+
+@event.listens_for(Base, "before_insert", propagate=True)
+def _resolve_interned_strings_of_object(mapper, connection, target) -> None:
+    # Fallback for sessions without the resolve_interned_strings hook, which resolves the strings of one object at
+    # a time
+    for attribute in interned_strings(type(target)):
+        if getattr(target, attribute.id_attribute) is None:
+            string = target.__dict__[attribute.pending_attribute]
+            setattr(
+                target,
+                attribute.id_attribute,
+                PropertyString.ids(connection, [string])[string],
+            )
@@ -1,14 +1,83 @@
-from .Base import Base
+from .Base import Base, TypedPropertyValue, PROPERTY_TABLE_OPTIONS
+from .PropertyString import PropertyString, interned_string
+from .ResultChunk import (
+    ResultChunk,
+    ChunkedArrayHeader,
+    chunked_storage,
+    _CHUNKED_KINDS,
+)
 
-from typing import Dict
+from typing import Dict, Any, List, Optional, Tuple
 
-from sqlalchemy.orm import Mapped, mapped_column, relationship, attribute_keyed_dict
-from sqlalchemy import ForeignKey
+import itertools
+import math
+
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+    relationship,
+    attribute_keyed_dict,
+    Session,
+)
+from sqlalchemy import ForeignKey, Index, Numeric, UniqueConstraint, false
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ResultCollection(Base):
+    """Header of a collection (List, Matrix or Tensor) of Results that have been stored via insert_collection_result.
+    The header describes the collection as a whole, whereas every element is stored as a Result referencing its
+    collection along with its flat (0-based, row-major) position inside of it."""
+
+    __tablename__ = "result_collections"
+    __table_args__ = (
+        UniqueConstraint("processing_step_id", "kind", name="uq_result_collections"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    processing_step_id: Mapped[int] = mapped_column(
+        ForeignKey("processing_steps.id", onupdate="CASCADE", ondelete="CASCADE")
+    )
+    kind: Mapped[str]
+    # List, Matrix or Tensor (more than two dimensions)
+    layout: Mapped[str]
+    # Comma-separated dimensions, e.g. "3,4" for a matrix with 3 rows and 4 columns
+    _shape: Mapped[str] = mapped_column("shape")
+    # Sparse collections only store their nonzero elements (in coordinate format, i.e. every stored element carries
+    # its flat index). All other elements are zero
+    sparse: Mapped[bool] = mapped_column(default=False, server_default=false())
+    # Data type shared by all elements (as in Result._data_type) or "mixed"
+    element_type: Mapped[str]
+    original_collection_type: Mapped[str]
+
+    processing_step: Mapped["ProcessingStep"] = relationship(  # type: ignore
+        passive_deletes=True
+    )
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(int(dim) for dim in self._shape.split(",") if dim)
+
+    @shape.setter
+    def shape(self, value: Tuple[int, ...]):
+        self._shape = ",".join(str(dim) for dim in value)
+
+    @property
+    def size(self) -> int:
+        return math.prod(self.shape)
+
 
 class Result(Base):
     __tablename__ = "results"
+    __table_args__ = (
+        Index("ix_results_step_kind", "processing_step_id", "kind"),
+        Index("ix_results_kind_number", "kind", "_data_number"),
+        Index("ix_results_collection", "collection_id", "collection_index"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     processing_step_id: Mapped[int] = mapped_column(
@@ -17,52 +86,223 @@ class Result(Base):
     kind: Mapped[str]
     _data_value: Mapped[str]
     _data_type: Mapped[str]
+    _data_blob: Mapped[Optional[bytes]]
+    # Native copy of numeric (int and float) data, which allows aggregating results in SQL. NUMERIC affinity makes
+    # SQLite store integers as INTEGER and floats as REAL. Non-numeric and non-finite data is stored as NULL
+    _data_number: Mapped[Optional[float]] = mapped_column(Numeric(asdecimal=False))
+    # Only set for elements of collections
+    collection_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey(ResultCollection.id, onupdate="CASCADE", ondelete="CASCADE")
+    )
+    collection_index: Mapped[Optional[int]]
     _properties: Mapped[Dict[str, "ResultProperty"]] = relationship(
         collection_class=attribute_keyed_dict("keyword"), passive_deletes=True
     )
 
-    properties: AssociationProxy[Dict[str, str]] = association_proxy(
+    properties: AssociationProxy[Dict[str, Any]] = association_proxy(
         target_collection="_properties",
         attr="value",
         creator=lambda k, v: ResultProperty(keyword=k, value=v),
     )
 
-    processing_step: Mapped["ProcessingStep"] = relationship( # type: ignore
+    processing_step: Mapped["ProcessingStep"] = relationship(  # type: ignore
         back_populates="results", passive_deletes=True
     )
+    collection: Mapped[Optional[ResultCollection]] = relationship(passive_deletes=True)
+    # Only present for array data with chunked storage (see configure_chunked_storage)
+    _chunks: Mapped[List[ResultChunk]] = relationship(
+        order_by=ResultChunk.chunk_index,
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     @property
     def data(self):
-        if self._data_type == "int":
-            return int(self._data_value)
-        if self._data_type == "float":
-            return float(self._data_value)
-        elif self._data_type == "str":
-            return str(self._data_value)
+        if self._data_type == "chunked_array":
+            header = ChunkedArrayHeader.parse(self._data_value)
+            return ResultChunk.decode(
+                header, [chunk.data for chunk in self._chunks]
+            ).reshape(header.shape)
+
+        return Result.decode_data(self._data_type, self._data_value, self._data_blob)
 
     @data.setter
     def data(self, value):
-        if type(value) == int:
-            self._data_type = "int"
+        if self._data_type == "chunked_array":
+            # Chunks of the previous data are deleted as orphans
+            self._chunks = []
+
+        for column, column_value in Result.encode_data(value).items():
+            setattr(self, column, column_value)
+
+    @staticmethod
+    def encode_data(value) -> Dict[str, Any]:
+        """Maps the given value onto the (private) data columns of a Result. The returned dict can be used
+        to fill in the columns of a Result without having to create an ORM object for it (e.g. in bulk inserts)
+        """
+        if numpy is not None and isinstance(value, numpy.generic):
+            # NumPy scalars (e.g. numpy.float64) are stored as the corresponding Python values
+            value = value.item()
+
+        if type(value) == bool:
+            data_type = "bool"
+        elif type(value) == int:
+            data_type = "int"
         elif type(value) == float:
-            self._data_type = "float"
+            data_type = "float"
         elif type(value) == str:
-            self._data_type = "str"
+            data_type = "str"
         elif type(value) == list:
             raise RuntimeError(
                 "Adding lists directly is not supported. Use insert_collection_result from the utils module instead"
             )
+        elif Result._supports_buffer_protocol(value):
+            return Result._encode_array(value)
         else:
             raise RuntimeError("Unsupported data type: " + str(type(value)))
 
-        self._data_value = str(value)
+        return {
+            "_data_type": data_type,
+            "_data_value": str(value),
+            "_data_blob": None,
+            "_data_number": Result.to_number(value),
+        }
 
+    @staticmethod
+    def to_number(value) -> Optional[float]:
+        """Converts the given int or float into the representation used for the native numeric column (None for
+        other values and for numbers that SQLite can't represent natively)"""
+        if type(value) == int:
+            return value if -(2**63) <= value < 2**63 else None
+        if type(value) == float:
+            return value if math.isfinite(value) else None
+
+        return None
+
+    @staticmethod
+    def decode_data(data_type: str, data_value: str, data_blob: Optional[bytes] = None):
+        """Inverse of encode_data: converts the raw column values of a Result back into the stored value"""
+        if data_type == "array":
+            return Result._decode_array(data_value, data_blob)
+        if data_type == "chunked_array":
+            raise RuntimeError(
+                "Chunked array data can only be read via Result.data or data_manager.utils.get_array_rows"
+            )
+        if data_type in ("blob", "blob_array"):
+            raise RuntimeError(
+                "The data is stored externally and has to be read via data_manager.utils.BlobStore.load"
+            )
+        if data_type == "int":
+            return int(data_value)
+        if data_type == "float":
+            return float(data_value)
+        if data_type == "str":
+            return str(data_value)
+        if data_type == "bool":
+            return data_value == "True"
+
+        raise RuntimeError("Unknown data type: " + data_type)
+
+    @staticmethod
+    def _supports_buffer_protocol(value) -> bool:
+        try:
+            memoryview(value)
+            return True
+        except TypeError:
+            return False
+
+    @staticmethod
+    def _encode_array(value) -> Dict[str, Any]:
+        """Arrays (NumPy arrays or any other object supporting the buffer protocol) are stored as a single blob of
+        their raw (C-ordered) data. The dtype (including byte order) and the shape are stored as "<dtype>;<shape>"
+        in the value column (e.g. "<f8;3,4")"""
+        if numpy is None:
+            raise RuntimeError("Storing array data requires NumPy to be installed")
+
+        if not isinstance(value, numpy.ndarray):
+            value = numpy.asarray(memoryview(value))
+
+        array = numpy.asarray(value, order="C")
+
+        if array.dtype.hasobject:
+            raise RuntimeError("Arrays of Python objects can't be stored as array data")
+
+        return {
+            "_data_type": "array",
+            "_data_value": "{};{}".format(
+                array.dtype.str, ",".join(str(dim) for dim in array.shape)
+            ),
+            "_data_blob": array.tobytes(),
+            "_data_number": None,
+        }
 
-class ResultProperty(Base):
+    @staticmethod
+    def _decode_array(header: str, blob: Optional[bytes]):
+        """Reconstructs an array stored via _encode_array. The returned array is a read-only view onto the
+        blob fetched from the database (no copy is made)"""
+        if numpy is None:
+            raise RuntimeError("Reading array data requires NumPy to be installed")
+
+        assert blob is not None
+
+        dtype, shape = header.split(";")
+
+        return numpy.frombuffer(blob, dtype=numpy.dtype(dtype)).reshape(
+            tuple(int(dim) for dim in shape.split(",") if dim)
+        )
+
+
+def chunk_array_data(session: Session, flush_context, instances) -> None:
+    """Moves the array data of new or modified Results whose kind has chunked storage enabled into ResultChunks.
+    Registered on sessions via configure_session."""
+    if not _CHUNKED_KINDS:
+        return
+
+    for object in itertools.chain(session.new, session.dirty):
+        # Check the collection without triggering a lazy load of the relationship
+        if (
+            not isinstance(object, Result)
+            or object._data_type != "array"
+            or object.collection_id is not None
+            or object.__dict__.get("collection") is not None
+        ):
+            continue
+
+        storage = chunked_storage(object.kind)
+        if storage is None:
+            continue
+
+        assert object._data_blob is not None
+        header, chunks = ResultChunk.encode(
+            object._data_value, object._data_blob, storage
+        )
+        object._data_type = "chunked_array"
+        object._data_value = header
+        object._data_blob = None
+        object._chunks = [
+            ResultChunk(chunk_index=index, data=chunk)
+            for index, chunk in enumerate(chunks)
+        ]
+
+
+class ResultProperty(TypedPropertyValue, Base):
     __tablename__ = "result_properties"
+    __table_args__ = (
+        Index("ix_result_properties_keyword_value", "keyword_id", "value"),
+        Index(
+            "ix_result_properties_keyword_numeric_value", "keyword_id", "numeric_value"
+        ),
+        PROPERTY_TABLE_OPTIONS,
+    )
 
     result_id: Mapped[int] = mapped_column(
         ForeignKey(Result.id, onupdate="CASCADE", ondelete="CASCADE"), primary_key=True
     )
-    keyword: Mapped[str] = mapped_column(primary_key=True)
+    _keyword_id: Mapped[int] = mapped_column(
+        "keyword_id", ForeignKey(PropertyString.id), primary_key=True
+    )
+    _keyword: Mapped[PropertyString] = relationship(
+        viewonly=True, lazy="joined", innerjoin=True
+    )
+    keyword = interned_string("_keyword_id", "_keyword")
     value: Mapped[str]
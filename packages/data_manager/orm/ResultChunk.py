@@ -0,0 +1,182 @@
+from .Base import Base
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import lzma
+import math
+import zlib
+
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import ForeignKey
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Codec(NamedTuple):
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+# Codecs available for compressing chunks, keyed by the name that is stored alongside the data
+CODECS: Dict[str, Codec] = {
+    "none": Codec(bytes, bytes),
+    "zlib": Codec(zlib.compress, zlib.decompress),
+    "lzma": Codec(lzma.compress, lzma.decompress),
+}
+
+
+def register_codec(
+    name: str,
+    compress: Callable[[bytes], bytes],
+    decompress: Callable[[bytes], bytes],
+) -> None:
+    """Makes a codec available for chunked storage (see configure_chunked_storage). As the codec's name is stored
+    along with the data, the codec has to be registered before reading data that has been compressed with it.
+    """
+    if ";" in name:
+        raise RuntimeError("Codec names must not contain ';'")
+
+    CODECS[name] = Codec(compress, decompress)
+
+
+class ChunkedStorage(NamedTuple):
+    codec: str
+    # Upper bound for the size of a single chunk (in bytes, before compression)
+    chunk_size: int
+
+
+_CHUNKED_KINDS: Dict[str, ChunkedStorage] = {}
+
+
+def configure_chunked_storage(
+    kind: str, codec: str = "zlib", chunk_size: int = 2**20
+) -> None:
+    """Enables chunked storage for array data of Results of the given kind: instead of a single blob, the array's
+    raw data is split into chunks of (at most) chunk_size bytes, each of which is compressed with the given codec
+    and stored as a separate ResultChunk. This happens transparently when the Result is flushed by a session that
+    has been set up via configure_session. Large arrays can
+    then be read partially (see data_manager.utils.get_array_rows), which only decompresses the affected chunks.
+    Elements of collections are never chunked."""
+    if codec not in CODECS:
+        raise RuntimeError(
+            "Unknown codec '%s' - available codecs are: %s" % (codec, ", ".join(CODECS))
+        )
+    if chunk_size <= 0:
+        raise RuntimeError("The chunk size has to be positive")
+
+    _CHUNKED_KINDS[kind] = ChunkedStorage(codec, chunk_size)
+
+
+def disable_chunked_storage(kind: str) -> None:
+    """Stores array data of Results of the given kind as a single blob again (already stored data is not affected)"""
+    _CHUNKED_KINDS.pop(kind, None)
+
+
+def chunked_storage(kind: Optional[str]) -> Optional[ChunkedStorage]:
+    """Returns the chunked storage configuration of the given kind (None if its arrays are stored as single blobs)"""
+    return _CHUNKED_KINDS.get(kind) if kind is not None else None
+
+
+class ChunkedArrayHeader(NamedTuple):
+    dtype: str
+    shape: Tuple[int, ...]
+    codec: str
+    # Number of array elements per chunk
+    chunk_elements: int
+
+    @staticmethod
+    def parse(header: str) -> "ChunkedArrayHeader":
+        dtype, shape, codec, chunk_elements = header.split(";")
+
+        return ChunkedArrayHeader(
+            dtype,
+            tuple(int(dim) for dim in shape.split(",") if dim),
+            codec,
+            int(chunk_elements),
+        )
+
+    def __str__(self) -> str:
+        return "{};{};{};{}".format(
+            self.dtype,
+            ",".join(str(dim) for dim in self.shape),
+            self.codec,
+            self.chunk_elements,
+        )
+
+
+class ResultChunk(Base):
+    """Compressed chunk of the raw data of an array Result with chunked storage (see configure_chunked_storage).
+    The Result's value column holds "<dtype>;<shape>;<codec>;<elements per chunk>" (e.g. "<f8;1000,1000;zlib;131072")
+    and its chunks hold consecutive parts of the array's raw (C-ordered) data."""
+
+    __tablename__ = "result_chunks"
+
+    result_id: Mapped[int] = mapped_column(
+        ForeignKey("results.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    chunk_index: Mapped[int] = mapped_column(primary_key=True)
+    data: Mapped[bytes]
+
+    @staticmethod
+    def encode(
+        array_header: str, blob: bytes, storage: ChunkedStorage
+    ) -> Tuple[str, List[bytes]]:
+        """Splits and compresses the raw data of an array (as stored by Result._encode_array) according to the given
+        storage configuration. Returns the header of the chunked array along with the compressed chunks.
+        """
+        assert numpy is not None
+
+        dtype, shape = array_header.split(";")
+        itemsize = numpy.dtype(dtype).itemsize
+        chunk_elements = max(1, storage.chunk_size // max(itemsize, 1))
+        chunk_bytes = chunk_elements * itemsize
+
+        compress = CODECS[storage.codec].compress
+        chunks = [
+            compress(blob[offset : offset + chunk_bytes])
+            for offset in range(0, len(blob), chunk_bytes)
+        ]
+
+        header = ChunkedArrayHeader(
+            dtype,
+            tuple(int(dim) for dim in shape.split(",") if dim),
+            storage.codec,
+            chunk_elements,
+        )
+
+        return str(header), chunks
+
+    @staticmethod
+    def decode(
+        header: ChunkedArrayHeader,
+        chunks: Sequence[bytes],
+        first_element: int = 0,
+        n_elements: Optional[int] = None,
+    ):
+        """Reconstructs (part of) a chunked array from its consecutive compressed chunks, the first of which is the
+        chunk containing the element with the flat index first_element. Returns a flat array of n_elements elements
+        (all remaining elements if None)."""
+        if numpy is None:
+            raise RuntimeError("Reading array data requires NumPy to be installed")
+
+        if header.codec not in CODECS:
+            raise RuntimeError(
+                "Array data has been compressed with the unknown codec '%s'"
+                % header.codec
+            )
+
+        decompress = CODECS[header.codec].decompress
+        raw = b"".join(decompress(chunk) for chunk in chunks)
+
+        dtype = numpy.dtype(header.dtype)
+        offset = first_element % header.chunk_elements
+        if n_elements is None:
+            n_elements = math.prod(header.shape) - first_element
+
+        return numpy.frombuffer(
+            raw, dtype=dtype, count=n_elements, offset=offset * dtype.itemsize
+        )
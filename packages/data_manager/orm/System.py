@@ -1,15 +1,17 @@
-from .Base import Base
+from .Base import Base, TypedPropertyValue, PROPERTY_TABLE_OPTIONS
+from .PropertyString import PropertyString, interned_string
 
 
-from typing import Optional, Dict
+from typing import Any, Optional, Dict
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship, attribute_keyed_dict
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
 
 class System(Base):
     __tablename__ = "systems"
+    __table_args__ = (Index("ix_systems_name_variant", "name", "variant"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str]
@@ -18,18 +20,29 @@ class System(Base):
         collection_class=attribute_keyed_dict("name"), passive_deletes=True
     )
 
-    properties: AssociationProxy[Dict[str, str]] = association_proxy(
+    properties: AssociationProxy[Dict[str, Any]] = association_proxy(
         target_collection="_properties",
         attr="value",
         creator=lambda k, v: SystemProperty(name=k, value=v),
     )
 
 
-class SystemProperty(Base):
+class SystemProperty(TypedPropertyValue, Base):
     __tablename__ = "system_properties"
+    __table_args__ = (
+        Index("ix_system_properties_name_value", "name_id", "value"),
+        Index("ix_system_properties_name_numeric_value", "name_id", "numeric_value"),
+        PROPERTY_TABLE_OPTIONS,
+    )
 
     system_id: Mapped[int] = mapped_column(
         ForeignKey(System.id, onupdate="CASCADE", ondelete="CASCADE"), primary_key=True
     )
-    name: Mapped[str] = mapped_column(primary_key=True)
+    _name_id: Mapped[int] = mapped_column(
+        "name_id", ForeignKey(PropertyString.id), primary_key=True
+    )
+    _name: Mapped[PropertyString] = relationship(
+        viewonly=True, lazy="joined", innerjoin=True
+    )
+    name = interned_string("_name_id", "_name")
     value: Mapped[str]
@@ -1,6 +1,14 @@
-from .Base import Base
-from .Result import Result, ResultProperty
+from .Base import Base, TypedPropertyValue
+from .PropertyString import PropertyString
+from .ResultChunk import (
+    ResultChunk,
+    register_codec,
+    configure_chunked_storage,
+    disable_chunked_storage,
+)
+from .Result import Result, ResultProperty, ResultCollection
 from .Host import Host, HostProperty
 from .ProcessingStep import ProcessingStep, Keyword, ProcessingStepProperty
 from .System import System, SystemProperty
 from .Project import Project, Author
+from .events import configure_session
@@ -0,0 +1,24 @@
+from .PropertyString import resolve_interned_strings
+from .Result import chunk_array_data
+
+from typing import Type, Union
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker
+
+# Hooks that are run before every flush of sessions that have been set up via configure_session
+_BEFORE_FLUSH_HOOKS = [resolve_interned_strings, chunk_array_data]
+
+
+def configure_session(
+    target: Union[Session, "sessionmaker[Session]", Type[Session]],
+) -> None:
+    """Registers the flush hooks of the ORM on the given session (or on all sessions created by the given
+    sessionmaker or of the given Session subclass). They resolve the interned strings (see interned_string) of all
+    new objects in one go, whereas sessions without them fall back to resolving the strings object by object,
+    and move the array data of Results with chunked storage (see configure_chunked_storage) into ResultChunks.
+    Sessions obtained via data_manager.utils.open_database or get_sessionmaker are set up automatically. Calling
+    this function again for the same target has no effect."""
+    for hook in _BEFORE_FLUSH_HOOKS:
+        if not event.contains(target, "before_flush", hook):
+            event.listen(target, "before_flush", hook)
@@ -1,10 +1,107 @@
-from .database import open_database
+from .database import (
+    open_database,
+    get_sessionmaker,
+    dispose_engines,
+    configure_sqlite_engine,
+    SQLITE_PROFILES,
+)
 from .get_or_create import (
     get_or_create_project,
     get_or_create_author,
     get_or_create_system,
-    get_or_create_system,
+    get_or_create_keyword,
     get_or_create_host,
+    get_or_create_projects,
+    get_or_create_authors,
+    get_or_create_systems,
+    get_or_create_keywords,
+    get_or_create_hosts,
+)
+from .results import (
+    insert_collection_result,
+    insert_sparse_collection_result,
+    get_collection_result,
+    get_collection_slice,
+    get_sparse_collection_result,
+    iter_collection_result,
+    SparseCollection,
+    get_array_rows,
+    aggregate_results,
+    aggregate_results_query,
+)
+from .properties import (
+    get_property_keys,
+    get_property_values,
+    get_properties,
+    get_property_table,
+    PropertyTable,
+    PropertyMetadata,
+    property_metadata,
+    has_properties,
+    property_compares,
+    property_in_range,
+    PropertyFilter,
+    PropertyKey,
+    compile_property_filter,
+)
+from .provenance import (
+    StepGraph,
+    get_ancestors,
+    get_descendants,
+    maintain_step_closure,
+    rebuild_step_closure,
+    depends_on,
+    lookup_ancestors,
+    lookup_descendants,
+)
+from .loading import (
+    LoadingProfile,
+    LOADING_PROFILES,
+    register_loading_profile,
+    loading_options,
+    with_loading_profile,
+)
+from .migrations import upgrade_database, needs_upgrade
+from .lookup_cache import (
+    LookupCache,
+    enable_lookup_cache,
+    disable_lookup_cache,
+    get_lookup_cache,
+)
+from .instrumentation import (
+    QueryStatistics,
+    QueryCounts,
+    SlowQuery,
+    InstrumentedSession,
+    enable_query_statistics,
+    disable_query_statistics,
+    get_query_statistics,
+)
+from .blob_store import BlobStore, insert_blob_result
+from .ingestion import (
+    ParsedStep,
+    IngestionProgress,
+    register_parser,
+    scan_directories,
+    add_parsed_steps,
+    ingest_directories,
+)
+from .broker import WriteBroker, BrokerClient
+from .async_api import (
+    ThreadedAsyncSession,
+    open_async_database,
+    dispose_async_engines,
+    async_driver_available,
+    get_or_create_project_async,
+    get_or_create_author_async,
+    get_or_create_system_async,
+    get_or_create_keyword_async,
+    get_or_create_host_async,
+    get_or_create_projects_async,
+    get_or_create_authors_async,
+    get_or_create_systems_async,
+    get_or_create_keywords_async,
+    get_or_create_hosts_async,
+    insert_collection_result_async,
+    get_collection_result_async,
 )
-from .results import insert_collection_result, get_collection_result
-from .properties import get_property_keys, get_property_values, has_properties
@@ -0,0 +1,215 @@
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import asyncio
+import functools
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from data_manager.orm import configure_session
+
+from .database import get_sessionmaker, configure_sqlite_engine
+from .get_or_create import (
+    get_or_create_project,
+    get_or_create_author,
+    get_or_create_system,
+    get_or_create_keyword,
+    get_or_create_host,
+    get_or_create_projects,
+    get_or_create_authors,
+    get_or_create_systems,
+    get_or_create_keywords,
+    get_or_create_hosts,
+)
+from .results import insert_collection_result, get_collection_result
+
+T = TypeVar("T")
+
+
+class ThreadedAsyncSession:
+    """Asynchronous counterpart of a Session for environments without an async database driver: every operation is
+    executed on a regular (synchronous) Session by a dedicated worker thread, such that the event loop is never
+    blocked. The interface follows sqlalchemy.ext.asyncio.AsyncSession (including run_sync), so code written for
+    one works with the other. As with AsyncSession, results are fully buffered and lazy loading of attributes
+    should be avoided (use eager loading or run_sync instead), as it would perform I/O in the event loop's thread.
+    """
+
+    def __init__(self, session_factory: "sessionmaker[Session]"):
+        # Like for AsyncSessions, committing must not expire objects, as reloading them would happen on the event
+        # loop's thread
+        self.sync_session = session_factory(expire_on_commit=False)
+        # A single worker thread, as Sessions must not be used concurrently
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="data_manager-session"
+        )
+
+    async def run_sync(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """Calls function(sync_session, *args, **kwargs) in the worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            functools.partial(function, self.sync_session, *args, **kwargs),
+        )
+
+    async def execute(self, statement, *args, **kwargs):
+        frozen = await self.run_sync(
+            lambda session: session.execute(statement, *args, **kwargs).freeze()
+        )
+        return frozen()
+
+    async def scalars(self, statement, *args, **kwargs):
+        return (await self.execute(statement, *args, **kwargs)).scalars()
+
+    async def scalar(self, statement, *args, **kwargs):
+        return (await self.execute(statement, *args, **kwargs)).scalar()
+
+    async def get(self, entity, identity, **kwargs):
+        return await self.run_sync(
+            lambda session: session.get(entity, identity, **kwargs)
+        )
+
+    def add(self, instance) -> None:
+        self.sync_session.add(instance)
+
+    def add_all(self, instances) -> None:
+        self.sync_session.add_all(instances)
+
+    async def delete(self, instance) -> None:
+        await self.run_sync(lambda session: session.delete(instance))
+
+    async def flush(self) -> None:
+        await self.run_sync(lambda session: session.flush())
+
+    async def commit(self) -> None:
+        await self.run_sync(lambda session: session.commit())
+
+    async def rollback(self) -> None:
+        await self.run_sync(lambda session: session.rollback())
+
+    async def refresh(self, instance, *args, **kwargs) -> None:
+        await self.run_sync(lambda session: session.refresh(instance, *args, **kwargs))
+
+    async def close(self) -> None:
+        await self.run_sync(lambda session: session.close())
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> "ThreadedAsyncSession":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+
+def async_driver_available() -> bool:
+    """Whether SQLAlchemy's asyncio extension can be used with SQLite (requires aiosqlite and greenlet)"""
+    return (
+        importlib.util.find_spec("aiosqlite") is not None
+        and importlib.util.find_spec("greenlet") is not None
+    )
+
+
+class _SyncSession(Session):
+    """Session underlying the AsyncSessions of open_async_database (carrying the ORM's flush hooks)"""
+
+
+configure_session(_SyncSession)
+
+# Async engines (and their session factories), keyed like the engines of get_sessionmaker
+_async_engines: Dict[Tuple, Any] = {}
+_async_engines_lock = threading.Lock()
+
+
+async def open_async_database(
+    database: str,
+    create_as_needed: bool = True,
+    echo: bool = False,
+    profile: Optional[str] = None,
+    offload_to_thread: Optional[bool] = None,
+    upgrade: bool = False,
+):
+    """Async counterpart of open_database (for SQLite). By default, this returns an
+    sqlalchemy.ext.asyncio.AsyncSession using the aiosqlite driver if aiosqlite and greenlet are installed and a
+    ThreadedAsyncSession (offloading a synchronous Session to a worker thread) otherwise. Pass offload_to_thread to
+    choose explicitly. The database is created as needed (or upgraded if upgrade is True, see get_sessionmaker) in a
+    worker thread.
+    Use the *_async helpers (e.g. get_or_create_project_async), which work with both kinds of sessions.
+    """
+    if offload_to_thread is None:
+        offload_to_thread = not async_driver_available()
+    elif not offload_to_thread and not async_driver_available():
+        raise RuntimeError(
+            "Async sessions without thread offloading require aiosqlite and greenlet to be installed"
+        )
+
+    session_factory = await asyncio.to_thread(
+        get_sessionmaker,
+        database,
+        create_as_needed=create_as_needed,
+        echo=echo,
+        profile=profile,
+        upgrade=upgrade,
+    )
+
+    if offload_to_thread:
+        return ThreadedAsyncSession(session_factory)
+
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    url = session_factory.kw["bind"].url.set(drivername="sqlite+aiosqlite")
+    key = (str(url), echo, profile)
+
+    with _async_engines_lock:
+        if key not in _async_engines:
+            engine = create_async_engine(url, echo=echo)
+            configure_sqlite_engine(engine.sync_engine, profile)
+            _async_engines[key] = (
+                engine,
+                async_sessionmaker(
+                    engine, expire_on_commit=False, sync_session_class=_SyncSession
+                ),
+            )
+
+        return _async_engines[key][1]()
+
+
+async def dispose_async_engines() -> None:
+    """Closes all connections of the engines created by open_async_database"""
+    with _async_engines_lock:
+        engines = [engine for engine, _ in _async_engines.values()]
+        _async_engines.clear()
+
+    for engine in engines:
+        await engine.dispose()
+
+
+def _offloaded(function: Callable[..., T]) -> Callable[..., Any]:
+    """Creates an async variant of the given helper taking a Session as its first argument. The variant takes an
+    AsyncSession or a ThreadedAsyncSession instead and executes the helper via the session's run_sync.
+    """
+
+    @functools.wraps(function)
+    async def variant(session, *args, **kwargs) -> T:
+        return await session.run_sync(function, *args, **kwargs)
+
+    variant.__name__ = variant.__qualname__ = function.__name__ + "_async"
+    variant.__doc__ = (
+        "Async variant of %s (see there), to be awaited on an async session"
+        % (function.__name__)
+    )
+
+    return variant
+
+
+get_or_create_project_async = _offloaded(get_or_create_project)
+get_or_create_author_async = _offloaded(get_or_create_author)
+get_or_create_system_async = _offloaded(get_or_create_system)
+get_or_create_keyword_async = _offloaded(get_or_create_keyword)
+get_or_create_host_async = _offloaded(get_or_create_host)
+get_or_create_projects_async = _offloaded(get_or_create_projects)
+get_or_create_authors_async = _offloaded(get_or_create_authors)
+get_or_create_systems_async = _offloaded(get_or_create_systems)
+get_or_create_keywords_async = _offloaded(get_or_create_keywords)
+get_or_create_hosts_async = _offloaded(get_or_create_hosts)
+insert_collection_result_async = _offloaded(insert_collection_result)
+get_collection_result_async = _offloaded(get_collection_result)
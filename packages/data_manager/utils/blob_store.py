@@ -0,0 +1,223 @@
+from typing import Iterator, List, Optional, Set
+
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from data_manager.orm import Result, ProcessingStep
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class BlobStore:
+    """Content-addressed store of large data (e.g. arrays or output files) outside of the database. Every blob is
+    stored as a read-only file named after the SHA-256 digest of its content inside of the given root directory
+    (using two levels of subdirectories, e.g. <root>/ab/cd/abcd...). Storing identical content multiple times
+    results in a single file. Results reference blobs by their digest (see insert_blob_result) and the blobs are
+    read via memory mapping, i.e. without copying them into memory."""
+
+    _BLOCK_SIZE = 2**20
+    # Blobs are written to temporary files (inside of the root directory) that are moved into place afterwards
+    _TEMPORARY_PREFIX = ".tmp-"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def is_digest(name: str) -> bool:
+        """Checks whether the given name is a valid blob digest (a lowercase, hex-encoded SHA-256 digest)"""
+        return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+    def path(self, digest: str) -> str:
+        if not BlobStore.is_digest(digest):
+            raise RuntimeError("Invalid blob digest '%s'" % digest)
+
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def _commit(self, temporary_path: str, digest: str) -> None:
+        """Moves the given temporary file to its final location (unless the blob is already stored)"""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(temporary_path)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(temporary_path, 0o444)
+        # Atomic, such that readers (and concurrent writers of the same content) never see a partial blob
+        os.replace(temporary_path, path)
+
+    def put(self, data) -> str:
+        """Stores the given bytes-like object (e.g. bytes or a C-contiguous NumPy array) and returns its digest"""
+        view = memoryview(data).cast("B")
+        digest = hashlib.sha256(view).hexdigest()
+
+        if digest not in self:
+            with tempfile.NamedTemporaryFile(
+                dir=self.root, prefix=BlobStore._TEMPORARY_PREFIX, delete=False
+            ) as file:
+                file.write(view)
+            self._commit(file.name, digest)
+
+        return digest
+
+    def add_file(self, path: str, move: bool = False) -> str:
+        """Stores the content of the given file and returns its digest. The file is processed in blocks, so it
+        doesn't have to fit into memory. If move is True, the original file is removed afterwards.
+        """
+        hash = hashlib.sha256()
+        with open(path, "rb") as source, tempfile.NamedTemporaryFile(
+            dir=self.root, prefix=BlobStore._TEMPORARY_PREFIX, delete=False
+        ) as file:
+            while block := source.read(BlobStore._BLOCK_SIZE):
+                hash.update(block)
+                file.write(block)
+
+        digest = hash.hexdigest()
+        self._commit(file.name, digest)
+
+        if move:
+            os.remove(path)
+
+        return digest
+
+    def open(self, digest: str) -> memoryview:
+        """Returns a read-only memoryview of the given blob that is backed by a memory mapping of its file"""
+        path = self.path(digest)
+        if not os.path.exists(path):
+            raise RuntimeError("Blob '%s' is not part of the store" % digest)
+
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files can't be memory mapped
+                return memoryview(b"")
+            # The mapping stays valid after the file has been closed
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def load(self, result: Result):
+        """Returns the data of a Result that has been stored via insert_blob_result without copying it: a read-only
+        memoryview for raw data and a read-only NumPy array for array data"""
+        if result._data_type == "blob":
+            return self.open(result._data_value)
+        if result._data_type != "blob_array":
+            raise RuntimeError(
+                "Result %s is not stored in a BlobStore (but as %s)"
+                % (result.id, result._data_type)
+            )
+
+        if numpy is None:
+            raise RuntimeError("Reading array data requires NumPy to be installed")
+
+        dtype, shape, digest = result._data_value.split(";")
+
+        return numpy.frombuffer(self.open(digest), dtype=numpy.dtype(dtype)).reshape(
+            tuple(int(dim) for dim in shape.split(",") if dim)
+        )
+
+    def digests(self) -> Iterator[str]:
+        """Yields the digests of all blobs in the store. Files that are not named after a digest or that are not
+        located in the directory matching their digest (e.g. leftover temporary files) are skipped.
+        """
+        for directory, _, files in os.walk(self.root):
+            if os.path.relpath(directory, self.root).count(os.sep) != 1:
+                continue
+            for name in files:
+                if BlobStore.is_digest(name) and os.path.dirname(
+                    self.path(name)
+                ) == os.path.normpath(directory):
+                    yield name
+
+    def remove_temporary_files(self, min_age: float = 3600) -> List[str]:
+        """Removes temporary files that have been left behind by interrupted writers and that haven't been modified
+        for at least min_age seconds (such that the files of ongoing writes are kept). Returns their paths.
+        """
+        removed = []
+        threshold = time.time() - min_age
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if (
+                    entry.is_file()
+                    and entry.name.startswith(BlobStore._TEMPORARY_PREFIX)
+                    and entry.stat().st_mtime <= threshold
+                ):
+                    os.remove(entry.path)
+                    removed.append(entry.path)
+
+        return removed
+
+    def remove(self, digest: str) -> None:
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def remove_unreferenced(self, session: Session) -> List[str]:
+        """Removes all blobs that are neither referenced by a Result nor are the output of a ProcessingStep in the
+        database of the given session. Returns the digests of the removed blobs.
+        Note that blobs that are stored by concurrent writers whose transaction has not been committed yet appear to
+        be unreferenced. Leftover temporary files are removed as well (see remove_temporary_files).
+        """
+        referenced: Set[Optional[str]] = set(
+            session.scalars(
+                select(ProcessingStep.output_digest).where(
+                    ProcessingStep.output_digest.is_not(None)
+                )
+            )
+        )
+        for data_value in session.scalars(
+            select(Result._data_value).where(
+                Result._data_type.in_(["blob", "blob_array"])
+            )
+        ):
+            referenced.add(data_value.split(";")[-1])
+
+        removed = [digest for digest in self.digests() if digest not in referenced]
+        for digest in removed:
+            self.remove(digest)
+        self.remove_temporary_files()
+
+        return removed
+
+
+def insert_blob_result(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    data,
+    store: BlobStore,
+) -> Result:
+    """Stores the given data (a NumPy array or any other bytes-like object) in the given BlobStore and adds a Result
+    referencing it by its digest to the given processing step. The Result's value column holds the digest for raw
+    data and "<dtype>;<shape>;<digest>" for arrays. Use BlobStore.load to read the data.
+    """
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        if data.dtype.hasobject:
+            raise RuntimeError("Arrays of Python objects can't be stored as array data")
+
+        array = numpy.ascontiguousarray(data)
+        data_type = "blob_array"
+        data_value = "{};{};{}".format(
+            array.dtype.str,
+            ",".join(str(dim) for dim in array.shape),
+            store.put(array),
+        )
+    else:
+        data_type = "blob"
+        data_value = store.put(data)
+
+    result = Result(kind=kind, processing_step=processing_step)
+    result._data_type = data_type
+    result._data_value = data_value
+    session.add(result)
+
+    return result
@@ -0,0 +1,397 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from .get_or_create import get_or_create_projects
+from .ingestion import ParsedStep, add_parsed_steps
+
+# Wire protocol: clients send one JSON object per line of the form
+#   {"project": <name>, "steps": [{"kind": ..., "results": {...}, "properties": {...}, "system": [<name>, <variant>],
+#                                  "host": ..., "output_path": ...}, ...]}
+# (all step fields but kind are optional) and receive one JSON object per request, either {"step_ids": [...]} with
+# the IDs of the created steps (in order) or {"error": <message>}.
+
+# Interval (in seconds) in which waiting submissions check whether the writer is still running
+_WAIT_INTERVAL = 1.0
+
+
+class _Submission:
+    def __init__(self, project: str, records: List[tuple]):
+        self.project = project
+        self.records = records
+        self.step_ids: Optional[List[int]] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+
+def _parse_request(line: bytes) -> _Submission:
+    request = json.loads(line)
+
+    records = []
+    for step in request["steps"]:
+        system = step.get("system")
+        if system is not None:
+            name, variant = (system, None) if isinstance(system, str) else system
+            system = (name, variant)
+
+        records.append(
+            (
+                step.get("output_path"),
+                ParsedStep(
+                    kind=step["kind"],
+                    results=step.get("results"),
+                    properties=step.get("properties"),
+                    system=system,
+                    host=step.get("host"),
+                ),
+            )
+        )
+
+    return _Submission(str(request["project"]), records)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker: WriteBroker = self.server.broker  # type: ignore
+
+        for line in self.rfile:
+            try:
+                submission = _parse_request(line)
+            except (ValueError, KeyError, TypeError) as error:
+                reply: Dict[str, Any] = {"error": "Malformed request: %s" % error}
+            else:
+                reply = broker._submit(submission)
+
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Clients connecting while the server is busy accepting others are queued instead of being refused
+    request_queue_size = socket.SOMAXCONN
+
+
+class WriteBroker:
+    """Local write broker that accepts submissions of ProcessingSteps (including their Results) from any number of
+    concurrent clients (see BrokerClient) over a Unix socket and writes them into the database from a single writer
+    thread. Submissions that arrive while the writer is busy (or within max_delay seconds after the first one) are
+    coalesced into a single transaction of up to batch_size steps, such that the writer's throughput grows with the
+    number of producers instead of collapsing under contention for SQLite's write lock. Every client is answered
+    as soon as the transaction containing its submission has been committed. If a transaction fails, its
+    submissions are retried one by one, such that a faulty submission only affects the client that sent it.
+    If the writer itself fails (e.g. because the database can't be opened), all pending and further submissions
+    are rejected. Submissions that haven't been committed within timeout seconds (if given) are rejected as well,
+    although they may still be written afterwards.
+    Use start/stop (or a with statement) to run the broker in background threads or serve_forever to run it in the
+    calling thread. The data is written via the Sessions of the given session factory (e.g. from get_sessionmaker).
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        session_factory: "sessionmaker[Session]",
+        batch_size: int = 1000,
+        max_delay: float = 0.01,
+        timeout: Optional[float] = None,
+    ):
+        assert batch_size > 0 and max_delay >= 0
+        assert timeout is None or timeout > 0
+
+        self.socket_path = os.path.abspath(socket_path)
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self.submissions = 0
+        self.steps = 0
+        self.transactions = 0
+        self.failures = 0
+
+        self._queue: "queue.Queue[Optional[_Submission]]" = queue.Queue()
+        self._server: Optional[_Server] = None
+        self._threads: List[threading.Thread] = []
+        self._writer_error: Optional[str] = None
+
+    def _submit(self, submission: _Submission) -> Dict[str, Any]:
+        self._queue.put(submission)
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not submission.done.wait(_WAIT_INTERVAL):
+            if self._writer_error is not None:
+                # The writer failed after having rejected the pending submissions
+                return {"error": self._writer_error}
+            if deadline is not None and time.monotonic() >= deadline:
+                return {"error": "Timed out waiting for the submission to be written"}
+
+        if submission.error is not None:
+            return {"error": submission.error}
+        return {"step_ids": submission.step_ids}
+
+    def _next_batch(self) -> Optional[List[_Submission]]:
+        """Waits for the next submission and collects further submissions until the batch is full or max_delay has
+        passed. Returns None once the broker has been stopped."""
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        n_steps = len(first.records)
+        deadline = time.monotonic() + self.max_delay
+
+        while n_steps < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                current = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+
+            if current is None:
+                # Stop after having written this batch
+                self._queue.put(None)
+                break
+
+            batch.append(current)
+            n_steps += len(current.records)
+
+        return batch
+
+    def _write(self, session: Session, batch: List[_Submission]) -> None:
+        try:
+            projects = get_or_create_projects(
+                session, {submission.project for submission in batch}
+            )
+            step_ids = [
+                [
+                    step.id
+                    for step in add_parsed_steps(
+                        session, projects[submission.project], submission.records
+                    )
+                ]
+                for submission in batch
+            ]
+            session.commit()
+        except Exception as error:
+            session.rollback()
+
+            if len(batch) > 1:
+                for submission in batch:
+                    self._write(session, [submission])
+            else:
+                self.failures += 1
+                batch[0].error = "%s: %s" % (type(error).__name__, error)
+                batch[0].done.set()
+
+            return
+        finally:
+            # Written objects are not needed anymore
+            session.expunge_all()
+
+        self.transactions += 1
+        for submission, ids in zip(batch, step_ids):
+            self.submissions += 1
+            self.steps += len(ids)
+            submission.step_ids = ids
+            submission.done.set()
+
+    def _run_writer(self) -> None:
+        batch: Optional[List[_Submission]] = None
+        try:
+            with self.session_factory() as session:
+                while (batch := self._next_batch()) is not None:
+                    self._write(session, batch)
+        except Exception as error:
+            self._writer_error = "The broker's writer failed: %s: %s" % (
+                type(error).__name__,
+                error,
+            )
+
+            # Reject the submissions of the current batch (that haven't been answered yet) and all queued ones
+            pending = list(batch or [])
+            while True:
+                try:
+                    submission = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if submission is not None:
+                    pending.append(submission)
+
+            for submission in pending:
+                if not submission.done.is_set():
+                    submission.error = self._writer_error
+                    submission.done.set()
+
+    def start(self) -> "WriteBroker":
+        """Starts listening on the socket and writing submissions in background threads"""
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # Left behind by a broker that didn't shut down cleanly
+                os.remove(self.socket_path)
+            else:
+                raise RuntimeError(
+                    "Another broker is already listening on '%s'" % self.socket_path
+                )
+            finally:
+                probe.close()
+
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.broker = self  # type: ignore
+
+        self._threads = [
+            threading.Thread(target=self._run_writer, daemon=True),
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        """Stops accepting connections, writes all pending submissions and removes the socket"""
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        self._server = None
+        self._threads = []
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def serve_forever(self) -> None:
+        """Runs the broker until the calling thread is interrupted (e.g. via Ctrl+C)"""
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            "submissions": self.submissions,
+            "steps": self.steps,
+            "transactions": self.transactions,
+            "failures": self.failures,
+        }
+
+    def __enter__(self) -> "WriteBroker":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+class BrokerClient:
+    """Client of a WriteBroker. A client holds a single connection and can be used from one thread at a time. The
+    timeout (in seconds) applies to waiting for the replies to submissions."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Connect in blocking mode: with a timeout, connecting to a busy broker fails immediately (EAGAIN)
+        # instead of waiting until the broker accepts the connection
+        self._socket.connect(socket_path)
+        self._socket.settimeout(timeout)
+        self._file = self._socket.makefile("rwb")
+
+    def submit(
+        self,
+        project: str,
+        records: Sequence[ParsedStep],
+        output_paths: Optional[Sequence[Optional[str]]] = None,
+    ) -> List[int]:
+        """Submits the given steps (to be added to the project of the given name, which is created as needed) and
+        waits until the broker has committed them. Returns the IDs of the created steps. All data has to be
+        JSON-serializable (i.e. results can be numbers, strings and (nested) lists of those).
+        """
+        if output_paths is None:
+            output_paths = [None] * len(records)
+        assert len(output_paths) == len(records)
+
+        request = {
+            "project": project,
+            "steps": [
+                {
+                    "kind": record.kind,
+                    "results": record.results,
+                    "properties": record.properties,
+                    "system": record.system,
+                    "host": record.host,
+                    "output_path": output_path,
+                }
+                for record, output_path in zip(records, output_paths)
+            ],
+        }
+
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+
+        line = self._file.readline()
+        if not line:
+            raise RuntimeError("The broker closed the connection")
+
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError("The broker rejected the submission: " + reply["error"])
+
+        return reply["step_ids"]
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> "BrokerClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def main():
+    from .database import get_sessionmaker, SQLITE_PROFILES
+
+    parser = argparse.ArgumentParser(
+        description="Runs a write broker that funnels submissions of concurrent clients into a database"
+    )
+    parser.add_argument("database", help="Path to the SQLite database")
+    parser.add_argument("socket", help="Path of the Unix socket to listen on")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-delay", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--profile", choices=list(SQLITE_PROFILES), default=None)
+    args = parser.parse_args()
+
+    WriteBroker(
+        args.socket,
+        get_sessionmaker(args.database, profile=args.profile),
+        batch_size=args.batch_size,
+        max_delay=args.max_delay,
+        timeout=args.timeout,
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
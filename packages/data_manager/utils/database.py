@@ -1,30 +1,120 @@
-from typing import Optional
+from typing import NamedTuple, Optional, Dict, Union, Tuple
 from enum import Enum
 from pathlib import Path
+import os
+import threading
 import warnings
 
-from sqlalchemy import create_engine, event, Engine, event
+from sqlalchemy import create_engine, event, Engine
 from sqlalchemy.exc import SAWarning
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
-from data_manager.orm import Base
+from data_manager.orm import Base, configure_session
+from .migrations import upgrade_database, needs_upgrade
+from .instrumentation import (
+    QueryStatistics,
+    InstrumentedSession,
+    enable_query_statistics,
+)
 
 
 class Backend(Enum):
     SQLite = 1
 
 
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    # For SQLite we have to explicitly enable foreign keys
-    # Once we also support different backends, this has to be made backend-agnostic
-    # Taken from https://stackoverflow.com/a/12770354
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+# Named sets of PRAGMAs that are applied to every new connection of an engine (in the given order). Foreign key
+# support is always enabled, regardless of the chosen profile.
+# - safe: WAL journal with fully synchronous commits (durable even across power loss)
+# - concurrent-readers: WAL journal with relaxed syncing and memory-mapped I/O for read-heavy workloads with
+#   occasional writers
+# - bulk-ingest: trades durability (the last transactions may be lost on power loss or OS crash) for maximal write
+#   throughput
+SQLITE_PROFILES: Dict[str, Dict[str, Union[str, int]]] = {
+    "safe": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+    },
+    "concurrent-readers": {
+        "busy_timeout": 30000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        # Negative cache sizes are given in KiB
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "bulk-ingest": {
+        "busy_timeout": 60000,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256 * 1024,
+        "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
 
 
-def open_database(
+def configure_sqlite_engine(engine: Engine, profile: Optional[str] = None) -> None:
+    """Registers a listener on the given engine that sets up every new connection according to the given
+    (named) profile (see SQLITE_PROFILES). Without a profile, only foreign key support is enabled. This has to be
+    called before the engine establishes its first connection."""
+    if profile is not None and profile not in SQLITE_PROFILES:
+        raise RuntimeError(
+            "Unknown SQLite profile '%s' - available profiles are: %s"
+            % (profile, ", ".join(SQLITE_PROFILES))
+        )
+
+    pragmas = SQLITE_PROFILES[profile] if profile is not None else {}
+
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        # For SQLite we have to explicitly enable foreign keys
+        # Once we also support different backends, this has to be made backend-agnostic
+        # Taken from https://stackoverflow.com/a/12770354
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+
+    event.listen(engine, "connect", set_sqlite_pragma)
+
+
+# Process-wide registry of engines (and their session factories), keyed by database URL and engine options, such
+# that repeatedly opening the same database only costs a connection checkout from the engine's pool
+class _RegisteredEngine(NamedTuple):
+    engine: Engine
+    session_factory: "sessionmaker[Session]"
+    # (st_dev, st_ino) of the database file the engine has been created for
+    file_identity: Optional[Tuple[int, int]]
+
+
+_engines: Dict[Tuple, _RegisteredEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def _file_identity(path: str) -> Optional[Tuple[int, int]]:
+    """Returns the identity of the given file (None if it doesn't exist)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_dev, stat.st_ino
+
+
+def _dispose_engines_after_fork() -> None:
+    # Pooled connections must not be shared with a forked child process. Note that close=False leaves the
+    # connections of the parent untouched
+    for registered in _engines.values():
+        registered.engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_engines_after_fork)
+
+
+def get_sessionmaker(
     database: str,
     backend: Backend = Backend.SQLite,
     host: Optional[str] = None,
@@ -32,8 +122,22 @@ def open_database(
     user: Optional[str] = None,
     password: Optional[str] = None,
     create_as_needed: bool = True,
-    echo: bool = False
-) -> Session:
+    echo: bool = False,
+    profile: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None,
+    pool_timeout: Optional[float] = None,
+    pool_recycle: Optional[int] = None,
+    upgrade: bool = False,
+) -> "sessionmaker[Session]":
+    """Gets the session factory for the given database. The underlying engine (including its connection pool) is
+    created on first use and then reused for all subsequent calls with the same database and options, as long as the
+    database file hasn't been deleted or replaced in the meantime (otherwise a new engine is created). Only when
+    creating the engine, the existence of the database is checked and its schema is created if needed. Databases
+    that have been created by older versions of data_manager are only upgraded (via upgrade_database) if upgrade is
+    True, otherwise opening them raises a RuntimeError.
+    The pool_* arguments configure the engine's connection pool (see sqlalchemy.create_engine) and SQLAlchemy's
+    defaults are used for those that are None."""
     if backend == Backend.SQLite:
         assert host is None
         assert port is None
@@ -43,7 +147,32 @@ def open_database(
         if not database.endswith(".sqlite"):
             database += ".sqlite"
 
-        engine = create_engine("sqlite:///%s" % database, echo=echo)
+        url = "sqlite:///%s" % os.path.abspath(database)
+    else:
+        raise RuntimeError("(Currently) unsupported database backend '%s'" % backend)
+
+    pool_options = {
+        key: value
+        for key, value in [
+            ("pool_size", pool_size),
+            ("max_overflow", max_overflow),
+            ("pool_timeout", pool_timeout),
+            ("pool_recycle", pool_recycle),
+        ]
+        if value is not None
+    }
+
+    key = (url, echo, profile, tuple(sorted(pool_options.items())))
+
+    with _engines_lock:
+        registered = _engines.get(key)
+        if registered is not None:
+            if registered.file_identity == _file_identity(os.path.abspath(database)):
+                return registered.session_factory
+
+            # Pooled connections of a deleted or replaced file would keep using the old file
+            registered.engine.dispose()
+            del _engines[key]
 
         path = Path(database)
         if path.exists():
@@ -52,18 +181,89 @@ def open_database(
                     "Can't create SQLite database at '%s' - path exists and is not a file"
                     % database
                 )
-        elif create_as_needed:
-            Base.metadata.create_all(engine)
-        else:
+        elif not create_as_needed:
             raise RuntimeError(
                 "Database '%s' does not exist and create_as_needed == False" % database
             )
 
+        engine = create_engine(url, echo=echo, **pool_options)
+        configure_sqlite_engine(engine, profile)
+
+        if not path.exists():
+            Base.metadata.create_all(engine)
+        elif upgrade:
+            upgrade_database(engine)
+        elif needs_upgrade(engine):
+            engine.dispose()
+            raise RuntimeError(
+                "Database '%s' has been created by an older version and has to be upgraded first - pass "
+                "upgrade=True or use upgrade_database" % database
+            )
+
         # Turn SQLAlchemy warnings into errors as these often indicate that something is fishy and that the
         # current data manipulation doesn't (fully) do what one expects
         warnings.filterwarnings("error", category=SAWarning)
 
-        return Session(engine)
+        session_factory = sessionmaker(bind=engine)
+        configure_session(session_factory)
 
-    else:
-        raise RuntimeError("(Currently) unsupported database backend '%s'" % backend)
+        _engines[key] = _RegisteredEngine(
+            engine, session_factory, _file_identity(os.path.abspath(database))
+        )
+
+        return session_factory
+
+
+def dispose_engines() -> None:
+    """Closes all pooled connections and empties the engine registry used by open_database and get_sessionmaker"""
+    with _engines_lock:
+        for registered in _engines.values():
+            registered.engine.dispose()
+
+        _engines.clear()
+
+
+def open_database(
+    database: str,
+    backend: Backend = Backend.SQLite,
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    user: Optional[str] = None,
+    password: Optional[str] = None,
+    create_as_needed: bool = True,
+    echo: bool = False,
+    profile: Optional[str] = None,
+    instrument: Union[bool, QueryStatistics] = False,
+    upgrade: bool = False,
+    **pool_options,
+) -> Session:
+    """Opens a session on the given database. For SQLite, profile selects one of the tuning profiles defined in
+    SQLITE_PROFILES (by default only foreign key support is enabled). Engines are reused across calls (see
+    get_sessionmaker, which also documents the accepted pool options and the upgrade of outdated databases).
+    If instrument is set, the session counts the statements it executes (see enable_query_statistics) and dumps the
+    statistics to stderr when it's closed. Pass a QueryStatistics object to configure the slow query log or to
+    accumulate the statistics of several sessions."""
+    session_factory = get_sessionmaker(
+        database=database,
+        backend=backend,
+        host=host,
+        port=port,
+        user=user,
+        password=password,
+        create_as_needed=create_as_needed,
+        echo=echo,
+        profile=profile,
+        upgrade=upgrade,
+        **pool_options,
+    )
+
+    if instrument is False:
+        return session_factory()
+
+    session = InstrumentedSession(**session_factory.kw)
+    configure_session(session)
+    enable_query_statistics(
+        session, instrument if isinstance(instrument, QueryStatistics) else None
+    )
+
+    return session
@@ -1,22 +1,32 @@
-from typing import Optional
+from typing import Optional, Iterable, Union, Tuple, List, Dict, Any, Type, Sequence
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, insert, exists, bindparam, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from data_manager.orm import Project, Author, System, Keyword, Host
 
+from .lookup_cache import get_lookup_cache
+
 
 def get_or_create_project(session: Session, name: str) -> Project:
     """Gets the Project object with the given name. If no such object exists yet, a new one will be created
     and added to the given session. If more than one project with the same name exist, this function will error
     as disambiguation has to be done by the user (and then the desired project can be selected via its ID)
     """
+    cache = get_lookup_cache(session)
+    if cache is not None and (project := cache.get(Project, (name,))) is not None:
+        return project
+
     project = session.scalars(select(Project).where(Project.name == name)).one_or_none()
 
     if project is None:
         project = Project(name=name)
         session.add(project)
 
+    if cache is not None:
+        cache.put(Project, (name,), project)
+
     return project
 
 
@@ -27,6 +37,13 @@ def get_or_create_author(
     be created and added to the session. In case the search yields more than a single existing result, this
     function will error as disambiguation has to be done by the user (and then the desired author can be selected
     via its ID)"""
+    cache = get_lookup_cache(session)
+    if (
+        cache is not None
+        and (author := cache.get(Author, (name, affiliation))) is not None
+    ):
+        return author
+
     if affiliation is None:
         author = session.scalars(
             select(Author).where(Author.name == name)
@@ -42,6 +59,9 @@ def get_or_create_author(
         author = Author(name=name, affiliation=affiliation)
         session.add(author)
 
+    if cache is not None:
+        cache.put(Author, (name, affiliation), author)
+
     return author
 
 
@@ -52,6 +72,10 @@ def get_or_create_system(
     be created and added to the session. In case the search yields more than a single existing result, this
     function will error as disambiguation has to be done by the user (and then the desired system can be selected
     via its ID)"""
+    cache = get_lookup_cache(session)
+    if cache is not None and (system := cache.get(System, (name, variant))) is not None:
+        return system
+
     if variant is None:
         system = session.scalars(
             select(System).where(System.name == name)
@@ -65,6 +89,9 @@ def get_or_create_system(
         system = System(name=name, variant=variant)
         session.add(system)
 
+    if cache is not None:
+        cache.put(System, (name, variant), system)
+
     return system
 
 
@@ -73,12 +100,19 @@ def get_or_create_keyword(session: Session, name: str) -> Keyword:
     and added to the session. In case the search yields more than a single existing result, this function
     will error as disambiguation has to be done by the user (and then the desired keyword can be selected via its ID)
     """
+    cache = get_lookup_cache(session)
+    if cache is not None and (keyword := cache.get(Keyword, (name,))) is not None:
+        return keyword
+
     keyword = session.scalars(select(Keyword).where(Keyword.name == name)).one_or_none()
 
     if keyword is None:
         keyword = Keyword(name=name)
         session.add(keyword)
 
+    if cache is not None:
+        cache.put(Keyword, (name,), keyword)
+
     return keyword
 
 
@@ -87,10 +121,192 @@ def get_or_create_host(session: Session, name: str) -> Host:
     and added to the session. In case the search yields more than a single existing result, this function
     will error as disambiguation has to be done by the user (and then the desired host can be selected via its ID)
     """
+    cache = get_lookup_cache(session)
+    if cache is not None and (host := cache.get(Host, (name,))) is not None:
+        return host
+
     host = session.scalars(select(Host).where(Host.name == name)).one_or_none()
 
     if host is None:
         host = Host(name=name)
         session.add(host)
 
+    if cache is not None:
+        cache.put(Host, (name,), host)
+
     return host
+
+
+# Upper bound for the number of names per IN query, which keeps us below SQLite's limit on the number of variables
+# in a single statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+def _normalize_keys(keys: Iterable[Union[str, Tuple]], n_columns: int) -> List[Tuple]:
+    """Turns plain names into (name, None, ...) tuples and removes duplicates (preserving the order)"""
+    normalized = [
+        (key,) + (None,) * (n_columns - 1) if isinstance(key, str) else tuple(key)
+        for key in keys
+    ]
+    assert all(len(key) == n_columns and key[0] is not None for key in normalized)
+
+    return list(dict.fromkeys(normalized))
+
+
+def _bulk_lookup(
+    session: Session, cls: Type, columns: Sequence[str], keys: List[Tuple]
+) -> Dict[Tuple, Any]:
+    """Looks up the objects matching the given keys with one IN query (per batch of keys). As for the single-object
+    variants, None in any but the first (name) column matches every value. Ambiguous keys are an error.
+    """
+    name_column = getattr(cls, columns[0])
+
+    found: Dict[Tuple, Any] = {}
+
+    for offset in range(0, len(keys), _LOOKUP_BATCH_SIZE):
+        batch = keys[offset : offset + _LOOKUP_BATCH_SIZE]
+
+        candidates: Dict[Any, List[Any]] = {}
+        for current in session.scalars(
+            select(cls).where(name_column.in_({key[0] for key in batch}))
+        ):
+            candidates.setdefault(getattr(current, columns[0]), []).append(current)
+
+        for key in batch:
+            matches = [
+                current
+                for current in candidates.get(key[0], [])
+                if all(
+                    value is None or getattr(current, column) == value
+                    for column, value in zip(columns[1:], key[1:])
+                )
+            ]
+
+            if len(matches) > 1:
+                raise RuntimeError(
+                    "Found multiple %s objects matching %s - disambiguation has to be done by the user"
+                    % (cls.__name__, key)
+                )
+            elif len(matches) == 1:
+                found[key] = matches[0]
+
+    return found
+
+
+def _bulk_insert_missing(
+    session: Session, cls: Type, columns: Sequence[str], keys: List[Tuple]
+) -> None:
+    table = cls.__table__
+
+    if any(column.unique for column in table.c if column.name == columns[0]):
+        # A unique constraint on the name lets the database resolve races with concurrent writers for us
+        statement = sqlite_insert(table).on_conflict_do_nothing(
+            index_elements=[columns[0]]
+        )
+    else:
+        # Without unique constraints, the check for an existing object is done as part of the INSERT statement
+        # itself, which makes it atomic with respect to other writers
+        conditions = [table.c[columns[0]] == bindparam(columns[0])] + [
+            or_(
+                bindparam(column, type_=table.c[column].type).is_(None),
+                table.c[column] == bindparam(column),
+            )
+            for column in columns[1:]
+        ]
+        statement = insert(table).from_select(
+            list(columns),
+            select(
+                *[bindparam(column, type_=table.c[column].type) for column in columns]
+            ).where(~exists().where(and_(*conditions))),
+        )
+
+    session.execute(statement, [dict(zip(columns, key)) for key in keys])
+
+
+def _bulk_get_or_create(
+    session: Session, cls: Type, columns: Sequence[str], keys: Iterable
+) -> Dict[Tuple, Any]:
+    normalized = _normalize_keys(keys, len(columns))
+
+    cache = get_lookup_cache(session)
+
+    found: Dict[Tuple, Any] = {}
+    if cache is not None:
+        for key in normalized:
+            cached = cache.get(cls, key)
+            if cached is not None:
+                found[key] = cached
+
+    uncached = [key for key in normalized if key not in found]
+    if len(uncached) > 0:
+        looked_up = _bulk_lookup(session, cls, columns, uncached)
+
+        missing = [key for key in uncached if key not in looked_up]
+        if len(missing) > 0:
+            _bulk_insert_missing(session, cls, columns, missing)
+            looked_up.update(_bulk_lookup(session, cls, columns, missing))
+
+        if cache is not None:
+            for key, object in looked_up.items():
+                cache.put(cls, key, object)
+
+        found.update(looked_up)
+
+    assert len(found) == len(normalized)
+
+    return found
+
+
+def get_or_create_projects(
+    session: Session, names: Iterable[str]
+) -> Dict[str, Project]:
+    """Bulk variant of get_or_create_project: resolves all given names with a single IN query (per batch of names)
+    and inserts all missing projects with a single executemany INSERT. Contrary to get_or_create_project, the new
+    projects are directly written to the database (as part of the session's transaction). Returns a dict mapping
+    every name to its project."""
+    return {
+        key[0]: project
+        for key, project in _bulk_get_or_create(
+            session, Project, ["name"], names
+        ).items()
+    }
+
+
+def get_or_create_authors(
+    session: Session, authors: Iterable[Union[str, Tuple[str, Optional[str]]]]
+) -> Dict[Tuple[str, Optional[str]], Author]:
+    """Bulk variant of get_or_create_author (see get_or_create_projects) taking names or (name, affiliation) pairs.
+    The returned dict is keyed by (name, affiliation) pairs, where plain names are mapped onto (name, None).
+    """
+    return _bulk_get_or_create(session, Author, ["name", "affiliation"], authors)
+
+
+def get_or_create_systems(
+    session: Session, systems: Iterable[Union[str, Tuple[str, Optional[str]]]]
+) -> Dict[Tuple[str, Optional[str]], System]:
+    """Bulk variant of get_or_create_system (see get_or_create_projects) taking names or (name, variant) pairs.
+    The returned dict is keyed by (name, variant) pairs, where plain names are mapped onto (name, None).
+    """
+    return _bulk_get_or_create(session, System, ["name", "variant"], systems)
+
+
+def get_or_create_keywords(
+    session: Session, names: Iterable[str]
+) -> Dict[str, Keyword]:
+    """Bulk variant of get_or_create_keyword (see get_or_create_projects). As keyword names are unique, concurrent
+    insertions of the same keyword are resolved via INSERT ... ON CONFLICT DO NOTHING.
+    """
+    return {
+        key[0]: keyword
+        for key, keyword in _bulk_get_or_create(
+            session, Keyword, ["name"], names
+        ).items()
+    }
+
+
+def get_or_create_hosts(session: Session, names: Iterable[str]) -> Dict[str, Host]:
+    """Bulk variant of get_or_create_host (see get_or_create_projects)"""
+    return {
+        key[0]: host
+        for key, host in _bulk_get_or_create(session, Host, ["name"], names).items()
+    }
@@ -0,0 +1,282 @@
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import functools
+import multiprocessing
+import os
+import time
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from data_manager.orm import Project, ProcessingStep, Result
+from .get_or_create import get_or_create_systems, get_or_create_hosts
+from .results import insert_collection_result
+
+
+class ParsedStep(NamedTuple):
+    """Record that a parser produced for a single calculation directory. It is turned into a ProcessingStep (whose
+    output_path is the directory) with the given properties, system ((name, variant) pair) and host as well as one
+    Result per entry of results. Lists (and tuples) are stored as collections (see insert_collection_result).
+    """
+
+    kind: str
+    results: Optional[Dict[str, Any]] = None
+    properties: Optional[Dict[str, str]] = None
+    system: Optional[Tuple[str, Optional[str]]] = None
+    host: Optional[str] = None
+
+
+# A parser inspects the given directory and returns None if the directory doesn't contain output of the program
+# the parser is written for. Parsers are executed in worker processes and thus have to be picklable (e.g. functions
+# defined at the top level of a module).
+Parser = Callable[[str], Optional[ParsedStep]]
+
+PARSERS: Dict[str, Parser] = {}
+
+
+def register_parser(name: str, parser: Parser) -> None:
+    """Makes the given parser available under the given name (see ingest_directories)"""
+    PARSERS[name] = parser
+
+
+class IngestionProgress(NamedTuple):
+    """Snapshot of the state of an ingestion, as passed to progress callbacks and returned by ingest_directories"""
+
+    # Number of directories that are going to be processed
+    total: int
+    ingested: int
+    # Directories that have been ingested by a previous run
+    skipped: int
+    # Directories that none of the parsers recognized
+    unmatched: int
+    # Error messages of the directories whose parsing failed
+    failures: Dict[str, str]
+    # Wall time in seconds
+    elapsed: float
+
+    @property
+    def processed(self) -> int:
+        return self.ingested + self.skipped + self.unmatched + len(self.failures)
+
+    @property
+    def rate(self) -> float:
+        """Throughput in processed directories per second"""
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def scan_directories(root: str) -> List[str]:
+    """Returns (the absolute paths of) the given directory and all of its subdirectories that contain at least one
+    file, in sorted order"""
+    return sorted(
+        os.path.abspath(directory)
+        for directory, _, files in os.walk(root)
+        if len(files) > 0
+    )
+
+
+def _parse_directory(
+    directory: str, parsers: Sequence[Parser]
+) -> Tuple[str, Optional[ParsedStep], Optional[str]]:
+    """Runs the given parsers on the given directory until one of them recognizes it. Returns the directory along
+    with the parsed record (None if no parser recognized the directory) and the error message if parsing failed
+    """
+    try:
+        for parser in parsers:
+            record = parser(directory)
+            if record is not None:
+                return directory, record, None
+    except Exception as error:
+        return directory, None, "%s: %s" % (type(error).__name__, error)
+
+    return directory, None, None
+
+
+def add_parsed_steps(
+    session: Session,
+    project: Project,
+    records: Sequence[Tuple[Optional[str], ParsedStep]],
+) -> List[ProcessingStep]:
+    """Adds a ProcessingStep (along with its Results) to the given project per given (output path, record) pair and
+    returns the (flushed) steps. Systems and hosts are resolved for all records at once and plain Results are
+    inserted in bulk. The session is not committed, such that callers can combine several calls in one transaction.
+    """
+    systems = get_or_create_systems(
+        session, {record.system for _, record in records if record.system is not None}
+    )
+    hosts = get_or_create_hosts(
+        session, {record.host for _, record in records if record.host is not None}
+    )
+
+    steps = [
+        ProcessingStep(
+            kind=record.kind,
+            project=project,
+            output_path=directory,
+            system=systems[record.system] if record.system is not None else None,
+            host=hosts[record.host] if record.host is not None else None,
+            properties=dict(record.properties or {}),
+        )
+        for directory, record in records
+    ]
+    session.add_all(steps)
+    session.flush()
+
+    result_rows: List[Dict[str, Any]] = []
+    for step, (_, record) in zip(steps, records):
+        for kind, data in (record.results or {}).items():
+            if isinstance(data, (list, tuple)):
+                insert_collection_result(session, kind, step, data, bulk=True)
+            else:
+                result_rows.append(
+                    dict(
+                        kind=kind,
+                        processing_step_id=step.id,
+                        **Result.encode_data(data),
+                    )
+                )
+
+    if len(result_rows) > 0:
+        session.execute(
+            insert(Result.metadata.tables[Result.__tablename__]), result_rows
+        )
+
+    return steps
+
+
+def ingest_directories(
+    session: Session,
+    project: Project,
+    directories: Iterable[str],
+    parsers: Optional[Sequence[Union[str, Parser]]] = None,
+    processes: Optional[int] = None,
+    batch_size: int = 200,
+    progress: Optional[Callable[[IngestionProgress], None]] = None,
+) -> IngestionProgress:
+    """Ingests the given calculation directories (e.g. as obtained from scan_directories) into the given project.
+    The directories are parsed in a pool of the given number of worker processes (all available CPUs by default, 1
+    parses in the calling process) by trying the given parsers (names of registered parsers or parsers themselves;
+    all registered parsers by default) in order. The parsed records are written by the calling process only, in
+    transactions of batch_size directories that are committed on the given session (which is also committed before
+    the ingestion starts).
+    Every directory is ingested at most once per project: directories that already are the output_path of a step
+    of the project are skipped, such that an interrupted ingestion can simply be restarted. As every batch is
+    committed together with all of its Results, a crash never leaves partially ingested directories behind.
+    If a batch can't be written (e.g. because a parser produced a Result of an unsupported type), its records are
+    written one by one and the directories whose records fail are reported as failures.
+    The progress callback (if any) is called after every committed batch. Returns the final progress.
+    """
+    assert batch_size > 0
+
+    resolved_parsers = [
+        PARSERS[parser] if isinstance(parser, str) else parser
+        for parser in (parsers if parsers is not None else list(PARSERS))
+    ]
+    if len(resolved_parsers) == 0:
+        raise RuntimeError("No parsers have been given or registered")
+
+    session.add(project)
+    session.commit()
+
+    start = time.perf_counter()
+
+    ingested = set(
+        session.scalars(
+            select(ProcessingStep.output_path)
+            .where(ProcessingStep.project_id == project.id)
+            .where(ProcessingStep.output_path.is_not(None))
+        )
+    )
+    pending = list(dict.fromkeys(os.path.abspath(path) for path in directories))
+
+    n_ingested = 0
+    n_unmatched = 0
+    n_skipped = sum(1 for directory in pending if directory in ingested)
+    failures: Dict[str, str] = {}
+    pending = [directory for directory in pending if directory not in ingested]
+
+    def snapshot() -> IngestionProgress:
+        return IngestionProgress(
+            total=len(pending) + n_skipped,
+            ingested=n_ingested,
+            skipped=n_skipped,
+            unmatched=n_unmatched,
+            failures=dict(failures),
+            elapsed=time.perf_counter() - start,
+        )
+
+    parse = functools.partial(_parse_directory, parsers=resolved_parsers)
+
+    def write(records: List[Tuple[str, ParsedStep]]) -> None:
+        nonlocal n_ingested
+
+        try:
+            add_parsed_steps(session, project, records)
+            session.commit()
+        except Exception as error:
+            session.rollback()
+
+            if len(records) == 1:
+                failures[records[0][0]] = "%s: %s" % (type(error).__name__, error)
+            else:
+                # Retry the records one by one, such that only the faulty ones are left out
+                for record in records:
+                    write([record])
+
+            return
+
+        n_ingested += len(records)
+
+    def write_batch(records: List[Tuple[str, ParsedStep]]) -> None:
+        write(records)
+
+        if progress is not None:
+            progress(snapshot())
+
+    def consume(parsed: Iterator[Tuple[str, Optional[ParsedStep], Optional[str]]]):
+        nonlocal n_unmatched
+
+        records: List[Tuple[str, ParsedStep]] = []
+        for directory, record, error in parsed:
+            if error is not None:
+                failures[directory] = error
+            elif record is None:
+                n_unmatched += 1
+            else:
+                records.append((directory, record))
+
+            if len(records) >= batch_size:
+                write_batch(records)
+                records = []
+
+        write_batch(records)
+
+    if processes == 1:
+        consume(map(parse, pending))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            consume(
+                pool.imap_unordered(
+                    parse,
+                    pending,
+                    chunksize=max(
+                        1,
+                        min(
+                            64, len(pending) // (4 * (processes or os.cpu_count() or 1))
+                        ),
+                    ),
+                )
+            )
+
+    return snapshot()
@@ -0,0 +1,351 @@
+from typing import Any, Dict, List, NamedTuple, Optional, TextIO
+
+import logging
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_SESSION_INFO_KEY = "data_manager.query_statistics"
+_DUMPED_INFO_KEY = "data_manager.query_statistics_dumped"
+
+# Slow queries are logged as warnings to this logger
+logger = logging.getLogger("data_manager.queries")
+
+# Statements that are not issued from within a (public) data_manager function are attributed to this name
+APPLICATION = "<application>"
+
+
+class QueryCounts:
+    """Number of executed statements, the number of rows they returned (or modified) and their execution time"""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.elapsed = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "statements": self.statements,
+            "rows": self.rows,
+            "elapsed": self.elapsed,
+        }
+
+
+class SlowQuery(NamedTuple):
+    statement: str
+    parameters: Any
+    # Execution time in seconds
+    elapsed: float
+    helper: str
+    # Name of the lazily loaded relationship (e.g. "ProcessingStep.results") if the query is a lazy load
+    lazy_load: Optional[str]
+    # Output of EXPLAIN QUERY PLAN (if requested)
+    plan: Optional[List[str]]
+
+
+def _calling_helper() -> str:
+    """Returns the qualified name of the innermost public data_manager function on the current call stack"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        name = frame.f_code.co_name
+        if (
+            module.startswith("data_manager.")
+            and module != __name__
+            and not name.startswith("_")
+            and not name.startswith("<")
+        ):
+            return "%s.%s" % (module, name)
+        frame = frame.f_back
+
+    return APPLICATION
+
+
+class QueryStatistics:
+    """Counts the statements that Sessions (see enable_query_statistics) execute, the rows these statements return
+    or modify and the time spent executing them. The counts are broken down by the data_manager function (the
+    "helper", e.g. data_manager.utils.results.get_collection_result) that issued the statements, with statements
+    issued directly by the application attributed to APPLICATION, and by the relationships (e.g.
+    "ProcessingStep.results") whose lazy loading caused them. Many lazy loads of the same relationship are the
+    signature of the N+1 pattern, which is best avoided by loading the relationship eagerly.
+    Statements taking at least slow_query_threshold seconds are logged as warnings to the "data_manager.queries"
+    logger and (up to max_slow_queries of them) kept in slow_queries, along with their query plan if explain is
+    set. A single instance may be shared by multiple sessions (also across threads) to collect the statistics of
+    an entire job.
+    Note that row counting and the attribution of statements add noticeable overhead to every statement and every
+    fetched row, so this is meant for diagnosis rather than for production runs.
+    """
+
+    def __init__(
+        self,
+        slow_query_threshold: Optional[float] = None,
+        explain: bool = False,
+        max_slow_queries: int = 100,
+    ):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain = explain
+        self.max_slow_queries = max_slow_queries
+
+        self.total = QueryCounts()
+        self.by_helper: Dict[str, QueryCounts] = {}
+        self.by_lazy_load: Dict[str, QueryCounts] = {}
+        self.slow_queries: List[SlowQuery] = []
+
+        self._lock = threading.Lock()
+        # Per thread, the relationships that are currently being lazily loaded
+        self._local = threading.local()
+
+    def _lazy_loads(self) -> List[str]:
+        if not hasattr(self._local, "lazy_loads"):
+            self._local.lazy_loads = []
+        return self._local.lazy_loads
+
+    def _record(
+        self,
+        helper: str,
+        lazy_load: Optional[str],
+        rows: int,
+        elapsed: float,
+        statements: int = 1,
+    ) -> None:
+        with self._lock:
+            counts = [self.total, self.by_helper.setdefault(helper, QueryCounts())]
+            if lazy_load is not None:
+                counts.append(self.by_lazy_load.setdefault(lazy_load, QueryCounts()))
+
+            for current in counts:
+                current.statements += statements
+                current.rows += rows
+                current.elapsed += elapsed
+
+    def _record_slow_query(self, query: SlowQuery) -> None:
+        logger.warning(
+            "Slow query (%.3f s) issued by %s%s: %s",
+            query.elapsed,
+            query.helper,
+            " (lazy load of %s)" % query.lazy_load if query.lazy_load else "",
+            query.statement,
+        )
+
+        with self._lock:
+            if len(self.slow_queries) < self.max_slow_queries:
+                self.slow_queries.append(query)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = QueryCounts()
+            self.by_helper = {}
+            self.by_lazy_load = {}
+            self.slow_queries = []
+
+    def statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.total.as_dict(),
+                "by_helper": {
+                    helper: counts.as_dict()
+                    for helper, counts in self.by_helper.items()
+                },
+                "by_lazy_load": {
+                    relationship: counts.as_dict()
+                    for relationship, counts in self.by_lazy_load.items()
+                },
+                "slow_queries": [query._asdict() for query in self.slow_queries],
+            }
+
+    def summary(self) -> str:
+        """Formats the statistics as a human-readable report (with the most frequent helpers and lazy loads first)"""
+        with self._lock:
+            lines = [
+                "Query statistics: %d statements, %d rows, %.3f s"
+                % (self.total.statements, self.total.rows, self.total.elapsed)
+            ]
+
+            for title, counts in [
+                ("helper", self.by_helper),
+                ("lazy load", self.by_lazy_load),
+            ]:
+                if len(counts) == 0:
+                    continue
+
+                lines.append(
+                    "  %12s %12s %12s  %s" % ("statements", "rows", "time [s]", title)
+                )
+                for name, current in sorted(
+                    counts.items(), key=lambda item: -item[1].statements
+                ):
+                    lines.append(
+                        "  %12d %12d %12.3f  %s"
+                        % (current.statements, current.rows, current.elapsed, name)
+                    )
+
+            for query in self.slow_queries:
+                lines.append(
+                    "  Slow query (%.3f s) issued by %s%s:"
+                    % (
+                        query.elapsed,
+                        query.helper,
+                        (
+                            " (lazy load of %s)" % query.lazy_load
+                            if query.lazy_load
+                            else ""
+                        ),
+                    )
+                )
+                lines.extend("    " + line for line in query.statement.splitlines())
+                if query.plan is not None:
+                    lines.append("    Query plan:")
+                    lines.extend("      " + line for line in query.plan)
+
+        return "\n".join(lines)
+
+    def dump(self, file: Optional[TextIO] = None) -> None:
+        """Writes the summary to the given file (stderr by default)"""
+        print(self.summary(), file=file if file is not None else sys.stderr)
+
+
+def _explain(cursor, statement: str, parameters) -> Optional[List[str]]:
+    try:
+        # Use a separate cursor in order to not interfere with fetching the rows of the explained statement
+        plan = cursor.connection.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [str(row[-1]) for row in plan]
+    except Exception:
+        return None
+
+
+def get_query_statistics(session: Session) -> Optional[QueryStatistics]:
+    """Returns the QueryStatistics attached to the given session (None if instrumentation is not enabled)"""
+    return session.info.get(_SESSION_INFO_KEY)
+
+
+def enable_query_statistics(
+    session: Session, statistics: Optional[QueryStatistics] = None
+) -> QueryStatistics:
+    """Attaches the given QueryStatistics (a new one by default) to the given session, such that all statements
+    the session executes from now on are counted. This works by means of cursor execution events on the
+    connections the session uses, so statements executed directly on the session's connection (e.g. via
+    session.connection()) are included. Calling this function on a session that already has statistics attached
+    returns the existing statistics.
+    """
+    existing = get_query_statistics(session)
+    if existing is not None:
+        return existing
+
+    if statistics is None:
+        statistics = QueryStatistics()
+    session.info[_SESSION_INFO_KEY] = statistics
+
+    def before_cursor_execute(
+        connection, cursor, statement, parameters, context, executemany
+    ):
+        current = get_query_statistics(session)
+        if current is None:
+            return
+
+        lazy_loads = current._lazy_loads()
+        helper = _calling_helper()
+        lazy_load = lazy_loads[-1] if len(lazy_loads) > 0 else None
+        context._data_manager_query = (current, helper, lazy_load, time.perf_counter())
+
+        if hasattr(cursor, "row_factory") and cursor.row_factory is None:
+            # Count returned rows as they are fetched (this only works for sqlite3's cursors)
+            def count_row(cursor, row):
+                current._record(helper, lazy_load, rows=1, elapsed=0.0, statements=0)
+                return row
+
+            cursor.row_factory = count_row
+
+    def after_cursor_execute(
+        connection, cursor, statement, parameters, context, executemany
+    ):
+        query = getattr(context, "_data_manager_query", None)
+        if query is None:
+            return
+
+        current, helper, lazy_load, start = query
+        elapsed = time.perf_counter() - start
+
+        # For data modifications, the rowcount is the number of modified rows (it's -1 for queries)
+        current._record(
+            helper, lazy_load, rows=max(cursor.rowcount, 0), elapsed=elapsed
+        )
+
+        if (
+            current.slow_query_threshold is not None
+            and elapsed >= current.slow_query_threshold
+        ):
+            current._record_slow_query(
+                SlowQuery(
+                    statement=statement,
+                    parameters=parameters,
+                    elapsed=elapsed,
+                    helper=helper,
+                    lazy_load=lazy_load,
+                    plan=(
+                        _explain(cursor, statement, parameters)
+                        if current.explain and not executemany
+                        else None
+                    ),
+                )
+            )
+
+    def instrument_connection(connection) -> None:
+        if not event.contains(
+            connection, "before_cursor_execute", before_cursor_execute
+        ):
+            event.listen(connection, "before_cursor_execute", before_cursor_execute)
+            event.listen(connection, "after_cursor_execute", after_cursor_execute)
+
+    def after_begin(session, transaction, connection):
+        instrument_connection(connection)
+
+    def track_lazy_loads(orm_execute_state):
+        current = get_query_statistics(session)
+        if (
+            current is None
+            or not orm_execute_state.is_relationship_load
+            or orm_execute_state.lazy_loaded_from is None
+        ):
+            return None
+
+        lazy_loads = current._lazy_loads()
+        lazy_loads.append(str(orm_execute_state.loader_strategy_path[-1]))
+        try:
+            return orm_execute_state.invoke_statement()
+        finally:
+            lazy_loads.pop()
+
+    event.listen(session, "after_begin", after_begin)
+    event.listen(session, "do_orm_execute", track_lazy_loads)
+
+    if session.in_transaction():
+        # Connections that have already been begun won't trigger after_begin anymore
+        instrument_connection(session.connection())
+
+    return statistics
+
+
+def disable_query_statistics(session: Session) -> Optional[QueryStatistics]:
+    """Detaches the QueryStatistics (if any) from the given session and returns them. The event listeners stay
+    registered but no longer have any effect."""
+    return session.info.pop(_SESSION_INFO_KEY, None)
+
+
+class InstrumentedSession(Session):
+    """Session that dumps its QueryStatistics (see enable_query_statistics) to stderr when it's closed, such that
+    the statistics of every session end up in the log of the job that used it (see open_database's instrument
+    argument)"""
+
+    def close(self) -> None:
+        super().close()
+
+        statistics = get_query_statistics(self)
+        # Closing a session more than once must not repeat the report
+        if statistics is not None and statistics.total.statements > self.info.get(
+            _DUMPED_INFO_KEY, 0
+        ):
+            self.info[_DUMPED_INFO_KEY] = statistics.total.statements
+            statistics.dump()
@@ -0,0 +1,124 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Type
+
+from sqlalchemy import Select
+from sqlalchemy.orm import RelationshipProperty, joinedload, selectinload
+
+from data_manager.orm import Project, ProcessingStep, Result
+
+
+class LoadingProfile(NamedTuple):
+    """Set of relationships that are loaded eagerly along with objects of the given entity. Relationships are given
+    as dotted paths relative to the entity (e.g. "results._properties" for the properties of a step's results).
+    Collections are loaded via selectinload (one additional query per relationship) and many-to-one relationships
+    via joinedload (no additional query), such that the number of queries doesn't depend on the number of objects.
+    """
+
+    entity: Type
+    relationships: Sequence[str]
+
+
+LOADING_PROFILES: Dict[str, LoadingProfile] = {
+    "step-full": LoadingProfile(
+        ProcessingStep,
+        [
+            "host",
+            "system",
+            "keywords",
+            "_properties",
+            "results",
+            "results._properties",
+            "results.collection",
+        ],
+    ),
+    "step-graph": LoadingProfile(
+        ProcessingStep,
+        ["host", "system", "preceding_steps", "dependent_steps"],
+    ),
+    "results-with-properties": LoadingProfile(Result, ["_properties", "collection"]),
+}
+
+# Relationship paths that lead from the entity of a query to the entity of a profile
+_PARENT_PATHS: Dict[tuple, str] = {
+    (Project, ProcessingStep): "processing_steps",
+    (ProcessingStep, Result): "results",
+    (Project, Result): "processing_steps.results",
+}
+
+
+def register_loading_profile(
+    name: str, entity: Type, relationships: Sequence[str]
+) -> None:
+    """Makes the given profile available under the given name (see loading_options)"""
+    # Resolve the relationships right away, such that typos are reported early
+    _relationship_options(entity, relationships)
+
+    LOADING_PROFILES[name] = LoadingProfile(entity, list(relationships))
+
+
+def _relationship_options(entity: Type, paths: Sequence[str]) -> List:
+    options = []
+    for path in paths:
+        option = None
+        current = entity
+        for name in path.split("."):
+            attribute = getattr(current, name, None)
+            relationship = getattr(attribute, "property", None)
+            if attribute is None or not isinstance(relationship, RelationshipProperty):
+                raise RuntimeError(
+                    "'%s' is not a relationship of %s" % (name, current.__name__)
+                )
+
+            if relationship.uselist:
+                option = (
+                    selectinload(attribute)
+                    if option is None
+                    else option.selectinload(attribute)
+                )
+            else:
+                option = (
+                    joinedload(attribute)
+                    if option is None
+                    else option.joinedload(attribute)
+                )
+            current = relationship.mapper.class_
+
+        options.append(option)
+
+    return options
+
+
+def loading_options(profile: str, entity: Optional[Type] = None) -> List:
+    """Returns the loader options that implement the given (named) loading profile (see LOADING_PROFILES) for a
+    query whose primary entity is the given one (the profile's own entity by default). Profiles for steps can be
+    used in queries for Projects and profiles for Results in queries for Projects and ProcessingSteps. In that
+    case, the objects of the profile's entity are loaded eagerly as well. Pass the returned options to
+    Select.options or Session.get."""
+    if profile not in LOADING_PROFILES:
+        raise RuntimeError(
+            "Unknown loading profile '%s' - available profiles are: %s"
+            % (profile, ", ".join(LOADING_PROFILES))
+        )
+
+    target, relationships = LOADING_PROFILES[profile]
+    if entity is None or entity is target:
+        return _relationship_options(target, relationships)
+
+    if (entity, target) not in _PARENT_PATHS:
+        raise RuntimeError(
+            "Loading profile '%s' (for %s) can't be applied to queries for %s"
+            % (profile, target.__name__, entity.__name__)
+        )
+
+    prefix = _PARENT_PATHS[(entity, target)]
+    return _relationship_options(
+        entity, [prefix] + [prefix + "." + path for path in relationships]
+    )
+
+
+def with_loading_profile(statement: Select, profile: str) -> Select:
+    """Applies the given (named) loading profile to the given query, e.g.
+    with_loading_profile(select(Project).where(Project.name == "Test"), "step-full") loads the project along with
+    all of its steps, their results and properties, hosts, systems and keywords in a constant number of queries.
+    """
+    entity = statement.column_descriptions[0]["entity"]
+    return statement.options(*loading_options(profile, entity))
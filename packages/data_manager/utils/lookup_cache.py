@@ -0,0 +1,130 @@
+from typing import Optional, Any, Tuple, Type, Dict, Set
+
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_SESSION_INFO_KEY = "data_manager.lookup_cache"
+_LISTENERS_INFO_KEY = "data_manager.lookup_cache.listeners"
+
+
+class LookupCache:
+    """Least-recently-used cache of lookup entities (Projects, Authors, Systems, Hosts and Keywords) that the
+    get_or_create helpers consult before querying the database. Entries are keyed by the entity class and the
+    values the helper has been called with (e.g. (name, variant) for Systems). Use enable_lookup_cache to attach a
+    cache to a session.
+    Note that a cached entry is returned as long as it is in the cache, even if objects that would render the
+    lookup ambiguous have been created in the meantime by other means than the get_or_create helpers.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        assert max_size > 0
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[Type, Tuple], Any]" = OrderedDict()
+        # Reverse mapping (keyed by id(object)), which allows to efficiently discard objects
+        self._keys: Dict[int, Set[Tuple[Type, Tuple]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, cls: Type, key: Tuple) -> Optional[Any]:
+        entry = self._entries.get((cls, key))
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end((cls, key))
+
+        return entry
+
+    def put(self, cls: Type, key: Tuple, object: Any) -> None:
+        self._remove((cls, key))
+
+        self._entries[(cls, key)] = object
+        self._keys.setdefault(id(object), set()).add((cls, key))
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, cache_key: Tuple[Type, Tuple]) -> None:
+        object = self._entries.pop(cache_key, None)
+        if object is None:
+            return
+
+        keys = self._keys[id(object)]
+        keys.discard(cache_key)
+        if len(keys) == 0:
+            del self._keys[id(object)]
+
+    def discard(self, object: Any) -> None:
+        """Removes all entries referring to the given object"""
+        for cache_key in list(self._keys.get(id(object), ())):
+            self._remove(cache_key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys.clear()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def get_lookup_cache(session: Session) -> Optional[LookupCache]:
+    """Returns the LookupCache attached to the given session (None if caching is not enabled)"""
+    return session.info.get(_SESSION_INFO_KEY)
+
+
+def enable_lookup_cache(session: Session, max_size: int = 1024) -> LookupCache:
+    """Attaches a LookupCache (holding at most max_size entries) to the given session, such that repeated calls to
+    the get_or_create helpers for the same entity are served without querying the database. Newly created entities
+    are cached right away (i.e. while they are still pending). The cache is cleared whenever the session's
+    transaction is rolled back (which discards pending objects) and deleted or expunged objects are removed from
+    it. Calling this function on a session that already has a cache returns the existing cache.
+    """
+    cache = get_lookup_cache(session)
+    if cache is not None:
+        return cache
+
+    cache = LookupCache(max_size)
+    session.info[_SESSION_INFO_KEY] = cache
+
+    def clear_cache(session, previous_transaction):
+        cache.clear()
+
+    def discard_object(session, instance):
+        cache.discard(instance)
+
+    listeners = [
+        ("after_soft_rollback", clear_cache),
+        ("persistent_to_deleted", discard_object),
+        ("pending_to_transient", discard_object),
+        ("persistent_to_detached", discard_object),
+    ]
+    for identifier, listener in listeners:
+        event.listen(session, identifier, listener)
+    session.info[_LISTENERS_INFO_KEY] = listeners
+
+    return cache
+
+
+def disable_lookup_cache(session: Session) -> None:
+    """Detaches the LookupCache (if any) from the given session and removes its event listeners"""
+    cache = session.info.pop(_SESSION_INFO_KEY, None)
+    if cache is not None:
+        cache.clear()
+
+    for identifier, listener in session.info.pop(_LISTENERS_INFO_KEY, []):
+        event.remove(session, identifier, listener)
@@ -0,0 +1,303 @@
+from typing import List, Dict, Callable, Any, Tuple, Set, Optional
+
+from sqlalchemy import (
+    Engine,
+    Connection,
+    Table,
+    MetaData,
+    Index,
+    inspect,
+    select,
+    insert,
+    update,
+    bindparam,
+    tuple_,
+)
+from sqlalchemy.schema import CreateColumn
+
+from data_manager.orm import Base, Result, TypedPropertyValue, PropertyString
+from data_manager.orm.PropertyString import interned_strings
+
+
+def _add_column(connection: Connection, table: Table, column_name: str) -> None:
+    column = table.c[column_name]
+
+    if not column.nullable and column.server_default is None:
+        raise RuntimeError(
+            "Can't add column '%s' to existing table '%s' as it is neither nullable nor has a server default"
+            % (column_name, table.name)
+        )
+
+    connection.exec_driver_sql(
+        "ALTER TABLE %s ADD COLUMN %s"
+        % (
+            connection.dialect.identifier_preparer.format_table(table),
+            CreateColumn(column).compile(dialect=connection.dialect),
+        )
+    )
+
+
+def _interned_columns(table: Table) -> Dict[str, str]:
+    """Maps the names of the ID columns of all interned strings (see PropertyString) of the given table onto the
+    names of the columns that stored the plain strings before strings have been interned
+    """
+    columns: Dict[str, str] = {}
+    for mapper in Base.registry.mappers:
+        if mapper.local_table is table:
+            for attribute in interned_strings(mapper.class_):
+                id_column = mapper.attrs[attribute.id_attribute].columns[0]
+                columns[id_column.name] = attribute.name
+
+    return columns
+
+
+def _rebuild_with_interned_strings(
+    connection: Connection,
+    table: Table,
+    interned_columns: Dict[str, str],
+    existing_indexes: List[str],
+) -> None:
+    """Rebuilds a table that stores plain strings in the given (legacy) columns into one referencing the strings'
+    entries in PropertyString. SQLite can't change primary keys of existing tables, so the table is renamed, created
+    anew and the data is copied over."""
+    legacy_name = "_legacy_" + table.name
+
+    for index in existing_indexes:
+        connection.exec_driver_sql("DROP INDEX %s" % index)
+
+    connection.exec_driver_sql(
+        "ALTER TABLE %s RENAME TO %s" % (table.name, legacy_name)
+    )
+    table.create(connection)
+
+    legacy = Table(legacy_name, MetaData(), autoload_with=connection)
+
+    for legacy_column in interned_columns.values():
+        PropertyString.ids(
+            connection,
+            connection.scalars(select(legacy.c[legacy_column]).distinct()).all(),
+        )
+
+    copied_columns = [column.name for column in table.c if column.name in legacy.c]
+    query = select(*[legacy.c[name] for name in copied_columns])
+    for id_column, legacy_column in interned_columns.items():
+        strings = PropertyString.__table__.alias()
+        query = query.add_columns(strings.c.id).join(
+            strings, strings.c.string == legacy.c[legacy_column]
+        )
+
+    connection.execute(
+        insert(table).from_select(copied_columns + list(interned_columns), query)
+    )
+    connection.exec_driver_sql("DROP TABLE %s" % legacy_name)
+
+
+def _backfill(
+    engine: Engine,
+    table: Table,
+    source_columns: List[str],
+    target_column: str,
+    convert: Callable[..., Any],
+    batch_size: int,
+) -> None:
+    """Sets target_column = convert(*source_columns) for all rows of the given table in which it is NULL. The rows
+    are streamed in primary key order in batches of batch_size rows, each of which is updated and committed in a
+    transaction of its own, such that neither the memory consumption nor the size of the transaction grows with the
+    size of the table."""
+    primary_key = list(table.primary_key.columns)
+
+    statement = update(table).values({target_column: bindparam("_target")})
+    for column in primary_key:
+        statement = statement.where(column == bindparam("_pk_" + column.name))
+
+    query = (
+        select(*primary_key, *[table.c[name] for name in source_columns])
+        .where(table.c[target_column].is_(None))
+        .order_by(*primary_key)
+        .limit(batch_size)
+    )
+
+    last_key = None
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                query
+                if last_key is None
+                else query.where(tuple_(*primary_key) > tuple_(*last_key))
+            ).all()
+            if len(rows) == 0:
+                return
+
+            updates: List[Dict[str, Any]] = []
+            for row in rows:
+                target = convert(*row[len(primary_key) :])
+                if target is None:
+                    continue
+
+                current = {"_target": target}
+                current.update(
+                    {
+                        "_pk_" + column.name: row[i]
+                        for i, column in enumerate(primary_key)
+                    }
+                )
+                updates.append(current)
+
+            if len(updates) > 0:
+                connection.execute(statement, updates)
+
+        last_key = tuple(rows[-1][: len(primary_key)])
+
+
+def _result_number(data_type: str, data_value: str):
+    if data_type not in ("int", "float"):
+        return None
+
+    return Result.to_number(Result.decode_data(data_type, data_value))
+
+
+def _derived_columns(table: Table) -> List[Tuple[str, List[str], Callable[..., Any]]]:
+    """Returns (target column, source columns, conversion) for every column of the given table whose value is derived
+    from other columns of the same row"""
+    if table.name == Result.__tablename__:
+        return [("_data_number", ["_data_type", "_data_value"], _result_number)]
+    if "numeric_value" in table.c and "value" in table.c:
+        return [("numeric_value", ["value"], TypedPropertyValue.to_numeric)]
+
+    return []
+
+
+def needs_upgrade(engine: Engine) -> bool:
+    """Checks whether the given database lacks any of the tables, columns or indexes of the current ORM (in which
+    case it has to be brought up to date via upgrade_database)"""
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                return True
+
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            if any(column.name not in existing_columns for column in table.columns):
+                return True
+
+            existing_indexes = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+            if any(index.name not in existing_indexes for index in table.indexes):
+                return True
+
+    return False
+
+
+def upgrade_database(engine: Engine, batch_size: int = 10000) -> List[str]:
+    """Brings the schema of an existing database up to date with the current ORM: missing tables, columns and
+    indexes are created and property tables storing plain keyword strings are converted to reference
+    PropertyString, all of which happens in a single transaction. Afterwards, derived columns that have been added
+    to existing tables (the native numeric copy of Result data and the numeric shadow column of properties) are
+    filled in for the already stored rows in batches of batch_size rows (see _backfill). The indexes on those
+    columns are only created once they have been filled in completely, so an interrupted upgrade is resumed by
+    calling this function again. Returns a description of every applied change (empty if the database already
+    was up to date)."""
+    changes: List[str] = []
+    # (table, target column, source columns, conversion) of all derived columns that still have to be filled in
+    backfills: List[Tuple[Table, str, List[str], Callable[..., Any]]] = []
+    deferred_indexes: List[Index] = []
+
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                # Also creates the table's indexes
+                table.create(connection)
+                changes.append("Created table '%s'" % table.name)
+                continue
+
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            existing_indexes: Set[Optional[str]] = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+
+            interned_columns = _interned_columns(table)
+            if any(
+                id_column not in existing_columns and legacy_column in existing_columns
+                for id_column, legacy_column in interned_columns.items()
+            ):
+                _rebuild_with_interned_strings(
+                    connection,
+                    table,
+                    interned_columns,
+                    [index for index in existing_indexes if index is not None],
+                )
+                changes.append(
+                    "Rebuilt table '%s' with interned %s"
+                    % (table.name, ", ".join(interned_columns.values()))
+                )
+                # Columns that the legacy table didn't have are treated as freshly added ones (see below)
+                added_columns = [
+                    column.name
+                    for column in table.columns
+                    if column.name not in existing_columns
+                    and column.name not in interned_columns
+                ]
+                existing_indexes = {index.name for index in table.indexes}
+            else:
+                added_columns = [
+                    column.name
+                    for column in table.columns
+                    if column.name not in existing_columns
+                ]
+
+                for column_name in added_columns:
+                    _add_column(connection, table, column_name)
+                    changes.append(
+                        "Added column '%s' to table '%s'" % (column_name, table.name)
+                    )
+
+            for target, sources, convert in _derived_columns(table):
+                target_indexes = [
+                    index for index in table.indexes if target in index.columns
+                ]
+                # Only backfill freshly added columns (in up-to-date databases, NULL is a legitimate value for them)
+                # and those of a previously interrupted upgrade (whose indexes have not been created yet)
+                if target not in added_columns and all(
+                    index.name in existing_indexes for index in target_indexes
+                ):
+                    continue
+
+                backfills.append((table, target, sources, convert))
+                for index in target_indexes:
+                    if index.name in existing_indexes:
+                        index.drop(connection)
+                        existing_indexes.remove(index.name)
+                    deferred_indexes.append(index)
+
+            for index in table.indexes:
+                if index.name not in existing_indexes and all(
+                    index is not deferred for deferred in deferred_indexes
+                ):
+                    index.create(connection)
+                    changes.append(
+                        "Created index '%s' on table '%s'" % (index.name, table.name)
+                    )
+
+    for table, target, sources, convert in backfills:
+        _backfill(engine, table, sources, target, convert, batch_size)
+        changes.append("Filled in '%s' of table '%s'" % (target, table.name))
+
+    with engine.begin() as connection:
+        for index in deferred_indexes:
+            index.create(connection)
+            assert index.table is not None
+            changes.append(
+                "Created index '%s' on table '%s'" % (index.name, index.table.name)
+            )
+
+    return changes
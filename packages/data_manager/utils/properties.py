@@ -1,11 +1,37 @@
-from typing import Type, Optional
+from typing import (
+    Type,
+    Optional,
+    Any,
+    Callable,
+    List,
+    Dict,
+    Iterable,
+    NamedTuple,
+    Union,
+    Sequence,
+)
+
+import functools
+import operator
+
+from abc import ABC, abstractmethod
 
 import inspect
 
-from sqlalchemy import select, distinct, and_, or_
+from sqlalchemy import (
+    select,
+    and_,
+    or_,
+    true,
+    false,
+    intersect,
+    union,
+    ColumnElement,
+    Select,
+)
 from sqlalchemy.orm import Session
 
-from data_manager.orm import Base
+from data_manager.orm import Base, PropertyString, TypedPropertyValue
 
 
 def get_property_class(object) -> Type:
@@ -35,41 +61,425 @@ def get_id_member(cls):
     return members[0]
 
 
+def get_keyword_member(property_cls):
+    # Most property classes call their key "keyword", but SystemProperty calls it "name"
+    keyword = getattr(property_cls, "keyword", None)
+    return keyword if keyword is not None else property_cls.name
+
+
+class PropertyMetadata(NamedTuple):
+    """Describes how the properties of a class (e.g. ProcessingStep) are stored"""
+
+    owner_cls: Type
+    property_cls: Type
+    # Column of the property table that references the owning object
+    owner_id: Any
+    # Keyword (an interned string) of the properties and the column holding the keyword's ID
+    keyword: Any
+    keyword_id: Any
+
+
+@functools.lru_cache(maxsize=None)
+def _property_metadata(cls: Type) -> PropertyMetadata:
+    property_cls = get_property_class(cls)
+    keyword = get_keyword_member(property_cls)
+
+    return PropertyMetadata(
+        owner_cls=cls,
+        property_cls=property_cls,
+        owner_id=get_id_member(property_cls),
+        keyword=keyword,
+        keyword_id=keyword.id_column,
+    )
+
+
+def property_metadata(object) -> PropertyMetadata:
+    """Returns the PropertyMetadata of the given class (or of the class of the given object). The metadata is
+    resolved (via reflection) only once per class."""
+    return _property_metadata(object if inspect.isclass(object) else type(object))
+
+
 def get_property_keys(session: Session, object):
-    property_cls = get_property_class(object)
+    metadata = property_metadata(object)
 
-    query = select(distinct(property_cls.keyword))  # type: ignore
+    # Keywords are stored in PropertyString and only referenced by ID from the property tables
+    keyword_ids = select(metadata.keyword_id)
 
     if not inspect.isclass(object):
-        query = query.where(get_id_member(property_cls) == object.id)  # type: ignore
+        keyword_ids = keyword_ids.where(metadata.owner_id == object.id)  # type: ignore
 
-    return session.scalars(query).all()
+    return session.scalars(
+        select(PropertyString.string).where(PropertyString.id.in_(keyword_ids))
+    ).all()
 
 
 def get_property_values(session: Session, object, key: Optional[str] = None):
-    property_cls = get_property_class(object)
+    metadata = property_metadata(object)
 
-    query = select(distinct(property_cls.value))  # type: ignore
+    query = select(metadata.property_cls.value).distinct()  # type: ignore
 
     if not inspect.isclass(object):
-        query = query.where(get_id_member(property_cls) == object.id)  # type: ignore
+        query = query.where(metadata.owner_id == object.id)  # type: ignore
 
     if key is not None:
-        query = query.where(property_cls.keyword == key)  # type: ignore
+        query = query.where(metadata.keyword == key)
 
     return session.scalars(query).all()
 
 
-def has_properties(object, require_all=True, **properties):
-    property_cls = get_property_class(object)
+# Maximum number of IDs per query of get_properties (SQLite limits the number of parameters of a statement)
+_ID_BATCH_SIZE = 10000
+
+
+def get_properties(
+    session: Session,
+    cls: Type,
+    objects: Union[Iterable[Union[Base, int]], Select],
+    keys: Optional[Iterable[str]] = None,
+    typed: bool = False,
+) -> Dict[int, Dict[str, Any]]:
+    """Fetches the properties of many objects of the given class (e.g. Result) at once and returns them as a
+    dictionary mapping the ID of every object to the dictionary of its properties (which is empty for objects
+    without properties). The objects can be given as objects, as IDs or as a query selecting IDs, e.g.
+    select(Result.id).where(Result.kind == "Energy"). A query is evaluated as part of the (single) statement that
+    fetches the properties, whereas given objects or IDs are looked up in batches of up to 10000 per statement.
+    Only the properties with the given keys are fetched if keys is given. With typed, values are converted back
+    to the type they had when they were assigned (see TypedPropertyValue.typed_value) instead of being strings.
+    Unlike accessing the properties attribute of every single object, this doesn't load any ORM objects.
+    """
+    metadata = property_metadata(cls)
+    property_cls = metadata.property_cls
+
+    def convert(value: str, value_type: str) -> Any:
+        return TypedPropertyValue.convert(value, value_type) if typed else value
+
+    key_condition = metadata.keyword.in_(list(keys)) if keys is not None else true()
+
+    properties: Dict[int, Dict[str, Any]] = {}
 
-    join_condition = and_ if require_all else or_
+    if isinstance(objects, Select):
+        owner_ids = objects.subquery()
+        owner_id = owner_ids.c[0]
 
-    conditions = [
-        object.properties.any(
-            and_(property_cls.keyword == key, property_cls.value == str(value)) # type: ignore
+        query = (
+            select(
+                owner_id,
+                PropertyString.string,
+                property_cls.value,
+                property_cls.value_type,
+            )
+            .select_from(owner_ids)
+            .outerjoin(property_cls, and_(metadata.owner_id == owner_id, key_condition))
+            .outerjoin(PropertyString, PropertyString.id == metadata.keyword_id)
         )
-        for key, value in properties.items()
+
+        for id, key, value, value_type in session.execute(query):
+            current = properties.setdefault(id, {})
+            if key is not None:
+                current[key] = convert(value, value_type)
+
+        return properties
+
+    ids = [
+        object if isinstance(object, int) else object.id  # type: ignore
+        for object in objects
     ]
+    for id in ids:
+        properties[id] = {}
+
+    query = (
+        select(
+            metadata.owner_id,
+            PropertyString.string,
+            property_cls.value,
+            property_cls.value_type,
+        )
+        .join(PropertyString, PropertyString.id == metadata.keyword_id)
+        .where(key_condition)
+    )
+
+    for offset in range(0, len(ids), _ID_BATCH_SIZE):
+        batch = ids[offset : offset + _ID_BATCH_SIZE]
+        for id, key, value, value_type in session.execute(
+            query.where(metadata.owner_id.in_(batch))
+        ):
+            properties[id][key] = convert(value, value_type)
+
+    return properties
+
+
+class PropertyTable(NamedTuple):
+    """Columnar representation of the properties of many objects: columns maps every property key onto the list of
+    values of that property (None for objects that don't have it), in the order of ids
+    """
+
+    ids: List[int]
+    columns: Dict[str, List[Any]]
+
+
+def get_property_table(
+    session: Session,
+    cls: Type,
+    objects: Union[Iterable[Union[Base, int]], Select],
+    keys: Optional[Sequence[str]] = None,
+    typed: bool = False,
+) -> PropertyTable:
+    """Like get_properties, but pivots the properties into one column per key (e.g. for building a data frame via
+    pandas.DataFrame(table.columns, index=table.ids)). The columns are the given keys (in the given order) or, by
+    default, all keys that occur (in sorted order)."""
+    properties = get_properties(session, cls, objects, keys=keys, typed=typed)
+
+    if keys is None:
+        keys = sorted({key for current in properties.values() for key in current})
+
+    ids = list(properties)
+    return PropertyTable(
+        ids=ids,
+        columns={key: [properties[id].get(key) for id in ids] for key in keys},
+    )
+
+
+def has_properties(object, require_all: bool = True, **properties) -> ColumnElement:
+    """Builds a condition that is fulfilled by all objects (of the given class) having all (or, if require_all is
+    False, any) of the given properties, whose values are compared as strings. The condition is a compiled
+    PropertyFilter (see compile_property_filter)."""
+    if len(properties) == 0:
+        return true() if require_all else false()
+
+    filter = functools.reduce(
+        operator.and_ if require_all else operator.or_,
+        [PropertyKey(key) == str(value) for key, value in properties.items()],
+    )
+
+    return compile_property_filter(object, filter)
+
+
+_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _comparison_condition(property_cls, comparison: str, value: Any) -> ColumnElement:
+    if comparison not in _COMPARISONS:
+        raise RuntimeError("Unsupported comparison '%s'" % comparison)
+
+    if _is_number(value):
+        return _COMPARISONS[comparison](property_cls.numeric_value, value)
+    else:
+        return _COMPARISONS[comparison](property_cls.value, str(value))
+
+
+def _range_condition(
+    property_cls, minimum: Optional[float], maximum: Optional[float]
+) -> ColumnElement:
+    conditions = [property_cls.numeric_value.is_not(None)]
+    if minimum is not None:
+        conditions.append(property_cls.numeric_value >= minimum)
+    if maximum is not None:
+        conditions.append(property_cls.numeric_value <= maximum)
+
+    return and_(*conditions)
+
+
+def property_compares(object, key: str, comparison: str, value: Any) -> ColumnElement:
+    """Builds a condition that is fulfilled by all objects (of the given class) having a property with the given
+    key whose value compares to the given value as specified by comparison (one of ==, !=, <, <=, >, >=).
+    Comparisons with numbers are done on the numeric representation of the property values (only properties that
+    represent a number can match) whereas all other values are compared as strings. As the comparison is done in
+    SQL, the result can be used directly in a where clause, e.g.
+    select(ProcessingStep).where(property_compares(ProcessingStep, "cardinality", ">=", 3))
+    """
+    metadata = property_metadata(object)
+
+    return object.properties.any(
+        and_(
+            metadata.keyword == key,
+            _comparison_condition(metadata.property_cls, comparison, value),
+        )
+    )
+
+
+def property_in_range(
+    object, key: str, minimum: Optional[float] = None, maximum: Optional[float] = None
+) -> ColumnElement:
+    """Builds a condition that is fulfilled by all objects (of the given class) having a numeric property with the
+    given key whose value lies within [minimum, maximum] (either bound may be omitted)
+    """
+    metadata = property_metadata(object)
+
+    return object.properties.any(
+        and_(
+            metadata.keyword == key,
+            _range_condition(metadata.property_cls, minimum, maximum),
+        )
+    )
+
+
+class PropertyFilter(ABC):
+    """A boolean expression over conditions on the properties of an object. Filters are created via PropertyKey
+    and can be combined using & (and), | (or) and ~ (not), e.g.
+    (PropertyKey("basis") == "cc-pVTZ") & ~(PropertyKey("temperature").between(200, 300))
+    Use compile_property_filter to turn a filter into a condition that can be used in a where clause.
+    """
+
+    def __and__(self, other: "PropertyFilter") -> "PropertyFilter":
+        return _Combination(conjunction=True, operands=[self, other])
+
+    def __or__(self, other: "PropertyFilter") -> "PropertyFilter":
+        return _Combination(conjunction=False, operands=[self, other])
+
+    def __invert__(self) -> "PropertyFilter":
+        return _Negation(self)
+
+    @abstractmethod
+    def _evaluate(
+        self,
+        leaf_value: Callable[["_Predicate"], Any],
+        conjunction: Callable[[List[Any]], Any],
+        disjunction: Callable[[List[Any]], Any],
+        negation: Callable[[Any], Any],
+    ) -> Any:
+        """Evaluates this filter with its predicates replaced by leaf_value(predicate) and its boolean operators
+        replaced by the given functions"""
+        pass
+
+
+class _Predicate(PropertyFilter):
+    def __init__(self, key: str, condition: Callable[[Type], ColumnElement]):
+        self.key = key
+        self.condition = condition
+
+    def _evaluate(self, leaf_value, conjunction, disjunction, negation) -> Any:
+        return leaf_value(self)
+
+
+class _Combination(PropertyFilter):
+    def __init__(self, conjunction: bool, operands: List[PropertyFilter]):
+        self.conjunction = conjunction
+        # Flatten nested combinations of the same kind, e.g. (a & b) & c -> &(a, b, c)
+        self.operands = [
+            nested
+            for operand in operands
+            for nested in (
+                operand.operands
+                if isinstance(operand, _Combination)
+                and operand.conjunction == conjunction
+                else [operand]
+            )
+        ]
+
+    def _evaluate(self, leaf_value, conjunction, disjunction, negation) -> Any:
+        values = [
+            operand._evaluate(leaf_value, conjunction, disjunction, negation)
+            for operand in self.operands
+        ]
+        return conjunction(values) if self.conjunction else disjunction(values)
+
+
+class _Negation(PropertyFilter):
+    def __init__(self, operand: PropertyFilter):
+        self.operand = operand
+
+    def _evaluate(self, leaf_value, conjunction, disjunction, negation) -> Any:
+        return negation(
+            self.operand._evaluate(leaf_value, conjunction, disjunction, negation)
+        )
+
+
+class PropertyKey:
+    """Entry point for building PropertyFilters: comparing a PropertyKey with a value yields a filter that is
+    fulfilled by objects having a property with this key whose value compares accordingly (see property_compares
+    for how numbers and other values are compared)"""
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def _compare(self, comparison: str, value: Any) -> PropertyFilter:
+        # Validate eagerly, such that errors show up where the filter is built
+        if comparison not in _COMPARISONS:
+            raise RuntimeError("Unsupported comparison '%s'" % comparison)
+
+        return _Predicate(
+            self.key,
+            lambda property_cls: _comparison_condition(property_cls, comparison, value),
+        )
+
+    def __eq__(self, value) -> PropertyFilter:  # type: ignore[override]
+        return self._compare("==", value)
+
+    def __ne__(self, value) -> PropertyFilter:  # type: ignore[override]
+        return self._compare("!=", value)
+
+    def __lt__(self, value) -> PropertyFilter:
+        return self._compare("<", value)
+
+    def __le__(self, value) -> PropertyFilter:
+        return self._compare("<=", value)
+
+    def __gt__(self, value) -> PropertyFilter:
+        return self._compare(">", value)
+
+    def __ge__(self, value) -> PropertyFilter:
+        return self._compare(">=", value)
+
+    def between(
+        self, minimum: Optional[float] = None, maximum: Optional[float] = None
+    ) -> PropertyFilter:
+        return _Predicate(
+            self.key,
+            lambda property_cls: _range_condition(property_cls, minimum, maximum),
+        )
+
+    def exists(self) -> PropertyFilter:
+        return _Predicate(self.key, lambda property_cls: true())
+
+
+def compile_property_filter(object, filter: PropertyFilter) -> ColumnElement:
+    """Compiles the given filter into a condition on the given class (e.g. ProcessingStep) that can be used in a
+    where clause. Instead of one correlated EXISTS subquery per predicate (as property_compares produces), which is
+    evaluated for every candidate object, the set of matching objects is computed directly: every predicate
+    becomes a lookup of the owners of matching property rows via the (keyword, value) or (keyword, numeric_value)
+    index and the boolean operators are mapped onto INTERSECT (and), UNION (or) and EXCEPT (not).
+    """
+    metadata = property_metadata(object)
+    property_cls = metadata.property_cls
+    owner_id = metadata.owner_id
+    keyword = metadata.keyword
+
+    def matching_owners(leaf: _Predicate) -> Select:
+        return (
+            select(owner_id)
+            .where(keyword == leaf.key)
+            .where(leaf.condition(property_cls))
+        )
+
+    def complement(owners: Select) -> Select:
+        return select(object.id).except_(owners)  # type: ignore
+
+    def combine(set_operation, operands: List[Select]) -> Select:
+        if len(operands) == 1:
+            return operands[0]
+        # SQLite doesn't support parenthesized compound selects, so every operand becomes a subquery
+        return select(
+            set_operation(*[select(operand.subquery()) for operand in operands])
+            .subquery()
+            .c[0]
+        )
+
+    matching = filter._evaluate(
+        matching_owners,
+        conjunction=lambda operands: combine(intersect, operands),
+        disjunction=lambda operands: combine(union, operands),
+        negation=complement,
+    )
 
-    return join_condition(*conditions)
+    return object.id.in_(matching)
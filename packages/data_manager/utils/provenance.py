@@ -0,0 +1,453 @@
+from typing import (
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from collections import deque
+from itertools import chain
+
+from sqlalchemy import (
+    select,
+    delete,
+    literal,
+    and_,
+    or_,
+    true,
+    union_all,
+    bindparam,
+    func,
+    event,
+    Connection,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, sessionmaker, attributes
+from sqlalchemy.orm.base import PASSIVE_NO_INITIALIZE
+
+from data_manager.orm import ProcessingStep
+from data_manager.orm.ProcessingStep import step_hierarchy, step_closure
+
+
+class StepGraph(NamedTuple):
+    """Subgraph of the processing step DAG as obtained from get_ancestors/get_descendants"""
+
+    # Reached steps by ID (the step the traversal started from is not included)
+    steps: Dict[int, ProcessingStep]
+    # All traversed edges as (preceding_step_id, dependent_step_id) pairs
+    edges: Set[Tuple[int, int]]
+    # Distance (in edges) of every reached step from the step the traversal started from
+    depths: Dict[int, int]
+
+
+def _step_id(step: Union[ProcessingStep, int]) -> int:
+    step_id = step if isinstance(step, int) else step.id
+    assert step_id is not None
+    return step_id
+
+
+def _traverse(
+    session: Session,
+    step: Union[ProcessingStep, int],
+    upwards: bool,
+    max_depth: Optional[int],
+    kinds: Optional[Iterable[str]],
+) -> StepGraph:
+    step_id = _step_id(step)
+    assert max_depth is None or max_depth >= 0
+
+    if upwards:
+        near = step_hierarchy.c.dependent_step_id
+    else:
+        near = step_hierarchy.c.preceding_step_id
+
+    def far_end(edges):
+        return edges.c.preceding_step_id if upwards else edges.c.dependent_step_id
+
+    columns = [
+        step_hierarchy.c.preceding_step_id.label("preceding_step_id"),
+        step_hierarchy.c.dependent_step_id.label("dependent_step_id"),
+    ]
+
+    if max_depth is None:
+        # Without a depth limit, the CTE only consists of edges, which makes the UNION terminate after having
+        # visited every reachable edge once (even for diamond-shaped graphs). Depths are determined afterwards.
+        edges = select(*columns).where(near == step_id).cte(recursive=True)
+        recursive = select(*columns).join(edges, near == far_end(edges))
+    else:
+        edges = (
+            select(*columns, literal(1).label("depth"))
+            .where(near == step_id)
+            .where(literal(max_depth) > 0)
+            .cte(recursive=True)
+        )
+        recursive = (
+            select(*columns, (edges.c.depth + 1).label("depth"))
+            .join(edges, near == far_end(edges))
+            .where(edges.c.depth < max_depth)
+        )
+
+    edges = edges.union(recursive)
+
+    kind_condition = (
+        ProcessingStep.kind.in_(list(kinds)) if kinds is not None else true()
+    )
+
+    query = select(
+        ProcessingStep, edges.c.preceding_step_id, edges.c.dependent_step_id
+    ).outerjoin(
+        ProcessingStep, and_(ProcessingStep.id == far_end(edges), kind_condition)
+    )
+
+    graph = StepGraph(steps={}, edges=set(), depths={})
+    for current, preceding_id, dependent_id in session.execute(query):
+        graph.edges.add((preceding_id, dependent_id))
+        if current is not None:
+            graph.steps[current.id] = current
+
+    # Breadth-first search yields the shortest distance of every step from the origin
+    adjacency: Dict[int, List[int]] = {}
+    for preceding_id, dependent_id in graph.edges:
+        if upwards:
+            adjacency.setdefault(dependent_id, []).append(preceding_id)
+        else:
+            adjacency.setdefault(preceding_id, []).append(dependent_id)
+
+    queue = deque([(step_id, 0)])
+    visited = {step_id}
+    while queue:
+        current_id, depth = queue.popleft()
+        for neighbour in adjacency.get(current_id, []):
+            if neighbour not in visited:
+                visited.add(neighbour)
+                if neighbour in graph.steps:
+                    graph.depths[neighbour] = depth + 1
+                queue.append((neighbour, depth + 1))
+
+    return graph
+
+
+def get_ancestors(
+    session: Session,
+    step: Union[ProcessingStep, int],
+    max_depth: Optional[int] = None,
+    kinds: Optional[Iterable[str]] = None,
+) -> StepGraph:
+    """Determines all steps the given step (directly or indirectly) depends on by means of a single recursive
+    query over the step hierarchy. If max_depth is given, only steps that are at most that many edges away are
+    considered. If kinds is given, only steps of those kinds are contained in the returned steps (the traversal
+    still passes through steps of any kind and all traversed edges are returned)."""
+    return _traverse(session, step, upwards=True, max_depth=max_depth, kinds=kinds)
+
+
+def get_descendants(
+    session: Session,
+    step: Union[ProcessingStep, int],
+    max_depth: Optional[int] = None,
+    kinds: Optional[Iterable[str]] = None,
+) -> StepGraph:
+    """Determines all steps that (directly or indirectly) depend on the given step by means of a single recursive
+    query over the step hierarchy. See get_ancestors for the meaning of max_depth and kinds.
+    """
+    return _traverse(session, step, upwards=False, max_depth=max_depth, kinds=kinds)
+
+
+def _upsert_closure(query):
+    """Inserts the (ancestor_id, descendant_id, depth) rows produced by the given query into the closure table,
+    keeping the smaller depth for already existing pairs"""
+    # SQLite requires a WHERE clause on an INSERT ... SELECT with an ON CONFLICT clause
+    statement = sqlite_insert(step_closure).from_select(
+        ["ancestor_id", "descendant_id", "depth"], query.where(true())
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["ancestor_id", "descendant_id"],
+        set_={"depth": statement.excluded.depth},
+        where=statement.excluded.depth < step_closure.c.depth,
+    )
+
+
+def _recompute_closure(
+    connection: Connection, step_ids: Optional[Collection[int]] = None
+) -> None:
+    """Recomputes all closure rows whose descendant is in step_ids (or the entire closure if step_ids is None)
+    from the current state of the step hierarchy. The closure rows of all other steps are assumed to be correct.
+    """
+    edges = step_hierarchy.c
+
+    if step_ids is None:
+        connection.execute(delete(step_closure))
+        hierarchy = connection.execute(
+            select(edges.preceding_step_id, edges.dependent_step_id)
+        ).all()
+        step_ids = {step_id for edge in hierarchy for step_id in edge}
+    else:
+        if len(step_ids) == 0:
+            return
+        # The IDs are rendered inline in order to not run into SQLite's limit on the number of bound parameters
+        affected = bindparam(
+            "affected_steps", sorted(step_ids), expanding=True, literal_execute=True
+        )
+        connection.execute(
+            delete(step_closure).where(step_closure.c.descendant_id.in_(affected))
+        )
+        hierarchy = connection.execute(
+            select(edges.preceding_step_id, edges.dependent_step_id).where(
+                edges.dependent_step_id.in_(affected)
+            )
+        ).all()
+
+    # Process the affected steps in topological order, such that the closure rows of all preceding steps are
+    # complete by the time a step's ancestors are derived from them
+    pending_parents: Dict[int, int] = {step_id: 0 for step_id in step_ids}
+    children: Dict[int, List[int]] = {}
+    for preceding_id, dependent_id in hierarchy:
+        if preceding_id in pending_parents:
+            pending_parents[dependent_id] += 1
+            children.setdefault(preceding_id, []).append(dependent_id)
+
+    ready = [step_id for step_id, count in pending_parents.items() if count == 0]
+
+    current_step = bindparam("current_step")
+    parents = select(
+        edges.preceding_step_id.label("ancestor_id"), literal(1).label("depth")
+    ).where(edges.dependent_step_id == current_step)
+    indirect = (
+        select(step_closure.c.ancestor_id, step_closure.c.depth + 1)
+        .join(step_hierarchy, edges.preceding_step_id == step_closure.c.descendant_id)
+        .where(edges.dependent_step_id == current_step)
+    )
+    paths = union_all(parents, indirect).subquery()
+    derive_ancestors = step_closure.insert().from_select(
+        ["ancestor_id", "descendant_id", "depth"],
+        select(paths.c.ancestor_id, current_step, func.min(paths.c.depth)).group_by(
+            paths.c.ancestor_id
+        ),
+    )
+
+    processed = 0
+    while ready:
+        step_id = ready.pop()
+        processed += 1
+
+        connection.execute(derive_ancestors, {"current_step": step_id})
+
+        for child in children.get(step_id, []):
+            pending_parents[child] -= 1
+            if pending_parents[child] == 0:
+                ready.append(child)
+
+    if processed != len(pending_parents):
+        raise RuntimeError(
+            "The step hierarchy contains cycles - can't compute its transitive closure"
+        )
+
+
+def _add_closure_edge(
+    connection: Connection, preceding_id: int, dependent_id: int
+) -> None:
+    cycle = connection.execute(
+        select(literal(1))
+        .select_from(step_closure)
+        .where(step_closure.c.ancestor_id == dependent_id)
+        .where(step_closure.c.descendant_id == preceding_id)
+    ).first()
+
+    if preceding_id == dependent_id or cycle is not None:
+        raise RuntimeError(
+            "Making step %d depend on step %d would introduce a cycle into the step hierarchy"
+            % (dependent_id, preceding_id)
+        )
+
+    # Every ancestor of the preceding step (including itself) now reaches every descendant of the dependent step
+    # (including itself)
+    ancestors = union_all(
+        select(step_closure.c.ancestor_id.label("step_id"), step_closure.c.depth).where(
+            step_closure.c.descendant_id == preceding_id
+        ),
+        select(literal(preceding_id).label("step_id"), literal(0).label("depth")),
+    ).subquery()
+    descendants = union_all(
+        select(
+            step_closure.c.descendant_id.label("step_id"), step_closure.c.depth
+        ).where(step_closure.c.ancestor_id == dependent_id),
+        select(literal(dependent_id).label("step_id"), literal(0).label("depth")),
+    ).subquery()
+
+    connection.execute(
+        _upsert_closure(
+            select(
+                ancestors.c.step_id,
+                descendants.c.step_id,
+                ancestors.c.depth + descendants.c.depth + 1,
+            ).join_from(ancestors, descendants, true())
+        )
+    )
+
+
+_DELETED_STEPS = "data_manager.step_closure.deleted_steps"
+_DELETED_DESCENDANTS = "data_manager.step_closure.deleted_descendants"
+
+
+def _collect_deleted_descendants(session: Session, flush_context, instances) -> None:
+    # Once a step has been deleted, the closure no longer knows about its descendants, which is why they have to
+    # be determined before the flush
+    deleted = [
+        current.id
+        for current in session.deleted
+        if isinstance(current, ProcessingStep) and current.id is not None
+    ]
+
+    descendants: Set[int] = set()
+    if len(deleted) > 0:
+        descendants.update(
+            session.connection().scalars(
+                select(step_closure.c.descendant_id).where(
+                    step_closure.c.ancestor_id.in_(deleted)
+                )
+            )
+        )
+        descendants.difference_update(deleted)
+
+    session.info[_DELETED_STEPS] = set(deleted)
+    session.info[_DELETED_DESCENDANTS] = descendants
+
+
+def _update_step_closure(session: Session, flush_context) -> None:
+    added: Set[Tuple[int, int]] = set()
+    removed: Set[Tuple[int, int]] = set()
+
+    for current in chain(session.new, session.dirty):
+        if not isinstance(current, ProcessingStep):
+            continue
+
+        for key, is_preceding in [
+            ("preceding_steps", True),
+            ("dependent_steps", False),
+        ]:
+            history = attributes.get_history(
+                current, key, passive=PASSIVE_NO_INITIALIZE
+            )
+            for other, edges in chain(
+                ((other, added) for other in history.added),
+                ((other, removed) for other in history.deleted),
+            ):
+                if other in session.deleted:
+                    continue
+                edges.add(
+                    (other.id, current.id) if is_preceding else (current.id, other.id)
+                )
+
+    # Edges that have been removed and re-added within the same flush don't change anything
+    unchanged = added & removed
+    added -= unchanged
+    removed -= unchanged
+
+    deleted = session.info.pop(_DELETED_STEPS, set())
+    affected = session.info.pop(_DELETED_DESCENDANTS, set())
+
+    connection = session.connection()
+
+    if len(deleted) > 0:
+        # ON DELETE CASCADE only takes effect if SQLite enforces foreign keys, which is not the case for engines
+        # that have not been set up via configure_sqlite_engine. Leftover edges of deleted steps would otherwise
+        # be picked up again when recomputing the closure of their descendants.
+        connection.execute(
+            delete(step_closure).where(
+                or_(
+                    step_closure.c.ancestor_id.in_(deleted),
+                    step_closure.c.descendant_id.in_(deleted),
+                )
+            )
+        )
+        connection.execute(
+            delete(step_hierarchy).where(
+                or_(
+                    step_hierarchy.c.preceding_step_id.in_(deleted),
+                    step_hierarchy.c.dependent_step_id.in_(deleted),
+                )
+            )
+        )
+
+    if len(removed) > 0:
+        dependent_ids = {dependent_id for _, dependent_id in removed}
+        affected.update(dependent_ids)
+        affected.update(
+            connection.scalars(
+                select(step_closure.c.descendant_id).where(
+                    step_closure.c.ancestor_id.in_(dependent_ids)
+                )
+            )
+        )
+
+    _recompute_closure(connection, affected)
+
+    for preceding_id, dependent_id in sorted(added):
+        _add_closure_edge(connection, preceding_id, dependent_id)
+
+
+def maintain_step_closure(target: Union[Session, sessionmaker]) -> None:
+    """Keeps the transitive closure of the step hierarchy (processing_step_closure) up to date for all changes
+    flushed by the given session (or by all sessions created by the given sessionmaker). Adding a dependency that
+    would create a cycle makes the flush fail with a RuntimeError. Note that changes bypassing the ORM's unit of
+    work (e.g. bulk DELETE statements) are not tracked - use rebuild_step_closure after such changes and before
+    enabling the maintenance on an existing database."""
+    if not event.contains(target, "before_flush", _collect_deleted_descendants):
+        event.listen(target, "before_flush", _collect_deleted_descendants)
+        event.listen(target, "after_flush", _update_step_closure)
+
+
+def rebuild_step_closure(session: Session) -> None:
+    """(Re)computes the entire transitive closure of the step hierarchy"""
+    session.flush()
+    _recompute_closure(session.connection())
+
+
+def depends_on(
+    session: Session,
+    step: Union[ProcessingStep, int],
+    other: Union[ProcessingStep, int],
+) -> bool:
+    """Checks whether step (directly or indirectly) depends on other by means of a single index lookup in the
+    transitive closure of the step hierarchy (see maintain_step_closure)"""
+    return (
+        session.execute(
+            select(literal(1))
+            .select_from(step_closure)
+            .where(step_closure.c.ancestor_id == _step_id(other))
+            .where(step_closure.c.descendant_id == _step_id(step))
+        ).first()
+        is not None
+    )
+
+
+def lookup_ancestors(
+    session: Session, step: Union[ProcessingStep, int], max_depth: Optional[int] = None
+) -> Dict[int, int]:
+    """Looks up the IDs (and depths) of all ancestors of the given step in the transitive closure of the step
+    hierarchy (see maintain_step_closure)"""
+    query = select(step_closure.c.ancestor_id, step_closure.c.depth).where(
+        step_closure.c.descendant_id == _step_id(step)
+    )
+    if max_depth is not None:
+        query = query.where(step_closure.c.depth <= max_depth)
+
+    return {step_id: depth for step_id, depth in session.execute(query)}
+
+
+def lookup_descendants(
+    session: Session, step: Union[ProcessingStep, int], max_depth: Optional[int] = None
+) -> Dict[int, int]:
+    """Looks up the IDs (and depths) of all descendants of the given step in the transitive closure of the step
+    hierarchy (see maintain_step_closure)"""
+    query = select(step_closure.c.descendant_id, step_closure.c.depth).where(
+        step_closure.c.ancestor_id == _step_id(step)
+    )
+    if max_depth is not None:
+        query = query.where(step_closure.c.depth <= max_depth)
+
+    return {step_id: depth for step_id, depth in session.execute(query)}
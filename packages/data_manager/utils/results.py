@@ -1,92 +1,946 @@
-from typing import List, Any
+from typing import (
+    List,
+    Any,
+    Dict,
+    Iterator,
+    Iterable,
+    Tuple,
+    Optional,
+    Set,
+    Callable,
+    NamedTuple,
+    Sized,
+)
 
-from data_manager.orm import Result, ProcessingStep
+from itertools import islice, zip_longest
 
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+import math
+import operator
 
+from data_manager.orm import (
+    Result,
+    ResultProperty,
+    ResultCollection,
+    ProcessingStep,
+    PropertyString,
+    ResultChunk,
+)
+from data_manager.orm.ResultChunk import ChunkedArrayHeader
 
-def insert_collection_result(
-    session: Session, kind: str, processing_step: ProcessingStep, data
-) -> None:
-    nRows = len(data)
-    assert nRows > 0
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import select, insert, and_, cast, func, Integer, Select
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _is_nested(value) -> bool:
+    if isinstance(value, str):
+        return False
 
     try:
-        # Matrix
-        nCols = len(data[0])
-        assert nCols > 0
-
-        try:
-            len(data[0][0])
-            raise RuntimeError("More than 2D objects (matrices) not yet supported")
-        except:
-            pass
-
-        for row in range(nRows):
-            for col in range(len(data[row])):
-                current = Result(
-                    kind=kind, processing_step=processing_step, data=data[row][col]
+        len(value)
+        return True
+    except TypeError:
+        return False
+
+
+def _layout(shape: Tuple[int, ...]) -> str:
+    if len(shape) == 1:
+        return "List"
+    if len(shape) == 2:
+        return "Matrix"
+    return "Tensor"
+
+
+def _strides(shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Returns the distance (in flat indices) between consecutive positions along every dimension of the given
+    shape (in row-major order)"""
+    strides = [1] * len(shape)
+    for dim in range(len(shape) - 2, -1, -1):
+        strides[dim] = strides[dim + 1] * shape[dim + 1]
+
+    return tuple(strides)
+
+
+def _collection_layout(data) -> Tuple[str, Tuple[int, ...]]:
+    """Determines the layout ("List", "Matrix" or "Tensor") and the shape of the given collection, which is either a
+    NumPy array or (arbitrarily deeply) nested sequences. Nested sequences have to be regular, i.e. all sequences at
+    the same depth have to be of the same length and ragged collections are rejected.
+    """
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        shape = tuple(data.shape)
+    else:
+        shape = ()
+        level = [data]
+        while len(level) > 0 and any(_is_nested(current) for current in level):
+            if not all(_is_nested(current) for current in level) or any(
+                len(current) != len(level[0]) for current in level
+            ):
+                raise RuntimeError(
+                    "Ragged collections (nested sequences of differing lengths or depths) are not supported"
                 )
-                current.properties["kind"] = "Matrix"
-                current.properties["indexing"] = "1-based"
-                current.properties["row"] = str(row + 1)
-                current.properties["column"] = str(col + 1)
-                current.properties["original_collection_type"] = type(data).__name__
-                current.properties["total_dimension"] = "{},{}".format(nRows, nCols)
+            shape += (len(level[0]),)
+            level = [element for current in level for element in current]
 
-    except TypeError:
-        # Array
-        for i in range(nRows):
-            current = Result(kind=kind, processing_step=processing_step, data=data[i])
-            current.properties["kind"] = "List"
-            current.properties["indexing"] = "1-based"
-            current.properties["index"] = str(i + 1)
-            current.properties["original_collection_type"] = type(data).__name__
-            current.properties["total_dimension"] = "{}".format(nRows)
+    assert len(shape) > 0 and all(dim > 0 for dim in shape)
 
+    return _layout(shape), shape
 
-def get_collection_result(
+
+def _collection_elements(data, shape: Tuple[int, ...]) -> Iterator[Tuple[int, Any]]:
+    """Yields (flat index, value) for every element of the given collection, where the flat index is the 0-based
+    position of the element in row-major order"""
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        # tolist converts NumPy scalars into the corresponding Python types
+        yield from enumerate(data.ravel().tolist())
+        return
+
+    def elements(current, strides: Tuple[int, ...], offset: int):
+        if len(strides) == 1:
+            for index, value in enumerate(current):
+                yield offset + index, value
+        else:
+            for index, nested in enumerate(current):
+                yield from elements(nested, strides[1:], offset + index * strides[0])
+
+    yield from elements(data, _strides(shape), 0)
+
+
+def _is_zero(value) -> bool:
+    if numpy is not None and isinstance(value, numpy.generic):
+        value = value.item()
+
+    return type(value) in (int, float, bool) and value == 0
+
+
+def _batched(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def _store_collection(
+    session: Session,
+    collection: ResultCollection,
+    elements: Iterable[Tuple[int, Any]],
+    bulk: bool,
+    batch_size: int,
+) -> ResultCollection:
+    """Adds the given collection header along with one Result per given (flat index, value) element"""
+    kind = collection.kind
+    processing_step = collection.processing_step
+
+    session.add(collection)
+
+    data_types: Set[str] = set()
+
+    if not bulk:
+        for index, value in elements:
+            current = Result(
+                kind=kind,
+                processing_step=processing_step,
+                collection=collection,
+                collection_index=index,
+                data=value,
+            )
+            data_types.add(current._data_type)
+
+            session.add(current)
+    else:
+        assert batch_size > 0
+
+        session.flush()
+
+        for batch in _batched(elements, batch_size):
+            result_rows: List[Dict[str, Any]] = [
+                dict(
+                    kind=kind,
+                    processing_step_id=processing_step.id,
+                    collection_id=collection.id,
+                    collection_index=index,
+                    **Result.encode_data(value),
+                )
+                for index, value in batch
+            ]
+            data_types.update(current["_data_type"] for current in result_rows)
+
+            session.execute(
+                insert(Result.metadata.tables[Result.__tablename__]), result_rows
+            )
+
+    if len(data_types) == 1:
+        collection.element_type = data_types.pop()
+
+    return collection
+
+
+def insert_collection_result(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    data,
+    bulk: bool = False,
+    batch_size: int = 10000,
+    sparse: bool = False,
+) -> ResultCollection:
+    """Stores the given List, Matrix or Tensor (nested sequences or a NumPy array of any dimension) as a
+    ResultCollection (describing the collection's layout and shape) and a set of Results (one per element,
+    referencing the collection and carrying the element's flat index) associated with the given processing step.
+    Every processing step can hold at most one collection of a given kind and ragged collections (nested sequences
+    of differing lengths) are rejected with a RuntimeError. If sparse is True, only the nonzero
+    elements are stored (see insert_sparse_collection_result).
+    By default, one ORM object is created per element. In bulk mode, the elements are instead written via batched
+    executemany INSERT statements of (at most) batch_size elements each, which keeps the memory consumption bounded
+    and bypasses the unit of work. Note that bulk mode flushes the session in order for the processing step and the
+    collection to obtain an ID and that the inserted Results are not added to processing_step.results of already
+    loaded objects."""
+    layout, shape = _collection_layout(data)
+
+    elements = _collection_elements(data, shape)
+    if sparse:
+        elements = ((index, value) for index, value in elements if not _is_zero(value))
+
+    collection = ResultCollection(
+        kind=kind,
+        processing_step=processing_step,
+        layout=layout,
+        shape=shape,
+        sparse=sparse,
+        element_type="mixed",
+        original_collection_type=type(data).__name__,
+    )
+
+    return _store_collection(session, collection, elements, bulk, batch_size)
+
+
+def insert_sparse_collection_result(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    shape: Tuple[int, ...],
+    indices: Iterable[Tuple[int, ...]],
+    values: Iterable[Any],
+    bulk: bool = False,
+    batch_size: int = 10000,
+) -> ResultCollection:
+    """Stores a sparse collection of the given shape that is given in coordinate (COO) format, i.e. as the (0-based)
+    indices of its nonzero elements (one tuple per element or a NumPy array with one row per element) along with the
+    corresponding values. Only the given elements are stored, every other element of the collection is zero. The
+    indices have to be unique and there has to be exactly one value per index. See insert_collection_result for the
+    meaning of the remaining arguments.
+    """
+    shape = tuple(int(dim) for dim in shape)
+    if len(shape) == 0 or any(dim <= 0 for dim in shape):
+        raise RuntimeError("Invalid shape of a sparse collection: %s" % (shape,))
+
+    if numpy is not None and isinstance(indices, numpy.ndarray):
+        indices = indices.tolist()
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        values = values.tolist()
+
+    if (
+        isinstance(indices, Sized)
+        and isinstance(values, Sized)
+        and len(indices) != len(values)
+    ):
+        raise RuntimeError(
+            "Got %d indices but %d values for a sparse collection"
+            % (len(indices), len(values))
+        )
+
+    strides = _strides(shape)
+    missing: Any = object()
+
+    def elements():
+        for index, value in zip_longest(indices, values, fillvalue=missing):
+            if index is missing or value is missing:
+                raise RuntimeError(
+                    "The numbers of indices and values of a sparse collection differ"
+                )
+
+            index = tuple(index)
+            if len(index) != len(shape) or not all(
+                0 <= position < dim for position, dim in zip(index, shape)
+            ):
+                raise RuntimeError(
+                    "Index %s is out of bounds for a collection of shape %s"
+                    % (index, shape)
+                )
+
+            yield sum(
+                position * stride for position, stride in zip(index, strides)
+            ), value
+
+    collection = ResultCollection(
+        kind=kind,
+        processing_step=processing_step,
+        layout=_layout(shape),
+        shape=shape,
+        sparse=True,
+        element_type="mixed",
+        original_collection_type="sparse",
+    )
+
+    return _store_collection(session, collection, elements(), bulk, batch_size)
+
+
+def _collection_header(
     session: Session, kind: str, processing_step: ProcessingStep
-) -> List[Any]:
-    result_set = session.scalars(
-        select(Result)
+) -> Optional[ResultCollection]:
+    return session.scalars(
+        select(ResultCollection)
+        .where(ResultCollection.processing_step_id == processing_step.id)
+        .where(ResultCollection.kind == kind)
+    ).one_or_none()
+
+
+def _collection_query(collection: ResultCollection) -> Select:
+    """Builds a query yielding one row per element of the given collection, consisting of the element's raw data
+    columns and the element's flat index"""
+    return select(
+        Result._data_type.label("data_type"),
+        Result._data_value.label("data_value"),
+        Result._data_blob.label("data_blob"),
+        Result.collection_index.label("position"),
+    ).where(Result.collection_id == collection.id)
+
+
+def _fill_value(collection: ResultCollection):
+    """Returns the value of elements of the given collection that are not stored"""
+    if not collection.sparse:
+        return None
+    if collection.element_type == "bool":
+        return False
+
+    return 0.0 if collection.element_type == "float" else 0
+
+
+def _nest(values: List[Any], shape: Tuple[int, ...]) -> List[Any]:
+    """Turns the given flat list (in row-major order) into nested lists of the given shape"""
+    if len(shape) <= 1:
+        return values
+
+    stride = math.prod(shape[1:])
+    return [
+        _nest(values[index * stride : (index + 1) * stride], shape[1:])
+        for index in range(shape[0])
+    ]
+
+
+# Collections that have been stored before ResultCollection has been introduced don't have a header. Instead, their
+# layout is described by bookkeeping properties that are attached to every single element.
+
+
+def _legacy_collection_metadata(
+    session: Session, kind: str, processing_step: ProcessingStep
+) -> Tuple[str, Tuple[int, ...]]:
+    """Determines the layout ("List" or "Matrix") and the total dimension of the given legacy collection. The
+    bookkeeping properties of all elements are validated by a single aggregating query
+    """
+    metadata = session.execute(
+        select(PropertyString.string, ResultProperty.value)
+        .distinct()
+        .join_from(
+            ResultProperty,
+            PropertyString,
+            PropertyString.id == ResultProperty._keyword_id,
+        )
+        .join_from(ResultProperty, Result, Result.id == ResultProperty.result_id)
         .where(Result.kind == kind)
         .where(Result.processing_step_id == processing_step.id)
+        .where(PropertyString.string.in_(["kind", "indexing", "total_dimension"]))
     ).all()
 
-    assert len(result_set) > 0
-
-    data_kind: str = result_set[0].properties["kind"]
+    assert len(metadata) > 0
 
-    data: List[Any] = []
-    for current in result_set:
-        if current.properties["kind"] != data_kind:
+    values: Dict[str, str] = {}
+    for keyword, value in metadata:
+        if keyword in values:
             raise RuntimeError(
                 "The same dataset includes different kinds of data - this is not supported (and a bug?)"
             )
-        assert current.properties["indexing"] == "1-based"
-        if data_kind == "List":
-            index = int(current.properties["index"]) - 1
-            assert index >= 0
+        values[keyword] = value
 
-            if index + 1 > len(data):
-                data.extend([None] * (index + 1 - len(data)))
+    assert values["indexing"] == "1-based"
+    assert values["kind"] in ("List", "Matrix")
 
-            data[index] = current.data
-        else:
-            assert data_kind == "Matrix"
-            row = int(current.properties["row"]) - 1
-            col = int(current.properties["column"]) - 1
-            assert row >= 0
-            assert col >= 0
+    return values["kind"], tuple(
+        int(dim) for dim in values["total_dimension"].split(",")
+    )
+
+
+def _legacy_collection_query(
+    kind: str, processing_step: ProcessingStep, data_kind: str
+) -> Select:
+    """Builds a query yielding one row per element of the given legacy collection, consisting of the element's raw
+    data columns and the element's (1-based) position as integers"""
+    query = select(
+        Result._data_type.label("data_type"),
+        Result._data_value.label("data_value"),
+        Result._data_blob.label("data_blob"),
+    )
+
+    for keyword in ["index"] if data_kind == "List" else ["row", "column"]:
+        alias = aliased(ResultProperty)
+        query = query.add_columns(cast(alias.value, Integer).label(keyword)).join_from(
+            Result, alias, and_(alias.result_id == Result.id, alias.keyword == keyword)
+        )
+
+    return query.where(Result.kind == kind).where(
+        Result.processing_step_id == processing_step.id
+    )
+
+
+def _legacy_position(data_kind: str) -> Callable[[Any], Tuple[int, ...]]:
+    """Returns a function that extracts the (0-based) position of an element from a row of a
+    _legacy_collection_query"""
+    if data_kind == "List":
+        return lambda current: (current.index - 1,)
+
+    assert data_kind == "Matrix"
+    return lambda current: (current.row - 1, current.column - 1)
+
+
+def _array_dtype(data_types: Set[str]):
+    """Determines the dtype of an array holding elements of the given data types"""
+    assert numpy is not None
+
+    if len(data_types) > 0 and data_types <= {"bool"}:
+        return numpy.bool_
+    elif data_types <= {"int"}:
+        return numpy.int64
+    elif data_types <= {"int", "float"}:
+        return numpy.float64
+    else:
+        return object
+
+
+def _parse_values(rows, dtype):
+    """Parses the raw values of the given (numeric or boolean) elements in one go instead of element by element"""
+    assert numpy is not None
+
+    values = numpy.array([current.data_value for current in rows], dtype=str)
+    if dtype is numpy.bool_:
+        return values == "True"
+
+    return values.astype(dtype)
+
+
+def _assemble_array(rows, positions: List[Tuple[int, ...]], shape: Tuple[int, ...]):
+    if numpy is None:
+        raise RuntimeError(
+            "Retrieving collections as arrays requires NumPy to be installed"
+        )
+
+    dtype = _array_dtype({current.data_type for current in rows})
+
+    if dtype is object:
+        values = numpy.empty(len(rows), dtype=object)
+        values[:] = [
+            Result.decode_data(current.data_type, current.data_value, current.data_blob)
+            for current in rows
+        ]
+    else:
+        values = _parse_values(rows, dtype)
+
+    indices = numpy.array(positions, dtype=numpy.int64).reshape(len(rows), len(shape))
+    shape = tuple(
+        max(dim, int(largest) + 1) for dim, largest in zip(shape, indices.max(axis=0))
+    )
+
+    data = (
+        numpy.zeros(shape, dtype=dtype)
+        if dtype is not object
+        else numpy.empty(shape, dtype=object)
+    )
+    data[tuple(indices.T)] = values
+
+    return data
 
+
+def _assemble_list(
+    rows, positions: List[Tuple[int, ...]], shape: Tuple[int, ...]
+) -> List[Any]:
+    values = (
+        Result.decode_data(current.data_type, current.data_value, current.data_blob)
+        for current in rows
+    )
+
+    if len(shape) == 1:
+        data: List[Any] = [None] * shape[0]
+        for (index,), value in zip(positions, values):
+            if index >= len(data):
+                data.extend([None] * (index + 1 - len(data)))
+            data[index] = value
+    else:
+        # Rows keep the length they have been stored with, such that ragged matrices are read back unchanged
+        data = [[] for _ in range(shape[0])]
+        for (row, col), value in zip(positions, values):
             for _ in range(row + 1 - len(data)):
                 data.append([])
-
-            if col + 1 > len(data[row]):
+            if col >= len(data[row]):
                 data[row].extend([None] * (col + 1 - len(data[row])))
-
-            data[row][col] = current.data
+            data[row][col] = value
 
     return data
+
+
+def _assemble_collection(
+    rows, positions: List[int], shape: Tuple[int, ...], fill, as_array: bool
+):
+    """Assembles the given elements (with the given flat indices) into a collection of the given shape, in which
+    elements that are not part of rows are set to fill"""
+    size = math.prod(shape)
+
+    if not as_array:
+        data: List[Any] = [fill] * size
+        for position, current in zip(positions, rows):
+            data[position] = Result.decode_data(
+                current.data_type, current.data_value, current.data_blob
+            )
+
+        return _nest(data, shape)
+
+    if numpy is None:
+        raise RuntimeError(
+            "Retrieving collections as arrays requires NumPy to be installed"
+        )
+
+    dtype = _array_dtype({current.data_type for current in rows})
+
+    if dtype is object:
+        array = numpy.full(size, fill, dtype=object)
+        values = numpy.empty(len(rows), dtype=object)
+        values[:] = [
+            Result.decode_data(current.data_type, current.data_value, current.data_blob)
+            for current in rows
+        ]
+    else:
+        array = numpy.zeros(size, dtype=dtype)
+        values = _parse_values(rows, dtype)
+
+    array[numpy.array(positions, dtype=numpy.int64)] = values
+
+    return array.reshape(shape)
+
+
+def get_collection_result(
+    session: Session, kind: str, processing_step: ProcessingStep, as_array: bool = False
+):
+    """Retrieves a List, Matrix or Tensor that has been stored via insert_collection_result (or
+    insert_sparse_collection_result). The collection's shape is taken from its header, after which all elements
+    (together with their position) are fetched in a single query and are directly written into a preallocated
+    container. Collections stored by older versions (without a header) are reassembled from the bookkeeping
+    properties of their elements instead. By default, this is a (nested) list. If as_array is True, a NumPy array is
+    returned instead (whose dtype is int64 or float64 if all elements are numeric and object otherwise). Elements
+    of sparse collections that have not been stored are zero."""
+    collection = _collection_header(session, kind, processing_step)
+
+    if collection is not None:
+        rows = session.execute(_collection_query(collection)).all()
+        return _assemble_collection(
+            rows,
+            [current.position for current in rows],
+            collection.shape,
+            _fill_value(collection),
+            as_array,
+        )
+
+    data_kind, shape = _legacy_collection_metadata(session, kind, processing_step)
+    rows = session.execute(
+        _legacy_collection_query(kind, processing_step, data_kind)
+    ).all()
+    position = _legacy_position(data_kind)
+
+    positions = [position(current) for current in rows]
+    assert all(index >= 0 for current in positions for index in current)
+
+    if as_array:
+        return _assemble_array(rows, positions, shape)
+
+    return _assemble_list(rows, positions, shape)
+
+
+def get_collection_slice(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    index,
+    as_array: bool = False,
+):
+    """Retrieves part of a collection that has been stored via insert_collection_result (or
+    insert_sparse_collection_result) without loading the entire collection. The part is selected like in basic
+    NumPy indexing: index holds an integer or a slice (with a step of 1) for each of the leading dimensions of the
+    collection, where integers remove the respective dimension from the result. E.g. (2, slice(None), slice(0, 3))
+    selects the first three columns of all rows in the third matrix of a 3D tensor. Selecting a single element
+    returns the element itself. Only the elements inside the selected part are fetched from the database: the part
+    is translated into a range of flat indices (served by the index on the collection's elements) along with a
+    condition on the position along every restricted dimension.
+    Collections stored by older versions (without a header) can't be sliced."""
+    collection = _collection_header(session, kind, processing_step)
+    if collection is None:
+        raise RuntimeError(
+            "Collection '%s' has no header - slicing requires the collection to be stored by a newer version"
+            % kind
+        )
+
+    shape = collection.shape
+    index = index if isinstance(index, tuple) else (index,)
+    if len(index) > len(shape):
+        raise RuntimeError(
+            "Too many indices for a collection of shape %s: %s" % (shape, index)
+        )
+    index += (slice(None),) * (len(shape) - len(index))
+
+    ranges: List[Tuple[int, int]] = []
+    kept_dims: List[int] = []
+    for dim, (extent, current) in enumerate(zip(shape, index)):
+        if isinstance(current, slice):
+            start, stop, step = current.indices(extent)
+            if step != 1:
+                raise RuntimeError("Only slices with a step of 1 are supported")
+            ranges.append((start, max(start, stop)))
+            kept_dims.append(dim)
+        else:
+            position = operator.index(current)
+            if position < 0:
+                position += extent
+            if not 0 <= position < extent:
+                raise RuntimeError(
+                    "Index %d is out of bounds for dimension %d of size %d"
+                    % (current, dim, extent)
+                )
+            ranges.append((position, position + 1))
+
+    strides = _strides(shape)
+    box_shape = tuple(stop - start for start, stop in ranges)
+    box_strides = _strides(box_shape)
+
+    rows = []
+    if all(extent > 0 for extent in box_shape):
+        query = _collection_query(collection).where(
+            Result.collection_index.between(
+                sum(start * stride for (start, _), stride in zip(ranges, strides)),
+                sum((stop - 1) * stride for (_, stop), stride in zip(ranges, strides)),
+            )
+        )
+        for extent, stride, (start, stop) in zip(shape, strides, ranges):
+            if stop - start < extent:
+                query = query.where(
+                    ((Result.collection_index // stride) % extent).between(
+                        start, stop - 1
+                    )
+                )
+
+        rows = session.execute(query).all()
+
+    positions = []
+    for current in rows:
+        position = 0
+        for extent, stride, box_stride, (start, _) in zip(
+            shape, strides, box_strides, ranges
+        ):
+            position += ((current.position // stride) % extent - start) * box_stride
+        positions.append(position)
+
+    if len(kept_dims) == 0:
+        if len(rows) == 0:
+            return _fill_value(collection)
+        return Result.decode_data(
+            rows[0].data_type, rows[0].data_value, rows[0].data_blob
+        )
+
+    return _assemble_collection(
+        rows,
+        positions,
+        tuple(box_shape[dim] for dim in kept_dims),
+        _fill_value(collection),
+        as_array,
+    )
+
+
+class SparseCollection(NamedTuple):
+    shape: Tuple[int, ...]
+    indices: Any
+    values: Any
+
+
+def get_sparse_collection_result(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    as_array: bool = False,
+) -> SparseCollection:
+    """Retrieves the stored elements of a collection that has been stored via insert_sparse_collection_result (or
+    insert_collection_result) in coordinate (COO) format, i.e. without expanding it to its full size. The indices
+    are a list of index tuples (one per element, in row-major order) and the values are a list of the corresponding
+    elements. If as_array is True, indices is an integer array with one row per element and values is a NumPy
+    array instead."""
+    collection = _collection_header(session, kind, processing_step)
+    if collection is None:
+        raise RuntimeError(
+            "Collection '%s' has no header - it has been stored by an older version"
+            % kind
+        )
+
+    shape = collection.shape
+    rows = session.execute(
+        _collection_query(collection).order_by(Result.collection_index)
+    ).all()
+
+    indices = [
+        tuple(
+            (current.position // stride) % extent
+            for extent, stride in zip(shape, _strides(shape))
+        )
+        for current in rows
+    ]
+    values = [
+        Result.decode_data(current.data_type, current.data_value, current.data_blob)
+        for current in rows
+    ]
+
+    if as_array:
+        if numpy is None:
+            raise RuntimeError(
+                "Retrieving collections as arrays requires NumPy to be installed"
+            )
+
+        indices = numpy.array(indices, dtype=numpy.int64).reshape(len(rows), len(shape))
+        array = numpy.empty(
+            len(values), dtype=_array_dtype({current.data_type for current in rows})
+        )
+        array[:] = values
+        values = array
+
+    return SparseCollection(shape, indices, values)
+
+
+def _element_types(session: Session, query: Select) -> Set[str]:
+    """Determines the data types of all elements yielded by the given _collection_query or _legacy_collection_query"""
+    elements = query.subquery()
+    return set(session.scalars(select(elements.c.data_type).distinct()))
+
+
+def iter_collection_result(
+    session: Session,
+    kind: str,
+    processing_step: ProcessingStep,
+    block_size: int = 1000,
+    as_array: bool = False,
+) -> Iterator[Any]:
+    """Iterates over a List, Matrix or Tensor that has been stored via insert_collection_result in index order
+    without materializing the entire collection. For Matrices every yielded item is one row and for Tensors every
+    yielded item is the sub-tensor belonging to one index of the leading dimension, whereas Lists are yielded in
+    blocks of block_size consecutive elements (the last block may be shorter). The elements are streamed from the
+    database in batches of block_size rows (yield_per), such that the memory consumption is independent of the
+    size of the collection. If as_array is True, the rows/blocks are yielded as NumPy arrays instead of lists, all of
+    which have the same dtype (as in get_collection_result). For collections whose elements are of different types,
+    this requires an additional query over the types of all elements. Note that the session must not be used for
+    anything else while the iteration is in progress.
+    """
+    assert block_size > 0
+
+    if as_array and numpy is None:
+        raise RuntimeError(
+            "Retrieving collections as arrays requires NumPy to be installed"
+        )
+
+    collection = _collection_header(session, kind, processing_step)
+
+    if collection is not None:
+        shape = collection.shape
+        fill = _fill_value(collection)
+        query = _collection_query(collection).order_by(Result.collection_index)
+        element_types = (
+            {collection.element_type} if collection.element_type != "mixed" else None
+        )
+        block_elements = block_size if len(shape) == 1 else math.prod(shape[1:])
+        split = lambda current: divmod(current.position, block_elements)
+    else:
+        data_kind, shape = _legacy_collection_metadata(session, kind, processing_step)
+        fill = None
+        query = _legacy_collection_query(kind, processing_step, data_kind)
+        element_types = None
+        if data_kind == "List":
+            query = query.order_by(query.selected_columns.index)
+        else:
+            query = query.order_by(
+                query.selected_columns.row, query.selected_columns.column
+            )
+        position = _legacy_position(data_kind)
+        if data_kind == "List":
+            split = lambda current: divmod(position(current)[0], block_size)
+        else:
+            split = position
+
+    if as_array and element_types is None:
+        # All yielded arrays share the same dtype, which is derived from the types of all elements
+        element_types = _element_types(session, query)
+
+    if len(shape) == 1:
+        n_blocks = (shape[0] + block_size - 1) // block_size
+        block_length = lambda block: min(block_size, shape[0] - block * block_size)
+    else:
+        n_blocks = shape[0]
+        block_length = lambda block: math.prod(shape[1:])
+
+    if collection is None and len(shape) == 2 and not as_array:
+        # Like in get_collection_result, rows of legacy matrices keep the length they have been stored with
+        block_length = lambda block: 0
+
+    def finalize(values: List[Any]):
+        if not as_array:
+            return _nest(values, shape[1:]) if len(shape) > 2 else values
+
+        assert numpy is not None and element_types is not None
+        # Missing elements are represented as None, which requires an object array
+        dtype = (
+            _array_dtype(element_types)
+            if not any(value is None for value in values)
+            else object
+        )
+        array = numpy.empty(len(values), dtype=dtype)
+        array[:] = values
+        return array.reshape(shape[1:]) if len(shape) > 2 else array
+
+    current_block = 0
+    values: List[Any] = [fill] * block_length(0)
+
+    for current in session.execute(query.execution_options(yield_per=block_size)):
+        block, offset = split(current)
+
+        assert block >= current_block and offset >= 0
+
+        while block > current_block:
+            yield finalize(values)
+            current_block += 1
+            values = [fill] * max(block_length(current_block), 0)
+
+        if offset >= len(values):
+            values.extend([fill] * (offset + 1 - len(values)))
+
+        values[offset] = Result.decode_data(
+            current.data_type, current.data_value, current.data_blob
+        )
+
+    yield finalize(values)
+
+    # Trailing blocks without any stored elements
+    for block in range(current_block + 1, n_blocks):
+        yield finalize([fill] * block_length(block))
+
+
+def get_array_rows(
+    session: Session, result: Result, start: int = 0, stop: Optional[int] = None
+):
+    """Reads the rows start to stop (exclusive, along the leading dimension) of the array stored in the given
+    Result. For arrays with chunked storage (see data_manager.orm.configure_chunked_storage), only the chunks
+    containing the requested rows are fetched from the database and decompressed. Arrays stored as a single blob are
+    read entirely and sliced afterwards. Returns a read-only NumPy array."""
+    if result._data_type == "array":
+        data = result.data
+        assert numpy is not None and isinstance(data, numpy.ndarray)
+        return data[start:stop]
+    if result._data_type != "chunked_array":
+        raise RuntimeError(
+            "Result %s does not hold array data (but %s)"
+            % (result.id, result._data_type)
+        )
+
+    header = ChunkedArrayHeader.parse(result._data_value)
+    if len(header.shape) == 0:
+        raise RuntimeError("Can't read rows of a 0-dimensional array")
+
+    start, stop, _ = slice(start, stop).indices(header.shape[0])
+    stop = max(start, stop)
+    row_elements = math.prod(header.shape[1:])
+    first_element = start * row_elements
+    n_elements = (stop - start) * row_elements
+    shape = (stop - start,) + header.shape[1:]
+
+    if n_elements == 0:
+        return ResultChunk.decode(header, [], 0, 0).reshape(shape)
+
+    chunks = session.scalars(
+        select(ResultChunk.data)
+        .where(ResultChunk.result_id == result.id)
+        .where(
+            ResultChunk.chunk_index.between(
+                first_element // header.chunk_elements,
+                (first_element + n_elements - 1) // header.chunk_elements,
+            )
+        )
+        .order_by(ResultChunk.chunk_index)
+    ).all()
+
+    return ResultChunk.decode(header, chunks, first_element, n_elements).reshape(shape)
+
+
+_AGGREGATES = {
+    "min": func.min,
+    "max": func.max,
+    "avg": func.avg,
+    "sum": func.sum,
+    "count": func.count,
+}
+
+_GROUPINGS = {
+    "system": ProcessingStep.system_id,
+    "host": ProcessingStep.host_id,
+    "project": ProcessingStep.project_id,
+    "step_kind": ProcessingStep.kind,
+}
+
+
+def aggregate_results_query(
+    kind: str, function: str, group_by: Optional[str] = None
+) -> Select:
+    """Builds a query computing the given aggregate (min, max, avg, sum or count) over the numeric data of all
+    Results of the given kind. If group_by is given (one of system, host, project or step_kind), the query yields
+    (group, aggregate) rows, where group is the ID of the system/host/project or the kind of the processing step
+    the Results belong to. Non-numeric Results don't take part in the aggregation."""
+    if function not in _AGGREGATES:
+        raise RuntimeError(
+            "Unsupported aggregate '%s' - available aggregates are: %s"
+            % (function, ", ".join(_AGGREGATES))
+        )
+    if group_by is not None and group_by not in _GROUPINGS:
+        raise RuntimeError(
+            "Unsupported grouping '%s' - available groupings are: %s"
+            % (group_by, ", ".join(_GROUPINGS))
+        )
+
+    aggregate = _AGGREGATES[function](Result._data_number)
+
+    if group_by is None:
+        query = select(aggregate)
+    else:
+        group = _GROUPINGS[group_by]
+        query = (
+            select(group, aggregate)
+            .join(ProcessingStep, ProcessingStep.id == Result.processing_step_id)
+            .group_by(group)
+        )
+
+    # Served by the (kind, _data_number) index
+    return query.where(Result.kind == kind).where(Result._data_number.is_not(None))
+
+
+def aggregate_results(
+    session: Session, kind: str, function: str, group_by: Optional[str] = None
+):
+    """Computes the given aggregate over the numeric data of all Results of the given kind inside the database (see
+    aggregate_results_query), e.g. the lowest energy per system via
+    aggregate_results(session, "Energy", "min", group_by="system")
+    Without group_by, the aggregate is returned as a single number (None if there are no numeric Results of the
+    given kind). Otherwise, a dict mapping every group to its aggregate is returned."""
+    query = aggregate_results_query(kind, function, group_by)
+
+    if group_by is None:
+        return session.execute(query).scalar_one()
+
+    return {group: value for group, value in session.execute(query)}
@@ -8,7 +8,26 @@ from sqlalchemy import select
 import sqlalchemy.orm
 import sqlalchemy.exc
 
-from data_manager.orm import Base, Host, ProcessingStep, Result, System, Project
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from data_manager.orm import (
+    Base,
+    Host,
+    ProcessingStep,
+    Result,
+    System,
+    Project,
+    PropertyString,
+    HostProperty,
+    SystemProperty,
+    ResultChunk,
+    configure_chunked_storage,
+    disable_chunked_storage,
+    configure_session,
+)
 
 
 class TestORM(unittest.TestCase):
@@ -17,6 +36,7 @@ class TestORM(unittest.TestCase):
         cls.engine = sqlalchemy.create_engine("sqlite:///:memory:")
         Base.metadata.create_all(cls.engine)
         cls.Session = sqlalchemy.orm.sessionmaker(bind=cls.engine)
+        configure_session(cls.Session)
 
     def test_host(self):
         with self.Session() as session:
@@ -80,6 +100,127 @@ class TestORM(unittest.TestCase):
             self.assertEqual(res2.data, "Doublet")
             self.assertEqual(len(res2.properties), 0)
 
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_array_result(self):
+        assert numpy is not None
+        matrix = numpy.arange(12, dtype=">f8").reshape(3, 4)
+        vector = numpy.array([1, -2, 3], dtype=numpy.int32)
+
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="Dummy", project=project)
+
+            step.results.append(Result(kind="Hessian", data=matrix))
+            step.results.append(Result(kind="Occupations", data=vector.data))
+
+            session.add(project)
+            session.commit()
+
+        with self.Session() as session:
+            hessian = session.scalars(
+                select(Result).where(Result.kind == "Hessian")
+            ).one()
+            data = hessian.data
+            assert isinstance(data, numpy.ndarray)
+            self.assertEqual(data.dtype, numpy.dtype(">f8"))
+            self.assertEqual(data.shape, (3, 4))
+            self.assertTrue(numpy.array_equal(data, matrix))
+
+            occupations = session.scalars(
+                select(Result).where(Result.kind == "Occupations")
+            ).one()
+            data = occupations.data
+            assert isinstance(data, numpy.ndarray)
+            self.assertEqual(data.dtype, numpy.dtype(numpy.int32))
+            self.assertTrue(numpy.array_equal(data, vector))
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_numpy_scalar_result(self):
+        assert numpy is not None
+
+        with self.Session() as session:
+            step = ProcessingStep(kind="Dummy", project=Project(name="Dummy"))
+            energy = Result(kind="NumPyEnergy", data=numpy.float64(1.5))
+            converged = Result(kind="NumPyConverged", data=numpy.bool_(True))
+            iterations = Result(kind="NumPyIterations", data=numpy.int64(12))
+            step.results.extend([energy, converged, iterations])
+            session.add(step)
+            session.commit()
+
+            # NumPy scalars are stored like the corresponding Python values
+            self.assertEqual(energy._data_type, "float")
+            self.assertEqual(energy._data_number, 1.5)
+            self.assertEqual(iterations._data_number, 12)
+            session.expire_all()
+
+            self.assertEqual(type(energy.data), float)
+            self.assertEqual(energy.data, 1.5)
+            self.assertIs(converged.data, True)
+            self.assertEqual(type(iterations.data), int)
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_chunked_array_result(self):
+        assert numpy is not None
+        density = numpy.linspace(0, 1, 60).reshape(6, 10)
+
+        configure_chunked_storage("Density", codec="lzma", chunk_size=128)
+        try:
+            with self.Session() as session:
+                project = Project(name="Dummy")
+                step = ProcessingStep(kind="Dummy", project=project)
+                result = Result(kind="Density", data=density)
+                step.results.append(result)
+
+                session.add(project)
+                session.commit()
+
+                self.assertEqual(result._data_type, "chunked_array")
+                self.assertIsNone(result._data_blob)
+                # 60 float64 elements with 16 elements per chunk
+                self.assertEqual(len(result._chunks), 4)
+
+                result_id = result.id
+
+            with self.Session() as session:
+                result = session.get(Result, result_id)
+                assert result is not None
+                self.assertTrue(numpy.array_equal(result.data, density))
+
+                # Replacing the data drops the previous chunks
+                result.data = numpy.zeros(3)
+                session.commit()
+                self.assertEqual(len(result._chunks), 1)
+                self.assertEqual(
+                    len(
+                        session.scalars(
+                            select(ResultChunk).where(
+                                ResultChunk.result_id == result_id
+                            )
+                        ).all()
+                    ),
+                    1,
+                )
+                data = result.data
+                assert isinstance(data, numpy.ndarray)
+                self.assertEqual(data.tolist(), [0.0, 0.0, 0.0])
+
+            # Sessions that haven't been set up via configure_session store arrays as single blobs
+            with sqlalchemy.orm.Session(self.engine) as session:
+                result = Result(kind="Density", data=density)
+                session.add(
+                    ProcessingStep(
+                        kind="Unconfigured",
+                        project=Project(name="Plain"),
+                        results=[result],
+                    )
+                )
+                session.commit()
+
+                self.assertEqual(result._data_type, "array")
+                self.assertEqual(len(result._chunks), 0)
+        finally:
+            disable_chunked_storage("Density")
+
     def test_system(self):
         with self.Session() as session:
             sys1 = System(name="Methane", properties={"geometry_type": "XYZ"})
@@ -101,6 +242,80 @@ class TestORM(unittest.TestCase):
             self.assertEqual(sys2.variant, "distorted")
             self.assertEqual(len(sys2.properties), 0)
 
+    def test_interned_property_keywords(self):
+        with self.Session() as session:
+            host = Host(name="interned_host")
+            system = System(name="interned_system")
+            host.properties["interned_keyword"] = "a"
+            host.properties["other_interned_keyword"] = "b"
+            system.properties["interned_keyword"] = "c"
+
+            session.add_all([host, system])
+            session.commit()
+
+            # Keywords are only stored once, regardless of how often they are used
+            self.assertEqual(
+                sorted(
+                    session.scalars(
+                        select(PropertyString.string).where(
+                            PropertyString.string.like("%interned_keyword")
+                        )
+                    ).all()
+                ),
+                ["interned_keyword", "other_interned_keyword"],
+            )
+
+        with self.Session() as session:
+            host = session.scalars(
+                select(Host).where(Host.name == "interned_host")
+            ).one()
+            self.assertEqual(
+                host.properties,
+                {"interned_keyword": "a", "other_interned_keyword": "b"},
+            )
+            self.assertEqual(
+                session.scalars(
+                    select(SystemProperty.value).where(
+                        SystemProperty.name == "interned_keyword"
+                    )
+                ).all(),
+                ["c"],
+            )
+
+            # Renaming keywords of persistent properties
+            host._properties["other_interned_keyword"].keyword = "renamed_keyword"
+            session.commit()
+
+            self.assertEqual(
+                session.scalars(
+                    select(HostProperty.value).where(
+                        HostProperty.keyword == "renamed_keyword"
+                    )
+                ).all(),
+                ["b"],
+            )
+
+        # Sessions that haven't been set up via configure_session resolve the keywords object by object
+        with sqlalchemy.orm.Session(self.engine) as session:
+            host = Host(
+                name="unconfigured_host",
+                properties={"interned_keyword": "d", "fallback_keyword": "e"},
+            )
+            session.add(host)
+            session.commit()
+
+            self.assertEqual(
+                host.properties, {"interned_keyword": "d", "fallback_keyword": "e"}
+            )
+            self.assertEqual(
+                session.scalars(
+                    select(HostProperty.value).where(
+                        HostProperty.keyword == "fallback_keyword"
+                    )
+                ).all(),
+                ["e"],
+            )
+
     def test_processing_step(self):
         with self.Session() as session:
             project = Project(name="Dummy")
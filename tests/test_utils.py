@@ -2,18 +2,129 @@
 
 import unittest
 
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import threading
+
 import sqlalchemy.orm
+import sqlalchemy.exc
+from sqlalchemy import select, func, event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from data_manager.orm import (
+    Base,
+    Project,
+    ProcessingStep,
+    Result,
+    ResultProperty,
+    System,
+    Host,
+    Author,
+    Keyword,
+    ProcessingStepProperty,
+    configure_chunked_storage,
+    disable_chunked_storage,
+    configure_session,
+)
+from data_manager.utils import (
+    open_database,
+    configure_sqlite_engine,
+    get_sessionmaker,
+    dispose_engines,
+    insert_collection_result,
+    get_collection_result,
+    upgrade_database,
+    iter_collection_result,
+    insert_sparse_collection_result,
+    get_collection_slice,
+    get_sparse_collection_result,
+    get_array_rows,
+    BlobStore,
+    insert_blob_result,
+    ParsedStep,
+    scan_directories,
+    ingest_directories,
+    WriteBroker,
+    BrokerClient,
+    ThreadedAsyncSession,
+    open_async_database,
+    dispose_async_engines,
+    async_driver_available,
+    get_or_create_system_async,
+    get_or_create_hosts_async,
+    insert_collection_result_async,
+    get_collection_result_async,
+    register_loading_profile,
+    loading_options,
+    with_loading_profile,
+    QueryStatistics,
+    enable_query_statistics,
+    disable_query_statistics,
+    get_query_statistics,
+    aggregate_results,
+    needs_upgrade,
+    get_or_create_host,
+    get_or_create_system,
+    enable_lookup_cache,
+    get_lookup_cache,
+    disable_lookup_cache,
+    get_or_create_hosts,
+    get_or_create_systems,
+    get_or_create_authors,
+    get_or_create_keywords,
+    get_or_create_projects,
+    get_ancestors,
+    get_descendants,
+    maintain_step_closure,
+    rebuild_step_closure,
+    depends_on,
+    lookup_ancestors,
+    lookup_descendants,
+    has_properties,
+    property_compares,
+    property_in_range,
+    get_property_keys,
+    get_properties,
+    get_property_table,
+    property_metadata,
+    PropertyKey,
+    compile_property_filter,
+)
+
+
+def parse_energy_output(directory: str):
+    """Parser used by test_ingest_directories"""
+    path = os.path.join(directory, "energy.out")
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as file:
+        energy, *occupations = file.read().split()
 
-from data_manager.orm import Base, Project, ProcessingStep, Result
-from data_manager.utils import insert_collection_result, get_collection_result
+    return ParsedStep(
+        kind="SCF",
+        results={"Energy": float(energy), "Occupations": [int(n) for n in occupations]},
+        properties={"program": "dummy"},
+        system=(os.path.basename(directory), None),
+        host="cluster",
+    )
 
 
 class TestUtils(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        configure_sqlite_engine(cls.engine)
         Base.metadata.create_all(cls.engine)
         cls.Session = sqlalchemy.orm.sessionmaker(bind=cls.engine)
+        configure_session(cls.Session)
 
     def test_collection_results(self):
         with self.Session() as session:
@@ -46,6 +157,1586 @@ class TestUtils(unittest.TestCase):
             self.assertEqual(listResult, fetchedList)
             self.assertEqual(matrixResult, fetchedMatrix)
 
+    def test_collection_header(self):
+        with self.Session() as session:
+            step = ProcessingStep(kind="HeaderExample", project=Project(name="Dummy"))
+
+            collection = insert_collection_result(
+                session=session,
+                kind="Header",
+                processing_step=step,
+                data=[[1.5, 2.5], [3.5, 4.5]],
+            )
+            session.commit()
+
+            self.assertEqual(collection.layout, "Matrix")
+            self.assertEqual(collection.shape, (2, 2))
+            self.assertEqual(collection.element_type, "float")
+            # Elements only carry their position, but no bookkeeping properties
+            self.assertEqual(
+                session.execute(
+                    select(Result.collection_index, Result.properties.any())
+                    .where(Result.collection_id == collection.id)
+                    .order_by(Result.collection_index)
+                ).all(),
+                [(0, False), (1, False), (2, False), (3, False)],
+            )
+            self.assertEqual(
+                get_collection_result(session, "Header", step),
+                [[1.5, 2.5], [3.5, 4.5]],
+            )
+
+            # Ragged collections can't be represented by a shape
+            for ragged in ([[1, 2], [3]], [[1, 2], 3], [[[1]], [2]]):
+                with self.assertRaises(RuntimeError):
+                    insert_collection_result(
+                        session=session,
+                        kind="Ragged",
+                        processing_step=step,
+                        data=ragged,
+                    )
+
+            # Every step holds at most one collection of a given kind
+            insert_collection_result(
+                session=session, kind="Header", processing_step=step, data=[1]
+            )
+            with self.assertRaises(sqlalchemy.exc.IntegrityError):
+                session.flush()
+
+    def test_legacy_collection_results(self):
+        with self.Session() as session:
+            step = ProcessingStep(kind="LegacyExample", project=Project(name="Dummy"))
+
+            # Collections stored before ResultCollection existed describe their layout via element properties
+            # Older versions also accepted ragged matrices
+            for kind, matrix in [
+                ("Legacy", [[1, 2, 3], [4, 5, 6]]),
+                ("LegacyRagged", [[1, 2], [3]]),
+            ]:
+                for row, values in enumerate(matrix):
+                    for col, value in enumerate(values):
+                        current = Result(kind=kind, processing_step=step, data=value)
+                        current.properties["kind"] = "Matrix"
+                        current.properties["indexing"] = "1-based"
+                        current.properties["row"] = str(row + 1)
+                        current.properties["column"] = str(col + 1)
+                        current.properties["original_collection_type"] = "list"
+                        current.properties["total_dimension"] = "{},{}".format(
+                            len(matrix), len(matrix[0])
+                        )
+                        session.add(current)
+
+            session.commit()
+
+            for kind, matrix in [
+                ("Legacy", [[1, 2, 3], [4, 5, 6]]),
+                ("LegacyRagged", [[1, 2], [3]]),
+            ]:
+                self.assertEqual(get_collection_result(session, kind, step), matrix)
+                self.assertEqual(
+                    list(iter_collection_result(session, kind, step)), matrix
+                )
+
+    def test_bulk_collection_results(self):
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="BulkExample", project=project)
+            session.add(project)
+
+            listResult = [1, "test", 0.25, -3]
+            matrixResult = [[1.5, 2, 3], ["4", 5, "6"], [7, 8, 9]]
+
+            insert_collection_result(
+                session=session,
+                kind="ListTest",
+                processing_step=step,
+                data=listResult,
+                bulk=True,
+                batch_size=3,
+            )
+            insert_collection_result(
+                session=session,
+                kind="MatrixTest",
+                processing_step=step,
+                data=matrixResult,
+                bulk=True,
+                batch_size=2,
+            )
+
+            session.commit()
+
+            fetchedList = get_collection_result(
+                session=session, kind="ListTest", processing_step=step
+            )
+            fetchedMatrix = get_collection_result(
+                session=session, kind="MatrixTest", processing_step=step
+            )
+
+            self.assertEqual(listResult, fetchedList)
+            self.assertEqual(matrixResult, fetchedMatrix)
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_collection_results_as_array(self):
+        assert numpy is not None
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="ArrayExample", project=project)
+            session.add(project)
+
+            floatMatrix = [[1.5, 2, 3], [4, 5, 6.25]]
+            intList = [3, 1, 2]
+            mixedList = [1, "test", 0.25]
+
+            insert_collection_result(
+                session=session, kind="Floats", processing_step=step, data=floatMatrix
+            )
+            insert_collection_result(
+                session=session, kind="Ints", processing_step=step, data=intList
+            )
+            insert_collection_result(
+                session=session, kind="Mixed", processing_step=step, data=mixedList
+            )
+
+            session.commit()
+
+            fetchedMatrix = get_collection_result(
+                session=session, kind="Floats", processing_step=step, as_array=True
+            )
+            assert isinstance(fetchedMatrix, numpy.ndarray)
+            self.assertEqual(fetchedMatrix.dtype, numpy.float64)
+            self.assertTrue(numpy.array_equal(fetchedMatrix, numpy.array(floatMatrix)))
+
+            fetchedInts = get_collection_result(
+                session=session, kind="Ints", processing_step=step, as_array=True
+            )
+            assert isinstance(fetchedInts, numpy.ndarray)
+            self.assertEqual(fetchedInts.dtype, numpy.int64)
+            self.assertEqual(fetchedInts.tolist(), intList)
+
+            fetchedMixed = get_collection_result(
+                session=session, kind="Mixed", processing_step=step, as_array=True
+            )
+            assert isinstance(fetchedMixed, numpy.ndarray)
+            self.assertEqual(fetchedMixed.dtype, object)
+            self.assertEqual(fetchedMixed.tolist(), mixedList)
+
+    def test_iter_collection_results(self):
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="IterExample", project=project)
+            session.add(project)
+
+            listResult = list(range(10))
+            matrixResult = [[1, 2, 3], ["4", 5, "6"], [7.5, 8, 9]]
+
+            insert_collection_result(
+                session=session, kind="ListTest", processing_step=step, data=listResult
+            )
+            insert_collection_result(
+                session=session,
+                kind="MatrixTest",
+                processing_step=step,
+                data=matrixResult,
+                bulk=True,
+            )
+            session.commit()
+
+            blocks = list(
+                iter_collection_result(
+                    session=session, kind="ListTest", processing_step=step, block_size=4
+                )
+            )
+            self.assertEqual(blocks, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+            rows = list(
+                iter_collection_result(
+                    session=session,
+                    kind="MatrixTest",
+                    processing_step=step,
+                    block_size=2,
+                )
+            )
+            self.assertEqual(rows, matrixResult)
+
+            if numpy is not None:
+                arrays = list(
+                    iter_collection_result(
+                        session=session,
+                        kind="ListTest",
+                        processing_step=step,
+                        block_size=5,
+                        as_array=True,
+                    )
+                )
+                self.assertEqual(len(arrays), 2)
+                self.assertEqual(arrays[1].dtype, numpy.int64)
+                self.assertEqual(arrays[1].tolist(), [5, 6, 7, 8, 9])
+
+    def test_tensor_collection_results(self):
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="TensorExample", project=project)
+            session.add(project)
+
+            tensor = [
+                [[i * 100 + j * 10 + k for k in range(4)] for j in range(3)]
+                for i in range(2)
+            ]
+
+            collection = insert_collection_result(
+                session=session, kind="Tensor", processing_step=step, data=tensor
+            )
+            session.commit()
+
+            self.assertEqual(collection.layout, "Tensor")
+            self.assertEqual(collection.shape, (2, 3, 4))
+
+            self.assertEqual(get_collection_result(session, "Tensor", step), tensor)
+            self.assertEqual(
+                list(iter_collection_result(session, "Tensor", step)), tensor
+            )
+
+            self.assertEqual(
+                get_collection_slice(session, "Tensor", step, 1), tensor[1]
+            )
+            self.assertEqual(
+                get_collection_slice(
+                    session, "Tensor", step, (slice(None), 2, slice(1, 3))
+                ),
+                [[21, 22], [121, 122]],
+            )
+            self.assertEqual(
+                get_collection_slice(session, "Tensor", step, (1, -1, 0)), 120
+            )
+            self.assertEqual(
+                get_collection_slice(session, "Tensor", step, (0, slice(2, 2))), []
+            )
+
+            with self.assertRaises(RuntimeError):
+                get_collection_slice(session, "Tensor", step, (2,))
+            with self.assertRaises(RuntimeError):
+                get_collection_slice(session, "Tensor", step, (0, 0, 0, 0))
+
+    def test_sparse_collection_results(self):
+        with self.Session() as session:
+            project = Project(name="Dummy")
+            step = ProcessingStep(kind="SparseExample", project=project)
+            session.add(project)
+
+            collection = insert_sparse_collection_result(
+                session=session,
+                kind="Integrals",
+                processing_step=step,
+                shape=(2, 2, 2, 2),
+                indices=[(0, 0, 0, 0), (1, 0, 1, 0), (1, 1, 1, 1)],
+                values=[0.5, -0.25, 2.0],
+                bulk=True,
+            )
+            dense = insert_collection_result(
+                session=session,
+                kind="Dense",
+                processing_step=step,
+                data=[[0, 1.5], [0.0, 0]],
+                sparse=True,
+            )
+            session.commit()
+
+            self.assertTrue(collection.sparse)
+            self.assertEqual(collection.layout, "Tensor")
+            self.assertEqual(collection.element_type, "float")
+            self.assertEqual(
+                session.scalar(
+                    select(func.count()).where(Result.collection_id == dense.id)
+                ),
+                1,
+            )
+
+            self.assertEqual(
+                get_collection_result(session, "Dense", step), [[0, 1.5], [0, 0]]
+            )
+            self.assertEqual(
+                get_collection_slice(session, "Integrals", step, (1, slice(None), 1)),
+                [[-0.25, 0.0], [0.0, 2.0]],
+            )
+            self.assertEqual(
+                get_collection_slice(session, "Integrals", step, (1, 0, 1, 0)), -0.25
+            )
+            self.assertEqual(
+                get_collection_slice(session, "Integrals", step, (0, 1, 0, 1)), 0.0
+            )
+
+            sparse = get_sparse_collection_result(session, "Integrals", step)
+            self.assertEqual(sparse.shape, (2, 2, 2, 2))
+            self.assertEqual(sparse.indices, [(0, 0, 0, 0), (1, 0, 1, 0), (1, 1, 1, 1)])
+            self.assertEqual(sparse.values, [0.5, -0.25, 2.0])
+
+            self.assertEqual(
+                list(iter_collection_result(session, "Integrals", step))[0],
+                [[[0.5, 0.0], [0.0, 0.0]], [[0.0, 0.0], [0.0, 0.0]]],
+            )
+
+            with self.assertRaises(RuntimeError):
+                insert_sparse_collection_result(
+                    session, "Invalid", step, (2, 2), [(2, 0)], [1.0]
+                )
+            # Every index needs exactly one value
+            with self.assertRaises(RuntimeError):
+                insert_sparse_collection_result(
+                    session, "Unmatched", step, (2, 2), [(0, 0), (1, 1)], [1.0]
+                )
+            with self.assertRaises(RuntimeError):
+                insert_sparse_collection_result(
+                    session, "Invalid", step, (2, 2), iter([(0, 0)]), iter([1.0, 2.0])
+                )
+            # Discard the headers of the rejected collections
+            session.rollback()
+
+            if numpy is not None:
+                fetched = get_collection_result(
+                    session, "Integrals", step, as_array=True
+                )
+                assert isinstance(fetched, numpy.ndarray)
+                self.assertEqual(fetched.dtype, numpy.float64)
+                self.assertEqual(fetched.shape, (2, 2, 2, 2))
+                self.assertEqual(fetched[1, 0, 1, 0], -0.25)
+                self.assertEqual(numpy.count_nonzero(fetched), 3)
+
+                # Zeros of NumPy data (arrays as well as sequences of NumPy scalars) are not stored
+                matrix = numpy.array([[0.0, 1.5, 0.0], [0.0, 0.0, -2.0]])
+                for kind, data in [
+                    ("NumPySparse", matrix),
+                    ("NumPyRows", list(matrix)),
+                ]:
+                    collection = insert_collection_result(
+                        session, kind, step, data, sparse=True
+                    )
+                    session.flush()
+                    self.assertEqual(
+                        session.scalar(
+                            select(func.count()).where(
+                                Result.collection_id == collection.id
+                            )
+                        ),
+                        2,
+                    )
+                    self.assertTrue(
+                        numpy.array_equal(
+                            get_collection_result(session, kind, step, as_array=True),
+                            matrix,
+                        )
+                    )
+
+                # Rows of collections with elements of different types share the same dtype
+                insert_sparse_collection_result(
+                    session,
+                    "Mixed",
+                    step,
+                    (3, 2),
+                    numpy.array([[0, 0], [2, 1]]),
+                    [1, 0.5],
+                )
+                self.assertEqual(
+                    [
+                        row.dtype
+                        for row in iter_collection_result(
+                            session, "Mixed", step, as_array=True
+                        )
+                    ],
+                    [numpy.float64] * 3,
+                )
+
+                # Boolean arrays
+                mask = numpy.array([[True, False], [False, False]])
+                insert_collection_result(session, "Mask", step, mask, sparse=True)
+                insert_sparse_collection_result(
+                    session,
+                    "SparseMask",
+                    step,
+                    (2, 2),
+                    numpy.array([[1, 1]]),
+                    numpy.array([True]),
+                )
+                session.commit()
+                self.assertEqual(
+                    get_collection_result(session, "Mask", step), mask.tolist()
+                )
+                fetched_mask = get_collection_result(
+                    session, "SparseMask", step, as_array=True
+                )
+                assert isinstance(fetched_mask, numpy.ndarray)
+                self.assertEqual(fetched_mask.dtype, numpy.bool_)
+                self.assertEqual(fetched_mask.tolist(), [[False, False], [False, True]])
+
+                array = numpy.arange(24).reshape(2, 3, 4)
+                insert_collection_result(session, "Array", step, array)
+                session.commit()
+
+                fetched_array = get_collection_result(
+                    session, "Array", step, as_array=True
+                )
+                assert isinstance(fetched_array, numpy.ndarray)
+                self.assertEqual(fetched_array.tolist(), array.tolist())
+                fetched_slice = get_collection_slice(
+                    session,
+                    "Array",
+                    step,
+                    (slice(None), slice(1, 3), 2),
+                    as_array=True,
+                )
+                assert isinstance(fetched_slice, numpy.ndarray)
+                self.assertTrue(numpy.array_equal(fetched_slice, array[:, 1:3, 2]))
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_get_array_rows(self):
+        assert numpy is not None
+        array = numpy.arange(1000, dtype=numpy.int64).reshape(100, 10)
+
+        configure_chunked_storage("ChunkedRows", codec="zlib", chunk_size=200)
+        try:
+            with self.Session() as session:
+                project = Project(name="Dummy")
+                step = ProcessingStep(kind="ChunkExample", project=project)
+                chunked = Result(kind="ChunkedRows", processing_step=step, data=array)
+                plain = Result(kind="PlainRows", processing_step=step, data=array)
+                session.add(project)
+                session.commit()
+
+                parameters = []
+                listener = lambda *args: parameters.append(args[3])
+                event.listen(self.engine, "before_cursor_execute", listener)
+                try:
+                    rows = get_array_rows(session, chunked, 42, 45)
+                finally:
+                    event.remove(self.engine, "before_cursor_execute", listener)
+
+                self.assertTrue(numpy.array_equal(rows, array[42:45]))
+                # Only the chunks containing the requested rows (elements 420 to 449 with 25 elements per chunk)
+                # are fetched (the preceding statement refreshes the expired Result)
+                self.assertEqual(parameters[-1], (chunked.id, 16, 17))
+
+                self.assertTrue(
+                    numpy.array_equal(get_array_rows(session, chunked, 97), array[97:])
+                )
+                empty = get_array_rows(session, chunked, 5, 5)
+                assert isinstance(empty, numpy.ndarray)
+                self.assertEqual(empty.shape, (0, 10))
+                self.assertTrue(
+                    numpy.array_equal(get_array_rows(session, plain, 3, 7), array[3:7])
+                )
+        finally:
+            disable_chunked_storage("ChunkedRows")
+
+    @unittest.skipIf(numpy is None, "NumPy is not available")
+    def test_blob_store(self):
+        assert numpy is not None
+        orbitals = numpy.arange(12, dtype=">f8").reshape(3, 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = BlobStore(os.path.join(directory, "blobs"))
+
+            with self.Session() as session:
+                project = Project(name="Dummy")
+                first = ProcessingStep(kind="BlobExample", project=project)
+                second = ProcessingStep(kind="BlobExample", project=project)
+                session.add(project)
+
+                results = [
+                    insert_blob_result(session, "Orbitals", step, orbitals, store)
+                    for step in (first, second)
+                ]
+                raw = insert_blob_result(session, "Raw", first, b"checkpoint", store)
+
+                output = os.path.join(directory, "output.log")
+                with open(output, "w") as file:
+                    file.write("Converged")
+                first.output_digest = store.add_file(output, move=True)
+                self.assertFalse(os.path.exists(output))
+
+                orphan = store.put(b"unreferenced")
+                session.commit()
+
+                # Identical content is only stored once
+                self.assertEqual(results[0]._data_value, results[1]._data_value)
+                self.assertEqual(len(list(store.digests())), 4)
+
+                loaded = store.load(results[1])
+                assert isinstance(loaded, numpy.ndarray)
+                self.assertEqual(loaded.dtype, numpy.dtype(">f8"))
+                self.assertTrue(numpy.array_equal(loaded, orbitals))
+                self.assertFalse(loaded.flags.writeable)
+                self.assertEqual(bytes(store.load(raw)), b"checkpoint")
+                output_digest = first.output_digest
+                assert output_digest is not None
+                self.assertEqual(bytes(store.open(output_digest)), b"Converged")
+
+                with self.assertRaises(RuntimeError):
+                    results[0].data
+
+                # Stray files (e.g. of an interrupted write) are no blobs
+                with open(os.path.join(store.root, ".tmp-interrupted"), "wb") as file:
+                    file.write(b"partial")
+                misplaced = os.path.join(
+                    store.root, orphan[:2], orphan[2:4], "notes.txt"
+                )
+                with open(misplaced, "w") as file:
+                    file.write("unrelated")
+                self.assertEqual(len(list(store.digests())), 4)
+                self.assertEqual(store.remove_temporary_files(), [])
+
+                self.assertEqual(store.remove_unreferenced(session), [orphan])
+                self.assertNotIn(orphan, store)
+                self.assertIn(first.output_digest, store)
+
+                self.assertEqual(
+                    store.remove_temporary_files(min_age=0),
+                    [os.path.join(store.root, ".tmp-interrupted")],
+                )
+
+    def test_ingest_directories(self):
+        with tempfile.TemporaryDirectory() as root:
+            for i in range(7):
+                os.makedirs(os.path.join(root, "calc%d" % i))
+                with open(os.path.join(root, "calc%d" % i, "energy.out"), "w") as file:
+                    file.write("%f 2 2 %d" % (-1.5 * i, i % 2))
+            os.makedirs(os.path.join(root, "broken"))
+            with open(os.path.join(root, "broken", "energy.out"), "w") as file:
+                file.write("not-a-number")
+            os.makedirs(os.path.join(root, "other"))
+            with open(os.path.join(root, "other", "notes.txt"), "w") as file:
+                file.write("unrelated")
+
+            directories = scan_directories(root)
+            self.assertEqual(len(directories), 9)
+
+            with self.Session() as session:
+                project = Project(name="IngestionExample")
+                snapshots = []
+
+                report = ingest_directories(
+                    session,
+                    project,
+                    directories[:4],
+                    parsers=[parse_energy_output],
+                    processes=1,
+                    batch_size=2,
+                    progress=snapshots.append,
+                )
+                self.assertEqual(report.ingested, 3)
+                self.assertEqual(list(report.failures), [os.path.join(root, "broken")])
+                self.assertEqual([s.ingested for s in snapshots], [2, 3])
+
+                # Resuming skips the directories that have been ingested before
+                report = ingest_directories(
+                    session,
+                    project,
+                    directories,
+                    parsers=[parse_energy_output],
+                    processes=2,
+                    batch_size=3,
+                )
+                self.assertEqual(report.total, 9)
+                self.assertEqual(report.skipped, 3)
+                self.assertEqual(report.ingested, 4)
+                self.assertEqual(report.unmatched, 1)
+                self.assertEqual(len(report.failures), 1)
+                self.assertEqual(report.processed, 9)
+
+                steps = session.scalars(
+                    select(ProcessingStep).where(ProcessingStep.project == project)
+                ).all()
+                self.assertEqual(len(steps), 7)
+
+                step = next(
+                    current
+                    for current in steps
+                    if current.output_path == os.path.join(root, "calc3")
+                )
+                assert step.system is not None and step.host is not None
+                self.assertEqual(step.system.name, "calc3")
+                self.assertEqual(step.host.name, "cluster")
+                self.assertEqual(step.properties, {"program": "dummy"})
+                self.assertEqual(
+                    {result.kind: result.data for result in step.results}["Energy"],
+                    -4.5,
+                )
+                self.assertEqual(
+                    get_collection_result(session, "Occupations", step), [2, 2, 1]
+                )
+
+                # Records that parse fine but can't be written only affect their own directory
+                def parse_unsupported(directory: str):
+                    record = parse_energy_output(directory)
+                    if record is not None and directory.endswith("calc1"):
+                        return record._replace(results={"Energy": {"unsupported": 1}})
+                    return record
+
+                unsupported = Project(name="UnsupportedIngestion")
+                for expected_ingested in (6, 0):
+                    report = ingest_directories(
+                        session,
+                        unsupported,
+                        directories,
+                        parsers=[parse_unsupported],
+                        processes=1,
+                        batch_size=3,
+                    )
+                    self.assertEqual(report.ingested, expected_ingested)
+                    self.assertEqual(
+                        sorted(report.failures),
+                        [os.path.join(root, "broken"), os.path.join(root, "calc1")],
+                    )
+                    self.assertIn(
+                        "Unsupported data type",
+                        report.failures[os.path.join(root, "calc1")],
+                    )
+
+                self.assertEqual(
+                    session.scalar(
+                        select(func.count())
+                        .select_from(ProcessingStep)
+                        .where(ProcessingStep.project == unsupported)
+                    ),
+                    6,
+                )
+
+    def test_write_broker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = sqlalchemy.create_engine(
+                "sqlite:///%s" % os.path.join(directory, "broker.sqlite")
+            )
+            configure_sqlite_engine(engine, "safe")
+            Base.metadata.create_all(engine)
+            Session = sqlalchemy.orm.sessionmaker(bind=engine)
+
+            socket_path = os.path.join(directory, "broker.socket")
+            step_ids = []
+            errors = []
+
+            def produce(producer: int):
+                try:
+                    with BrokerClient(socket_path, timeout=30) as client:
+                        for i in range(5):
+                            step_ids.extend(
+                                client.submit(
+                                    "BrokerExample",
+                                    [
+                                        ParsedStep(
+                                            kind="Job",
+                                            results={
+                                                "Energy": -1.0 * i,
+                                                "Ranks": [1, 2],
+                                            },
+                                            properties={"producer": str(producer)},
+                                            system=("Water", None),
+                                        )
+                                    ]
+                                    * 2,
+                                )
+                            )
+                except Exception as error:
+                    errors.append(error)
+
+            with WriteBroker(socket_path, Session, max_delay=0.05) as broker:
+                producers = [
+                    threading.Thread(target=produce, args=(i,)) for i in range(8)
+                ]
+                for producer in producers:
+                    producer.start()
+                for producer in producers:
+                    producer.join()
+
+                with BrokerClient(socket_path) as client:
+                    with self.assertRaises(RuntimeError):
+                        client.submit("BrokerExample", [ParsedStep("Job", {"Bad": {}})])
+                    # The connection is still usable after a rejected submission
+                    self.assertEqual(
+                        len(client.submit("BrokerExample", [ParsedStep("Job")])), 1
+                    )
+
+                with self.assertRaises(RuntimeError):
+                    WriteBroker(socket_path, Session).start()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(len(set(step_ids)), 80)
+            self.assertFalse(os.path.exists(socket_path))
+
+            statistics = broker.statistics()
+            self.assertEqual(statistics["steps"], 81)
+            self.assertEqual(statistics["failures"], 1)
+            # Concurrent submissions are coalesced into shared transactions
+            self.assertLess(statistics["transactions"], statistics["submissions"])
+
+            with Session() as session:
+                self.assertEqual(
+                    session.scalar(select(func.count()).select_from(ProcessingStep)),
+                    81,
+                )
+                self.assertEqual(
+                    session.scalar(
+                        select(func.count())
+                        .select_from(Result)
+                        .where(Result.kind == "Energy")
+                    ),
+                    80,
+                )
+                self.assertEqual(
+                    session.scalar(select(func.count()).select_from(System)), 1
+                )
+
+            # Many clients can connect at once (more than the default listen backlog)
+            def connect_and_submit():
+                try:
+                    with BrokerClient(socket_path, timeout=30) as client:
+                        client.submit("BurstExample", [ParsedStep("Job")])
+                except Exception as error:
+                    errors.append(error)
+
+            with WriteBroker(socket_path, Session):
+                clients = [
+                    threading.Thread(target=connect_and_submit) for _ in range(64)
+                ]
+                for client in clients:
+                    client.start()
+                for client in clients:
+                    client.join()
+
+            self.assertEqual(errors, [])
+
+            # Failures of the writer itself are reported to the clients instead of leaving them waiting
+            class UnavailableSession(sqlalchemy.orm.Session):
+                def __init__(self, *args, **kwargs):
+                    raise RuntimeError("Database unavailable")
+
+            with WriteBroker(
+                socket_path, sqlalchemy.orm.sessionmaker(class_=UnavailableSession)
+            ):
+                with BrokerClient(socket_path, timeout=30) as client:
+                    with self.assertRaisesRegex(RuntimeError, "Database unavailable"):
+                        client.submit("BrokerExample", [ParsedStep("Job")])
+
+            engine.dispose()
+
+    async def _use_async_session(self, session):
+        async with session:
+            system = await get_or_create_system_async(session, "Benzene")
+            hosts = await get_or_create_hosts_async(session, ["node1", "node2"])
+            step = ProcessingStep(
+                kind="AsyncExample",
+                project=Project(name="AsyncProject"),
+                system=system,
+                host=hosts["node2"],
+            )
+            session.add(step)
+
+            await insert_collection_result_async(
+                session, "Gradient", step, [[0.5, 1.5], [2.5, 3.5]]
+            )
+            await session.commit()
+
+            self.assertEqual(
+                await get_collection_result_async(session, "Gradient", step),
+                [[0.5, 1.5], [2.5, 3.5]],
+            )
+            self.assertEqual(
+                await session.scalar(
+                    select(func.count())
+                    .select_from(ProcessingStep)
+                    .where(ProcessingStep.kind == "AsyncExample")
+                ),
+                1,
+            )
+            self.assertEqual(
+                (await session.scalars(select(Host.name).order_by(Host.name))).all(),
+                ["node1", "node2"],
+            )
+
+    def test_threaded_async_session(self):
+        async def run(path):
+            session = await open_async_database(path, offload_to_thread=True)
+            self.assertIsInstance(session, ThreadedAsyncSession)
+            await self._use_async_session(session)
+
+            # Independent sessions make progress concurrently
+            async def count(_):
+                async with await open_async_database(
+                    path, offload_to_thread=True
+                ) as session:
+                    return await session.scalar(
+                        select(func.count()).select_from(System)
+                    )
+
+            self.assertEqual(await asyncio.gather(*map(count, range(10))), [1] * 10)
+
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                asyncio.run(run(os.path.join(directory, "async_test")))
+            finally:
+                dispose_engines()
+
+    @unittest.skipIf(
+        not async_driver_available(), "aiosqlite and greenlet are not available"
+    )
+    def test_async_session(self):
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        async def run(path):
+            session = await open_async_database(path, offload_to_thread=False)
+            self.assertIsInstance(session, AsyncSession)
+            await self._use_async_session(session)
+            await dispose_async_engines()
+
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                asyncio.run(run(os.path.join(directory, "async_test")))
+            finally:
+                dispose_engines()
+
+    def test_loading_profiles(self):
+        def create_project(name: str, n_steps: int) -> None:
+            with self.Session() as session:
+                project = Project(name=name)
+                for i in range(n_steps):
+                    step = ProcessingStep(
+                        kind="Loading",
+                        project=project,
+                        host=Host(name="%s host %d" % (name, i)),
+                        system=System(name="%s system %d" % (name, i)),
+                        keywords={Keyword(name="%s keyword %d" % (name, i))},
+                        properties={"index": str(i)},
+                    )
+                    result = Result(kind="Energy", data=float(i), processing_step=step)
+                    result.properties = {"unit": "Hartree"}
+                session.add(project)
+                session.commit()
+
+        def load_tree(name: str) -> int:
+            """Loads the entire project and returns the number of executed statements"""
+            with self.Session() as session:
+                statistics = enable_query_statistics(session)
+
+                project = session.scalars(
+                    with_loading_profile(
+                        select(Project).where(Project.name == name), "step-full"
+                    )
+                ).one()
+                for step in project.processing_steps:
+                    self.assertIsNotNone(step.host.name)
+                    self.assertIsNotNone(step.system.name)
+                    self.assertEqual(len(step.keywords), 1)
+                    self.assertEqual(step.properties["index"][0], step.host.name[-1])
+                    for result in step.results:
+                        self.assertEqual(result.properties["unit"], "Hartree")
+                        self.assertIsNone(result.collection)
+
+                self.assertEqual(statistics.by_lazy_load, {})
+                return statistics.total.statements
+
+        create_project("Small loading profile project", 2)
+        create_project("Large loading profile project", 8)
+        self.assertEqual(
+            load_tree("Small loading profile project"),
+            load_tree("Large loading profile project"),
+        )
+
+        with self.Session() as session:
+            statistics = enable_query_statistics(session)
+            steps = session.scalars(
+                select(ProcessingStep)
+                .where(ProcessingStep.kind == "Loading")
+                .options(*loading_options("results-with-properties", ProcessingStep))
+            ).all()
+            self.assertEqual(len(steps), 10)
+            for step in steps:
+                self.assertEqual(
+                    [result.properties["unit"] for result in step.results],
+                    ["Hartree"],
+                )
+            self.assertEqual(statistics.by_lazy_load, {})
+
+        register_loading_profile("step-hosts", ProcessingStep, ["host"])
+        self.assertEqual(len(loading_options("step-hosts", Project)), 2)
+
+        with self.assertRaises(RuntimeError):
+            register_loading_profile("invalid", ProcessingStep, ["hosts"])
+        with self.assertRaises(RuntimeError):
+            loading_options("nonexistent")
+        with self.assertRaises(RuntimeError):
+            loading_options("step-full", Host)
+
+    def test_query_statistics(self):
+        with self.Session() as session:
+            project = Project(name="Instrumentation")
+            for i in range(3):
+                step = ProcessingStep(kind="Instrumented", project=project)
+                insert_collection_result(session, "Instrumented", step, [i, i + 1])
+            session.add(project)
+            session.commit()
+
+        with self.Session() as session:
+            self.assertIsNone(get_query_statistics(session))
+            statistics = enable_query_statistics(
+                session, QueryStatistics(slow_query_threshold=0, explain=True)
+            )
+            self.assertIs(enable_query_statistics(session), statistics)
+
+            with self.assertLogs("data_manager.queries", "WARNING") as logs:
+                steps = session.scalars(
+                    select(ProcessingStep).where(ProcessingStep.kind == "Instrumented")
+                ).all()
+                for step in steps:
+                    self.assertEqual(len(step.results), 2)
+                self.assertEqual(
+                    get_collection_result(session, "Instrumented", steps[-1]), [2, 3]
+                )
+            self.assertEqual(len(logs.output), 6)
+
+            # One lazy load per step
+            lazy_loads = statistics.by_lazy_load["ProcessingStep.results"]
+            self.assertEqual(lazy_loads.statements, 3)
+            self.assertEqual(lazy_loads.rows, 6)
+
+            helper = statistics.by_helper[
+                "data_manager.utils.results.get_collection_result"
+            ]
+            # The collection and its two elements
+            self.assertEqual(helper.statements, 2)
+            self.assertEqual(helper.rows, 3)
+            self.assertEqual(statistics.by_helper["<application>"].statements, 4)
+            self.assertEqual(statistics.total.statements, 6)
+
+            self.assertEqual(len(statistics.slow_queries), 6)
+            self.assertTrue(all(query.plan for query in statistics.slow_queries))
+            self.assertEqual(
+                statistics.slow_queries[1].lazy_load, "ProcessingStep.results"
+            )
+
+            report = statistics.statistics()
+            self.assertEqual(report["statements"], 6)
+            self.assertIn("ProcessingStep.results", statistics.summary())
+
+            self.assertIs(disable_query_statistics(session), statistics)
+            session.scalars(select(Project)).all()
+            self.assertEqual(statistics.total.statements, 6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "instrumentation_test")
+            shared = QueryStatistics()
+
+            output = io.StringIO()
+            with contextlib.redirect_stderr(output):
+                for _ in range(2):
+                    with open_database(path, instrument=shared) as session:
+                        session.scalars(select(Project)).all()
+                    session.close()
+
+            self.assertEqual(shared.total.statements, 2)
+            # One report per session
+            self.assertEqual(output.getvalue().count("Query statistics"), 2)
+
+            with open_database(path) as session:
+                self.assertIsNone(get_query_statistics(session))
+
+            dispose_engines()
+
+    def test_open_database_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile_test")
+
+            with open_database(path, profile="bulk-ingest") as session:
+                connection = session.connection()
+                self.assertEqual(
+                    connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal"
+                )
+                self.assertEqual(
+                    connection.exec_driver_sql("PRAGMA synchronous").scalar(), 0
+                )
+                self.assertEqual(
+                    connection.exec_driver_sql("PRAGMA foreign_keys").scalar(), 1
+                )
+
+            with self.assertRaises(RuntimeError):
+                open_database(path, profile="nonexistent")
+
+            dispose_engines()
+
+    def test_engine_reuse(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reuse_test")
+
+            with open_database(path) as first, open_database(
+                path + ".sqlite"
+            ) as second:
+                self.assertIs(first.get_bind(), second.get_bind())
+
+            self.assertIs(get_sessionmaker(path), get_sessionmaker(path))
+            self.assertIsNot(
+                get_sessionmaker(path), get_sessionmaker(path, pool_size=2)
+            )
+
+            with self.assertRaises(RuntimeError):
+                open_database(
+                    os.path.join(directory, "missing"), create_as_needed=False
+                )
+
+            # Deleting or replacing the database file invalidates the cached engine
+            original = get_sessionmaker(path)
+            with original() as session:
+                session.add(Project(name="Original"))
+                session.commit()
+
+            os.remove(path + ".sqlite")
+            with self.assertRaises(RuntimeError):
+                get_sessionmaker(path, create_as_needed=False)
+
+            recreated = get_sessionmaker(path)
+            self.assertIsNot(recreated, original)
+            with recreated() as session:
+                self.assertEqual(session.scalars(select(Project.name)).all(), [])
+                session.add(Project(name="Recreated"))
+                session.commit()
+
+            self.assertIs(get_sessionmaker(path), recreated)
+            with get_sessionmaker(path)() as session:
+                self.assertEqual(
+                    session.scalars(select(Project.name)).all(), ["Recreated"]
+                )
+
+            dispose_engines()
+
+    def test_aggregate_results(self):
+        with self.Session() as session:
+            project = Project(name="Aggregates")
+            water = System(name="Water")
+            ammonia = System(name="Ammonia")
+            host = Host(name="Cluster")
+
+            energies = {water: [-76.3, -76.4, -76.1], ammonia: [-56.5, -56.2]}
+            for system, values in energies.items():
+                for value in values:
+                    step = ProcessingStep(
+                        kind="AggregateSP", project=project, system=system, host=host
+                    )
+                    session.add(
+                        Result(kind="AggregateEnergy", processing_step=step, data=value)
+                    )
+
+            step = ProcessingStep(kind="AggregateOpt", project=project, system=water)
+            session.add(
+                Result(kind="AggregateEnergy", processing_step=step, data=-76.5)
+            )
+            session.add(
+                Result(kind="AggregateEnergy", processing_step=step, data="n/a")
+            )
+            session.add(Result(kind="AggregateCount", processing_step=step, data=3))
+
+            session.commit()
+
+            self.assertEqual(
+                aggregate_results(session, "AggregateEnergy", "min", group_by="system"),
+                {water.id: -76.5, ammonia.id: -56.5},
+            )
+            self.assertEqual(
+                aggregate_results(
+                    session, "AggregateEnergy", "count", group_by="step_kind"
+                ),
+                {"AggregateSP": 5, "AggregateOpt": 1},
+            )
+            self.assertEqual(
+                aggregate_results(session, "AggregateEnergy", "max", group_by="host"),
+                {host.id: -56.2, None: -76.5},
+            )
+            self.assertEqual(aggregate_results(session, "AggregateEnergy", "count"), 6)
+            self.assertEqual(aggregate_results(session, "AggregateCount", "sum"), 3)
+            self.assertIsNone(aggregate_results(session, "Nonexistent", "max"))
+
+            with self.assertRaises(RuntimeError):
+                aggregate_results(session, "AggregateEnergy", "median")
+            with self.assertRaises(RuntimeError):
+                aggregate_results(session, "AggregateEnergy", "min", group_by="author")
+
+    def test_upgrade_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = sqlalchemy.create_engine(
+                "sqlite:///%s" % os.path.join(directory, "old.sqlite")
+            )
+            Base.metadata.create_all(engine)
+
+            # Turn the database into one created before blobs, numeric columns, typed properties and step closures
+            # existed
+            with engine.begin() as connection:
+                for statement in [
+                    "DROP INDEX ix_results_kind_number",
+                    "ALTER TABLE results DROP COLUMN _data_number",
+                    "ALTER TABLE results DROP COLUMN _data_blob",
+                    "DROP TABLE result_properties",
+                    "CREATE TABLE result_properties (result_id INTEGER NOT NULL, keyword VARCHAR NOT NULL, "
+                    + "value VARCHAR NOT NULL, PRIMARY KEY (result_id, keyword), "
+                    + "FOREIGN KEY(result_id) REFERENCES results (id) ON DELETE CASCADE ON UPDATE CASCADE)",
+                    "DROP TABLE processing_step_closure",
+                    "DROP TABLE system_properties",
+                    "CREATE TABLE system_properties (system_id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+                    + "value VARCHAR NOT NULL, value_type VARCHAR DEFAULT 'str' NOT NULL, numeric_value FLOAT, "
+                    + "PRIMARY KEY (system_id, name), FOREIGN KEY(system_id) REFERENCES systems (id))",
+                    "CREATE INDEX ix_system_properties_name_value ON system_properties (name, value)",
+                    "DROP TABLE property_strings",
+                    "INSERT INTO systems (id, name) VALUES (1, 'Water')",
+                    "INSERT INTO system_properties (system_id, name, value, value_type, numeric_value) VALUES "
+                    + "(1, 'charge', '0', 'int', 0.0)",
+                    "INSERT INTO projects (id, name) VALUES (1, 'Old')",
+                    "INSERT INTO processing_steps (id, kind, project_id) VALUES (1, 'Old', 1)",
+                    "INSERT INTO results (id, processing_step_id, kind, _data_type, _data_value) VALUES "
+                    + "(1, 1, 'Energy', 'float', '-1.5'), (2, 1, 'Energy', 'int', '3'), "
+                    + "(3, 1, 'Energy', 'str', '4'), (4, 1, 'Energy', 'float', 'nan')",
+                    "INSERT INTO result_properties (result_id, keyword, value) VALUES "
+                    + "(1, 'basis', 'cc-pVDZ'), (1, 'cardinality', '2')",
+                ]:
+                    connection.exec_driver_sql(statement)
+
+            # Outdated databases are only upgraded on request
+            self.assertTrue(needs_upgrade(engine))
+            with self.assertRaises(RuntimeError):
+                open_database(os.path.join(directory, "old"))
+
+            # Backfills are done in batches of two rows
+            changes = upgrade_database(engine, batch_size=2)
+            self.assertIn("Filled in '_data_number' of table 'results'", changes)
+            self.assertIn(
+                "Created index 'ix_results_kind_number' on table 'results'", changes
+            )
+            self.assertFalse(needs_upgrade(engine))
+            self.assertEqual(upgrade_database(engine), [])
+
+            # Upgrades interrupted while filling in a column are resumed (the column's index is missing until then)
+            with engine.begin() as connection:
+                connection.exec_driver_sql("DROP INDEX ix_results_kind_number")
+                connection.exec_driver_sql(
+                    "UPDATE results SET _data_number = NULL WHERE id > 1"
+                )
+            self.assertEqual(
+                upgrade_database(engine),
+                [
+                    "Filled in '_data_number' of table 'results'",
+                    "Created index 'ix_results_kind_number' on table 'results'",
+                ],
+            )
+
+            with sqlalchemy.orm.Session(engine) as session:
+                self.assertEqual(aggregate_results(session, "Energy", "min"), -1.5)
+                self.assertEqual(aggregate_results(session, "Energy", "count"), 2)
+                self.assertEqual(
+                    session.scalars(
+                        select(Result.id).where(
+                            property_in_range(Result, "cardinality", 1, 3)
+                        )
+                    ).all(),
+                    [1],
+                )
+                result = session.get(Result, 1)
+                system = session.get(System, 1)
+                assert result is not None and system is not None
+                self.assertEqual(
+                    result.properties, {"basis": "cc-pVDZ", "cardinality": "2"}
+                )
+                self.assertEqual(system._properties["charge"].typed_value, 0)
+                self.assertEqual(result.data, -1.5)
+                self.assertEqual(lookup_ancestors(session, 1), {})
+
+            engine.dispose()
+
+    def test_bulk_get_or_create(self):
+        with self.Session() as session:
+            existing_host = get_or_create_host(session, "BulkHost1")
+            session.add(System(name="BulkWater", variant="cc-pVDZ"))
+            session.add(Keyword(name="BulkKeyword1"))
+            session.commit()
+
+            hosts = get_or_create_hosts(
+                session, ["BulkHost1", "BulkHost2", "BulkHost3", "BulkHost2"]
+            )
+            self.assertEqual(set(hosts), {"BulkHost1", "BulkHost2", "BulkHost3"})
+            self.assertIs(hosts["BulkHost1"], existing_host)
+            self.assertTrue(all(host.id is not None for host in hosts.values()))
+            self.assertEqual(
+                get_or_create_hosts(session, ["BulkHost2", "BulkHost3"]),
+                {
+                    "BulkHost2": hosts["BulkHost2"],
+                    "BulkHost3": hosts["BulkHost3"],
+                },
+            )
+
+            systems = get_or_create_systems(
+                session,
+                ["BulkWater", ("BulkWater", "cc-pVDZ"), ("BulkWater", "cc-pVTZ")],
+            )
+            # Without a variant, the existing system is found
+            self.assertIs(
+                systems[("BulkWater", None)], systems[("BulkWater", "cc-pVDZ")]
+            )
+            self.assertEqual(systems[("BulkWater", "cc-pVTZ")].variant, "cc-pVTZ")
+            with self.assertRaises(RuntimeError):
+                get_or_create_systems(session, ["BulkWater"])
+
+            keywords = get_or_create_keywords(session, ["BulkKeyword1", "BulkKeyword2"])
+            self.assertEqual(
+                {name: keyword.name for name, keyword in keywords.items()},
+                {"BulkKeyword1": "BulkKeyword1", "BulkKeyword2": "BulkKeyword2"},
+            )
+
+            authors = get_or_create_authors(session, [("BulkAuthor", "Uni")])
+            projects = get_or_create_projects(session, ["BulkProject"])
+            session.commit()
+
+            self.assertEqual(
+                session.scalars(
+                    select(Author.id).where(Author.name == "BulkAuthor")
+                ).all(),
+                [authors[("BulkAuthor", "Uni")].id],
+            )
+            self.assertEqual(
+                session.scalars(
+                    select(Project.id).where(Project.name == "BulkProject")
+                ).all(),
+                [projects["BulkProject"].id],
+            )
+
+    def test_lookup_cache(self):
+        with self.Session() as session:
+            self.assertIsNone(get_lookup_cache(session))
+            cache = enable_lookup_cache(session, max_size=2)
+            self.assertIs(enable_lookup_cache(session), cache)
+
+            statements = []
+
+            def record_statement(connection, cursor, statement, *args):
+                statements.append(statement)
+
+            # Pending objects are served from the cache as well
+            host = get_or_create_host(session, "CachedHost")
+            self.assertIs(get_or_create_host(session, "CachedHost"), host)
+            session.commit()
+
+            event.listen(self.engine, "before_cursor_execute", record_statement)
+            self.assertIs(get_or_create_host(session, "CachedHost"), host)
+            event.remove(self.engine, "before_cursor_execute", record_statement)
+            self.assertEqual(statements, [])
+
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+            # Least recently used entries are evicted
+            water = get_or_create_system(session, "CachedWater")
+            get_or_create_system(session, "CachedAmmonia", "def2-SVP")
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.evictions, 1)
+            self.assertIs(get_or_create_system(session, "CachedWater"), water)
+
+            # Rolling back discards pending objects and thus also the cache's contents
+            session.rollback()
+            self.assertEqual(len(cache), 0)
+            self.assertIsNot(get_or_create_system(session, "CachedWater"), water)
+
+            session.delete(get_or_create_host(session, "CachedHost"))
+            session.flush()
+            self.assertEqual(len(cache), 1)
+
+            disable_lookup_cache(session)
+            self.assertIsNone(get_lookup_cache(session))
+            # The cache's event listeners are removed as well
+            self.assertFalse(session.dispatch.after_soft_rollback)
+            self.assertFalse(session.dispatch.persistent_to_deleted)
+
+    def test_step_provenance(self):
+        with self.Session() as session:
+            project = Project(name="Provenance")
+            geometry = ProcessingStep(kind="Geometry", project=project)
+            hf = ProcessingStep(kind="RHF", project=project, preceding_steps={geometry})
+            ccsd = ProcessingStep(
+                kind="CCSD", project=project, preceding_steps={hf, geometry}
+            )
+            triples = ProcessingStep(
+                kind="(T)", project=project, preceding_steps={ccsd}
+            )
+            mp2 = ProcessingStep(kind="MP2", project=project, preceding_steps={hf})
+            session.add(project)
+            session.commit()
+
+            ancestors = get_ancestors(session, triples)
+            self.assertEqual(set(ancestors.steps), {ccsd.id, hf.id, geometry.id})
+            self.assertEqual(ancestors.depths, {ccsd.id: 1, hf.id: 2, geometry.id: 2})
+            self.assertEqual(
+                ancestors.edges,
+                {
+                    (ccsd.id, triples.id),
+                    (hf.id, ccsd.id),
+                    (geometry.id, ccsd.id),
+                    (geometry.id, hf.id),
+                },
+            )
+
+            limited = get_ancestors(session, triples.id, max_depth=1)
+            self.assertEqual(set(limited.steps), {ccsd.id})
+            self.assertEqual(limited.edges, {(ccsd.id, triples.id)})
+
+            self.assertEqual(len(get_ancestors(session, triples, max_depth=0).edges), 0)
+
+            descendants = get_descendants(session, geometry, kinds=["CCSD", "MP2"])
+            self.assertEqual(set(descendants.steps), {ccsd.id, mp2.id})
+            self.assertEqual(descendants.depths, {ccsd.id: 1, mp2.id: 2})
+            self.assertEqual(len(descendants.edges), 5)
+
+    def test_step_closure(self):
+        with self.Session() as session:
+            maintain_step_closure(session)
+
+            project = Project(name="Closure")
+            geometry = ProcessingStep(kind="Geometry", project=project)
+            hf = ProcessingStep(kind="RHF", project=project, preceding_steps={geometry})
+            ccsd = ProcessingStep(kind="CCSD", project=project, preceding_steps={hf})
+            triples = ProcessingStep(kind="(T)", project=project)
+            ccsd.dependent_steps.add(triples)
+            session.add(project)
+            session.commit()
+
+            self.assertTrue(depends_on(session, triples, geometry))
+            self.assertFalse(depends_on(session, geometry, triples))
+            self.assertEqual(
+                lookup_descendants(session, geometry),
+                {hf.id: 1, ccsd.id: 2, triples.id: 3},
+            )
+
+            # Shortcut edge reduces the depth
+            triples.preceding_steps.add(geometry)
+            session.commit()
+            self.assertEqual(lookup_ancestors(session, triples)[geometry.id], 1)
+            self.assertEqual(
+                lookup_ancestors(session, triples, max_depth=1),
+                {geometry.id: 1, ccsd.id: 1},
+            )
+
+            # Cycles are rejected
+            geometry.preceding_steps.add(ccsd)
+            with self.assertRaises(RuntimeError):
+                session.commit()
+            session.rollback()
+
+            # Removing edges and deleting steps updates the closure
+            triples.preceding_steps.remove(geometry)
+            session.commit()
+            self.assertEqual(lookup_ancestors(session, triples)[geometry.id], 3)
+
+            session.delete(hf)
+            session.commit()
+            self.assertFalse(depends_on(session, ccsd, geometry))
+            self.assertEqual(lookup_ancestors(session, triples), {ccsd.id: 1})
+
+            expected = {
+                step_id: lookup_ancestors(session, step_id)
+                for step_id in [geometry.id, ccsd.id, triples.id]
+            }
+            rebuild_step_closure(session)
+            for step_id, ancestors in expected.items():
+                self.assertEqual(lookup_ancestors(session, step_id), ancestors)
+
+        # Deleted steps are also removed from the closure if SQLite doesn't enforce foreign keys
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        Session = sqlalchemy.orm.sessionmaker(bind=engine)
+        maintain_step_closure(Session)
+
+        with Session() as session:
+            project = Project(name="Unenforced")
+            first = ProcessingStep(kind="First", project=project)
+            second = ProcessingStep(
+                kind="Second", project=project, preceding_steps={first}
+            )
+            third = ProcessingStep(
+                kind="Third", project=project, preceding_steps={second}
+            )
+            session.add(project)
+            session.commit()
+            step_ids = (first.id, second.id, third.id)
+
+        with Session() as session:
+            session.delete(session.get(ProcessingStep, step_ids[1]))
+            session.commit()
+
+            self.assertEqual(lookup_descendants(session, step_ids[0]), {})
+            self.assertEqual(lookup_ancestors(session, step_ids[2]), {})
+            self.assertEqual(lookup_ancestors(session, step_ids[1]), {})
+
+        engine.dispose()
+
+    def test_bulk_properties(self):
+        with self.Session() as session:
+            project = Project(name="Bulk properties")
+            step = ProcessingStep(kind="BulkProperties", project=project)
+            results = [
+                Result(kind="BulkProperties", data=i, processing_step=step)
+                for i in range(4)
+            ]
+            results[0].properties = {"unit": "Hartree", "order": 2}
+            results[1].properties = {"unit": "eV"}
+            results[2].properties = {"converged": True}
+            session.add(project)
+
+            lithium = System(name="Lithium bulk properties")
+            lithium.properties["charge"] = 1
+            session.add(lithium)
+            session.commit()
+
+            ids = [result.id for result in results]
+
+            properties = get_properties(session, Result, results)
+            self.assertEqual(list(properties), ids)
+            self.assertEqual(properties[ids[0]], {"unit": "Hartree", "order": "2"})
+            self.assertEqual(properties[ids[3]], {})
+            self.assertEqual(
+                get_properties(session, Result, ids[1:3], typed=True),
+                {ids[1]: {"unit": "eV"}, ids[2]: {"converged": True}},
+            )
+            self.assertEqual(
+                get_properties(session, Result, ids, keys=["order"])[ids[0]],
+                {"order": "2"},
+            )
+
+            by_query = get_properties(
+                session,
+                Result,
+                select(Result.id).where(Result.kind == "BulkProperties"),
+                typed=True,
+            )
+            self.assertEqual(set(by_query), set(ids))
+            self.assertEqual(by_query[ids[0]], {"unit": "Hartree", "order": 2})
+            self.assertEqual(by_query[ids[3]], {})
+
+            self.assertEqual(
+                get_properties(session, System, [lithium.id], typed=True),
+                {lithium.id: {"charge": 1}},
+            )
+
+            table = get_property_table(session, Result, ids)
+            self.assertEqual(table.ids, ids)
+            self.assertEqual(list(table.columns), ["converged", "order", "unit"])
+            self.assertEqual(table.columns["unit"], ["Hartree", "eV", None, None])
+            self.assertEqual(
+                get_property_table(session, Result, ids, keys=["unit"]).columns,
+                {"unit": ["Hartree", "eV", None, None]},
+            )
+
+            metadata = property_metadata(results[0])
+            self.assertIs(metadata, property_metadata(Result))
+            self.assertIs(metadata.property_cls, ResultProperty)
+
+    def test_typed_properties(self):
+        with self.Session() as session:
+            project = Project(name="Typed properties")
+            for cardinality, temperature in [(2, 150.0), (3, 250.5), ("4", 298.15)]:
+                step = ProcessingStep(kind="TypedExample", project=project)
+                step.properties["cardinality"] = cardinality
+                step.properties["temperature"] = temperature
+                step.properties["basis"] = "cc-pV%sZ" % cardinality
+            session.add(project)
+
+            water = System(name="Water")
+            water.properties["charge"] = 0
+            session.add(water)
+            session.commit()
+
+            def matching(condition):
+                return {
+                    step.properties["cardinality"]
+                    for step in session.scalars(
+                        select(ProcessingStep)
+                        .where(ProcessingStep.kind == "TypedExample")
+                        .where(condition)
+                    )
+                }
+
+            self.assertEqual(
+                matching(property_compares(ProcessingStep, "cardinality", ">=", 3)),
+                {"3", "4"},
+            )
+            self.assertEqual(
+                matching(property_compares(ProcessingStep, "basis", "==", "cc-pV3Z")),
+                {"3"},
+            )
+            self.assertEqual(
+                matching(property_in_range(ProcessingStep, "temperature", 200, 300)),
+                {"3", "4"},
+            )
+            self.assertEqual(
+                matching(property_in_range(ProcessingStep, "temperature", maximum=200)),
+                {"2"},
+            )
+
+            step = session.scalars(
+                select(ProcessingStep)
+                .where(ProcessingStep.kind == "TypedExample")
+                .where(has_properties(ProcessingStep, cardinality=2))
+            ).one()
+            self.assertEqual(step._properties["cardinality"].typed_value, 2)
+            self.assertEqual(step._properties["temperature"].typed_value, 150.0)
+            self.assertEqual(step._properties["basis"].typed_value, "cc-pV2Z")
+
+            self.assertIn("charge", get_property_keys(session, System))
+            self.assertEqual(
+                session.scalars(
+                    select(System).where(property_compares(System, "charge", "==", 0))
+                ).one(),
+                water,
+            )
+
+    def test_property_filters(self):
+        with self.Session() as session:
+            project = Project(name="Filters")
+            for cardinality, method in [(2, "HF"), (3, "HF"), (3, "CCSD"), (4, "CCSD")]:
+                step = ProcessingStep(kind="FilterExample", project=project)
+                step.properties["cardinality"] = cardinality
+                step.properties["method"] = method
+                step.properties["label"] = "%s/%d" % (method, cardinality)
+            ProcessingStep(kind="FilterExample", project=project)
+            session.add(project)
+            session.commit()
+
+            def matching(filter):
+                return {
+                    step.properties.get("label")
+                    for step in session.scalars(
+                        select(ProcessingStep)
+                        .where(ProcessingStep.kind == "FilterExample")
+                        .where(compile_property_filter(ProcessingStep, filter))
+                    )
+                }
+
+            cardinality = PropertyKey("cardinality")
+            method = PropertyKey("method")
+
+            self.assertEqual(matching((cardinality >= 3) & (method == "HF")), {"HF/3"})
+            self.assertEqual(
+                matching((cardinality == 2) | (method == "CCSD")),
+                {"HF/2", "CCSD/3", "CCSD/4"},
+            )
+            self.assertEqual(matching(~(method == "HF")), {"CCSD/3", "CCSD/4", None})
+            self.assertEqual(
+                matching(cardinality.between(3, 4) & ~(method == "CCSD")),
+                {"HF/3"},
+            )
+            self.assertEqual(matching(~cardinality.exists()), {None})
+
+            # Equivalent to has_properties
+            self.assertEqual(
+                matching((method == "CCSD") & (cardinality == 3)),
+                {
+                    step.properties["label"]
+                    for step in session.scalars(
+                        select(ProcessingStep)
+                        .where(ProcessingStep.kind == "FilterExample")
+                        .where(
+                            has_properties(ProcessingStep, method="CCSD", cardinality=3)
+                        )
+                    )
+                },
+            )
+
 
 if __name__ == "__main__":
     unittest.main()